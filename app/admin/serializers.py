@@ -0,0 +1,48 @@
+from typing import List, Optional
+
+from pydantic import Field
+
+from core.serializers import CamelModel
+from user.serializers import Roles
+
+
+class Snapshot(CamelModel):
+    name: str
+    created_at: str
+    size: int
+    compressed_size: int
+    sha256: str
+    database_sha256: str
+    steps: int
+    restarts: int
+    copy_seconds: float
+    seconds: float
+
+
+# usernames of one bulk operation, what sqlite binds in a single statement
+MAX_BULK_USERNAMES = 5000
+
+
+class BulkUsernames(CamelModel):
+    usernames: List[str] = Field(..., min_items=1, max_items=MAX_BULK_USERNAMES)
+
+
+class BulkDepositReset(CamelModel):
+    # the buyers matching the deposit filter when not given
+    usernames: Optional[List[str]] = Field(
+        None, min_items=1, max_items=MAX_BULK_USERNAMES
+    )
+    min_deposit: Optional[int] = None
+    max_deposit: Optional[int] = None
+
+
+class BulkRoleChange(BulkUsernames):
+    role: Roles
+
+    class Config:
+        use_enum_values = True
+
+
+class BulkOutcome(CamelModel):
+    username: str
+    outcome: str
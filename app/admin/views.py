@@ -0,0 +1,133 @@
+from typing import Dict, List
+
+from fastapi import Depends, HTTPException, APIRouter
+
+from admin.serializers import (
+    BulkDepositReset,
+    BulkOutcome,
+    BulkRoleChange,
+    BulkUsernames,
+    Snapshot,
+)
+from core.auth import require_admin, require_read_admin
+from core.backup import SnapshotError, create_snapshot, database_path, list_snapshots
+from core.repository import Repository
+from core.settings import settings
+from core.storage import get_repository
+
+router = APIRouter()
+
+
+@router.post("/admin/snapshots", response_model=Snapshot)
+def take_snapshot(
+    auth_user=Depends(require_read_admin),
+):
+    """
+    Snapshot the database while it keeps serving requests
+    :param auth_user: the logged admin
+    :return: the snapshot metadata
+    """
+    try:
+        return create_snapshot(
+            database_path(settings.database_url),
+            settings.snapshot_dir,
+            pages=settings.snapshot_pages,
+            pause=settings.snapshot_pause_seconds,
+        )
+    except SnapshotError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@router.get("/admin/snapshots", response_model=List[Snapshot])
+def read_snapshots(
+    auth_user=Depends(require_read_admin),
+):
+    """
+    Snapshots which can be restored, the oldest first
+    :param auth_user: the logged admin
+    :return: list of snapshot metadata
+    """
+    return list_snapshots(settings.snapshot_dir)
+
+
+def bulk_outcomes(outcomes: Dict[str, str]) -> List[BulkOutcome]:
+    return [
+        BulkOutcome(username=username, outcome=outcome)
+        for username, outcome in outcomes.items()
+    ]
+
+
+@router.post("/admin/users/delete", response_model=List[BulkOutcome])
+def remove_users(
+    bulk: BulkUsernames,
+    repo: Repository = Depends(get_repository),
+    auth_user=Depends(require_admin),
+):
+    """
+    Remove users in one transaction, the products of the sellers with them
+    :param bulk: usernames to remove
+    :param repo: users and products storage
+    :param auth_user: the logged admin
+    :return: outcome for every username, `deleted` or `not_found`
+    """
+    if auth_user.username in bulk.usernames:
+        raise HTTPException(
+            status_code=400, detail="Sorry but you can't remove yourself"
+        )
+
+    outcomes = repo.remove_users(list(dict.fromkeys(bulk.usernames)))
+    repo.commit()
+    return bulk_outcomes(outcomes)
+
+
+@router.put("/admin/users/reset", response_model=List[BulkOutcome])
+def reset_deposits(
+    bulk: BulkDepositReset,
+    repo: Repository = Depends(get_repository),
+    auth_user=Depends(require_admin),
+):
+    """
+    Reset the deposit of a list of buyers, or of the buyers matching a deposit
+    filter, to zero in one transaction
+    :param bulk: usernames or deposit filter
+    :param repo: users and products storage
+    :param auth_user: the logged admin
+    :return: outcome for every username, `reset`, `not_buyer` or `not_found`
+    """
+    if bulk.usernames is None and bulk.min_deposit is None and bulk.max_deposit is None:
+        raise HTTPException(
+            status_code=400, detail="Give the usernames or a deposit filter"
+        )
+
+    if bulk.usernames is not None:
+        outcomes = repo.reset_deposits(list(dict.fromkeys(bulk.usernames)))
+    else:
+        outcomes = repo.reset_deposits(
+            min_deposit=bulk.min_deposit, max_deposit=bulk.max_deposit
+        )
+    repo.commit()
+    return bulk_outcomes(outcomes)
+
+
+@router.put("/admin/users/role", response_model=List[BulkOutcome])
+def change_roles(
+    bulk: BulkRoleChange,
+    repo: Repository = Depends(get_repository),
+    auth_user=Depends(require_admin),
+):
+    """
+    Give the same role to some users in one transaction
+    :param bulk: usernames and their new role
+    :param repo: users and products storage
+    :param auth_user: the logged admin
+    :return: outcome for every username, `updated`, `unchanged` or `not_found`
+    """
+    # an admin demoting themselves could leave no admin behind
+    if bulk.role != "admin" and auth_user.username in bulk.usernames:
+        raise HTTPException(
+            status_code=400, detail="Sorry but you can't change your own role"
+        )
+
+    outcomes = repo.change_roles(list(dict.fromkeys(bulk.usernames)), bulk.role)
+    repo.commit()
+    return bulk_outcomes(outcomes)
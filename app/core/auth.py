@@ -0,0 +1,72 @@
+"""
+Authentication of the requests, as dependencies of the handlers.
+
+The credentials are checked once per request: FastAPI caches a dependency for the
+whole request, so every dependency below asking for `require_user` gets the same
+user. It is loaded through the repository of the request, `get_repository` is
+cached too, so with the database backend the user sits in the identity map of the
+handler's session and the `core.utils` helpers reuse it instead of loading it again.
+"""
+
+from fastapi import Depends, HTTPException
+from fastapi.security import HTTPBasic, HTTPBasicCredentials
+
+from core.repository import Repository
+from core.storage import get_read_repository, get_repository
+
+security = HTTPBasic()
+
+
+def _authenticate(repo: Repository, credentials: HTTPBasicCredentials):
+    auth_user = repo.authenticate_user(credentials.username, credentials.password)
+    if not auth_user[0]:
+        raise HTTPException(status_code=auth_user[1], detail=auth_user[2])
+    return auth_user[1]
+
+
+def require_user(
+    repo: Repository = Depends(get_repository),
+    credentials: HTTPBasicCredentials = Depends(security),
+):
+    """
+    The authenticated user, for the handlers writing with `get_repository`
+    :param repo: users and products storage
+    :param credentials: user credentials
+    :return: the user
+    """
+    return _authenticate(repo, credentials)
+
+
+def require_read_user(
+    repo: Repository = Depends(get_read_repository),
+    credentials: HTTPBasicCredentials = Depends(security),
+):
+    """
+    The authenticated user, for the read-only handlers using `get_read_repository`
+    :param repo: users and products storage
+    :param credentials: user credentials
+    :return: the user
+    """
+    return _authenticate(repo, credentials)
+
+
+def _check_role(user, role: str, detail: str):
+    if user.role != role:
+        raise HTTPException(status_code=400, detail=detail)
+    return user
+
+
+def require_buyer(user=Depends(require_user)):
+    return _check_role(user, "buyer", "You should be a buyer to access this endpoint")
+
+
+def require_seller(user=Depends(require_user)):
+    return _check_role(user, "seller", "You should be a seller to access this endpoint")
+
+
+def require_admin(user=Depends(require_user)):
+    return _check_role(user, "admin", "You should be admin to access this endpoint")
+
+
+def require_read_admin(user=Depends(require_read_user)):
+    return _check_role(user, "admin", "You should be admin to access this endpoint")
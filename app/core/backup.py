@@ -0,0 +1,262 @@
+"""
+Online snapshots of the sqlite database.
+
+The database is copied with the sqlite backup API a few pages at a time. The source
+is only locked while a step copies its pages, and the copy pauses between two
+steps, so the writers never wait for more than one step. A snapshot is gzipped and
+checksummed next to a JSON metadata file, and restored into a fresh file only.
+"""
+
+import fcntl
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy.engine import make_url
+
+SNAPSHOT_SUFFIX = ".db.gz"
+CHUNK_SIZE = 1024 * 1024
+
+
+class SnapshotError(Exception):
+    """
+    A snapshot couldn't be taken or restored
+    """
+
+
+def database_path(url: str) -> str:
+    """
+    File of a sqlite database url
+    :param url: database url
+    :return: the database file path
+    """
+    parsed = make_url(url)
+    in_memory = not parsed.database or parsed.database == ":memory:"
+    if parsed.get_backend_name() != "sqlite" or in_memory:
+        raise SnapshotError("Only sqlite database files can be snapshotted")
+    return parsed.database
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _integrity_check(path: str):
+    connection = sqlite3.connect(path)
+    try:
+        result = connection.execute("PRAGMA integrity_check").fetchone()[0]
+    finally:
+        connection.close()
+    if result != "ok":
+        raise SnapshotError(f"Integrity check of {path} failed: {result}")
+
+
+@contextmanager
+def _exclusive(directory: str):
+    """
+    One snapshot at a time per directory, whatever the process taking it
+    """
+    with open(os.path.join(directory, ".lock"), "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise SnapshotError("A snapshot is already running")
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class _Restarted(Exception):
+    pass
+
+
+def _copy(source: str, copy_path: str, pages: int, pause: float, max_restarts: int):
+    """
+    Copy a live database with the backup API
+    :return: steps and restarts of the copy
+    :raise SnapshotError: when the copy restarted more than `max_restarts` times
+    """
+    stats = {"steps": 0, "restarts": 0}
+    remaining_before = None
+
+    def progress(status, remaining, total):
+        nonlocal remaining_before
+        stats["steps"] += 1
+        if remaining_before is not None and remaining > remaining_before:
+            stats["restarts"] += 1
+            if stats["restarts"] > max_restarts:
+                raise _Restarted()
+        remaining_before = remaining
+        if remaining and pause:
+            time.sleep(pause)
+
+    source_connection = sqlite3.connect(source, isolation_level=None)
+    try:
+        wal = source_connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        if wal:
+            # copy the snapshot of a read transaction: with WAL it never blocks the
+            # writers, and their commits don't restart the copy
+            source_connection.execute("BEGIN")
+            source_connection.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        copy_connection = sqlite3.connect(copy_path)
+        try:
+            # a busy source is retried soon, not after the default quarter second
+            source_connection.backup(
+                copy_connection, pages=pages, progress=progress, sleep=0.005
+            )
+        except _Restarted:
+            # without WAL every commit of another connection restarts the copy,
+            # copying it in one step would make every writer wait for it
+            raise SnapshotError(
+                f"{source} kept changing during the copy, retry later or switch "
+                "it to WAL"
+            )
+        finally:
+            copy_connection.close()
+    finally:
+        source_connection.close()
+    return stats
+
+
+def create_snapshot(
+    source: str,
+    directory: str,
+    pages: int = 64,
+    pause: float = 0.002,
+    max_restarts: int = 3,
+) -> Dict[str, Any]:
+    """
+    Take a snapshot of a live database
+    :param source: database file
+    :param directory: where the snapshots are kept
+    :param pages: pages copied per step, the source is locked during a step
+    :param pause: seconds the copy waits between two steps
+    :param max_restarts: restarts of the copy before giving up, only happens when
+        the database isn't in WAL mode, see `core.models.create_schema`
+    :return: metadata of the snapshot
+    :raise SnapshotError: when another snapshot is running, or the database kept
+        changing
+    """
+    os.makedirs(directory, exist_ok=True)
+    with _exclusive(directory):
+        created_at = datetime.utcnow()
+        name = f"snapshot-{created_at:%Y%m%dT%H%M%S%fZ}"
+        started = time.perf_counter()
+        with tempfile.TemporaryDirectory(dir=directory) as workdir:
+            copy_path = os.path.join(workdir, "copy.db")
+            stats = _copy(source, copy_path, pages, pause, max_restarts)
+            copied = time.perf_counter()
+            _integrity_check(copy_path)
+            size = os.path.getsize(copy_path)
+            database_sha256 = _sha256(copy_path)
+
+            archive_path = os.path.join(workdir, "copy.db.gz")
+            with open(copy_path, "rb") as raw, gzip.open(archive_path, "wb") as archive:
+                shutil.copyfileobj(raw, archive, CHUNK_SIZE)
+            meta = {
+                "name": name,
+                "created_at": created_at.isoformat() + "Z",
+                "size": size,
+                "compressed_size": os.path.getsize(archive_path),
+                "sha256": _sha256(archive_path),
+                "database_sha256": database_sha256,
+                **stats,
+                "copy_seconds": round(copied - started, 4),
+                "seconds": round(time.perf_counter() - started, 4),
+            }
+            os.replace(archive_path, os.path.join(directory, name + SNAPSHOT_SUFFIX))
+        # the metadata is written last, a snapshot without it is incomplete
+        with open(os.path.join(directory, name + ".json"), "w") as file:
+            json.dump(meta, file)
+        return meta
+
+
+def list_snapshots(directory: str) -> List[Dict[str, Any]]:
+    """
+    Complete snapshots of a directory, the oldest first
+    :param directory: where the snapshots are kept
+    :return: metadata of every snapshot
+    """
+    if not os.path.isdir(directory):
+        return []
+    snapshots = []
+    for entry in sorted(os.listdir(directory)):
+        if entry.startswith("snapshot-") and entry.endswith(".json"):
+            with open(os.path.join(directory, entry)) as file:
+                snapshots.append(json.load(file))
+    return snapshots
+
+
+def find_snapshot(directory: str, at: Optional[datetime] = None) -> Dict[str, Any]:
+    """
+    Snapshot to restore the database as it was at some point in time
+    :param directory: where the snapshots are kept
+    :param at: UTC point in time, the latest snapshot when None
+    :return: metadata of the last snapshot taken at or before `at`
+    """
+    snapshots = list_snapshots(directory)
+    if at is not None:
+        limit = at.isoformat() + "Z"
+        snapshots = [meta for meta in snapshots if meta["created_at"] <= limit]
+    if not snapshots:
+        raise SnapshotError("No snapshot found")
+    return snapshots[-1]
+
+
+def restore_snapshot(directory: str, name: str, target: str) -> Dict[str, Any]:
+    """
+    Restore a snapshot into a new database file, after checking its checksums
+    :param directory: where the snapshots are kept
+    :param name: snapshot name
+    :param target: database file to create, it must not exist
+    :return: metadata of the restored snapshot
+    """
+    with open(os.path.join(directory, name + ".json")) as file:
+        meta = json.load(file)
+    archive_path = os.path.join(directory, name + SNAPSHOT_SUFFIX)
+    if _sha256(archive_path) != meta["sha256"]:
+        raise SnapshotError(f"Checksum mismatch of {archive_path}")
+    if os.path.exists(target):
+        raise SnapshotError(f"{target} already exists")
+
+    partial = target + ".partial"
+    try:
+        with gzip.open(archive_path, "rb") as archive, open(partial, "wb") as raw:
+            shutil.copyfileobj(archive, raw, CHUNK_SIZE)
+        if _sha256(partial) != meta["database_sha256"]:
+            raise SnapshotError(f"Checksum mismatch of the restored {name}")
+        _integrity_check(partial)
+        os.replace(partial, target)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return meta
+
+
+def prune_snapshots(directory: str, keep: int) -> int:
+    """
+    Remove the oldest snapshots
+    :param directory: where the snapshots are kept
+    :param keep: number of snapshots kept
+    :return: number of removed snapshots
+    """
+    snapshots = list_snapshots(directory)
+    removed = snapshots[: max(0, len(snapshots) - keep)]
+    for meta in removed:
+        # metadata first, so a half removed snapshot is never listed
+        os.remove(os.path.join(directory, meta["name"] + ".json"))
+        os.remove(os.path.join(directory, meta["name"] + SNAPSHOT_SUFFIX))
+    return len(removed)
@@ -0,0 +1,394 @@
+"""
+Compact snapshot of the product table, serving the product reads.
+
+The products are kept column by column, in arrays of machine integers plus one
+shared name each, instead of one ORM instance with its instrumentation state per
+product, about a tenth of the memory. The JSON of a product name is encoded once
+and then served as is, until the products of that name change.
+
+The purchases change the stock column in place and drop the JSON of their product
+name only. The other writes committed by this worker build a new snapshot and swap
+it in, so the reads use whatever snapshot they picked up without taking any lock.
+"""
+
+import json
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from core import models
+from core.database import cache_loads
+
+# id, product name, amount available, cost, seller id
+Row = Tuple[int, str, int, int, int]
+
+# body of the names without any product, shared by all the snapshots
+_NO_PRODUCTS = b"[]"
+
+
+class CatalogSnapshot:
+    """
+    Products ordered by name then id: the products of a name are next to each other
+    and found by bisecting the name column, an id is found through the ids ordered
+    with their position. Only the stock column ever changes, see `add_stock`.
+    """
+
+    __slots__ = (
+        "ids",
+        "names",
+        "stocks",
+        "costs",
+        "seller_ids",
+        "sorted_ids",
+        "positions",
+        "_lock",
+        "_bodies",
+    )
+
+    def __init__(
+        self,
+        ids: array,
+        names: List[str],
+        stocks: array,
+        costs: array,
+        seller_ids: array,
+        sorted_ids: array,
+        positions: array,
+    ):
+        self.ids = ids
+        self.names = names
+        self.stocks = stocks
+        self.costs = costs
+        self.seller_ids = seller_ids
+        self.sorted_ids = sorted_ids
+        self.positions = positions
+        # guards the stock column and the bodies encoded from it
+        self._lock = threading.Lock()
+        self._bodies: Dict[str, bytes] = {}
+
+    @classmethod
+    def build(cls, rows: Iterable[Row]) -> "CatalogSnapshot":
+        """
+        Snapshot of some products
+        :param rows: the products, in any order
+        :return: the snapshot
+        """
+        ids, stocks, costs, seller_ids = array("q"), array("q"), array("q"), array("q")
+        names: List[str] = []
+        for product_id, product_name, amount_available, cost, seller_id in sorted(
+            rows, key=lambda row: (row[1] or "", row[0])
+        ):
+            product_name = product_name or ""
+            if names and names[-1] == product_name:
+                # equal names are next to each other and share one string
+                product_name = names[-1]
+            ids.append(product_id)
+            names.append(product_name)
+            stocks.append(amount_available or 0)
+            costs.append(cost or 0)
+            seller_ids.append(seller_id or 0)
+        by_id = sorted(range(len(ids)), key=ids.__getitem__)
+        sorted_ids = array("q", (ids[position] for position in by_id))
+        return cls(ids, names, stocks, costs, seller_ids, sorted_ids, array("q", by_id))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _position(self, product_id: int) -> Optional[int]:
+        index = bisect_left(self.sorted_ids, product_id)
+        if index < len(self.sorted_ids) and self.sorted_ids[index] == product_id:
+            return self.positions[index]
+        return None
+
+    def _rows(self, start: int = 0, stop: Optional[int] = None) -> Iterator[Row]:
+        return zip(
+            self.ids[start:stop],
+            self.names[start:stop],
+            self.stocks[start:stop],
+            self.costs[start:stop],
+            self.seller_ids[start:stop],
+        )
+
+    def row(self, product_id: int) -> Optional[Row]:
+        position = self._position(product_id)
+        if position is None:
+            return None
+        return next(self._rows(position, position + 1))
+
+    def product_ids(self, product_name: str) -> List[int]:
+        """
+        Ids of the products of a name
+        :param product_name: the product name
+        :return: the ids, in ascending order
+        """
+        start = bisect_left(self.names, product_name)
+        stop = bisect_right(self.names, product_name, start)
+        return self.ids[start:stop].tolist()
+
+    def products(self, product_name: str) -> List[dict]:
+        """
+        Products of a name, like the product read endpoint returns them
+        :param product_name: the product name
+        :return: list of products
+        """
+        start = bisect_left(self.names, product_name)
+        stop = bisect_right(self.names, product_name, start)
+        return [
+            {
+                "id": product_id,
+                "product_name": name,
+                "amount_available": amount_available,
+                "cost": cost,
+                "seller_id": seller_id,
+            }
+            for product_id, name, amount_available, cost, seller_id in self._rows(
+                start, stop
+            )
+        ]
+
+    def products_json(self, product_name: str) -> bytes:
+        """
+        Products of a name encoded as JSON, see `products`
+        :param product_name: the product name
+        :return: the JSON body
+        """
+        body = self._bodies.get(product_name)
+        if body is None:
+            with self._lock:
+                body = self._bodies.get(product_name)
+                if body is None:
+                    products = self.products(product_name)
+                    if not products:
+                        # unknown names are not remembered, anyone can ask for any
+                        return _NO_PRODUCTS
+                    body = json.dumps(products).encode()
+                    self._bodies[product_name] = body
+        return body
+
+    def add_stock(self, product_id: int, delta: int) -> "CatalogSnapshot":
+        """
+        Change the stock of a product in place, the JSON of its name is encoded again
+        on the next read
+        :param product_id: the product id
+        :param delta: units added (positive) or taken (negative)
+        :return: this snapshot
+        """
+        position = self._position(product_id)
+        if position is not None:
+            with self._lock:
+                self.stocks[position] += delta
+                self._bodies.pop(self.names[position], None)
+        return self
+
+    def with_product(self, row: Row, stock_delta: int) -> "CatalogSnapshot":
+        """
+        Snapshot with a product created or updated
+        :param row: the product, its stock is only used when it is new
+        :param stock_delta: what the update added to the stock
+        :return: this snapshot when only the stock changed, a new one otherwise
+        """
+        current = self.row(row[0])
+        if current is None:
+            return self.with_rows([row])
+        if current[:2] + current[3:] == row[:2] + row[3:]:
+            return self.add_stock(row[0], stock_delta)
+        return self.with_rows([row[:2] + (current[2] + stock_delta,) + row[3:]])
+
+    def with_rows(
+        self, rows: Iterable[Row] = (), removed: Iterable[int] = ()
+    ) -> "CatalogSnapshot":
+        """
+        Snapshot with some products added, replaced or removed
+        :param rows: products added or replaced
+        :param removed: ids of the products removed
+        :return: this snapshot when only stocks changed, a new one otherwise
+        """
+        changed: Dict[int, Optional[Row]] = {
+            product_id: None
+            for product_id in removed
+            if self._position(product_id) is not None
+        }
+        changed.update((row[0], row) for row in rows)
+        if all(
+            row is not None and self._same_but_stock(row) for row in changed.values()
+        ):
+            for product_id, _, amount_available, _, _ in changed.values():
+                self.add_stock(product_id, amount_available - self.row(product_id)[2])
+            return self
+
+        kept = [row for row in self._rows() if row[0] not in changed]
+        return CatalogSnapshot.build(
+            kept + [row for row in changed.values() if row is not None]
+        )
+
+    def _same_but_stock(self, row: Row) -> bool:
+        current = self.row(row[0])
+        return current is not None and current[:2] + current[3:] == row[:2] + row[3:]
+
+    def with_name(self, product_name: str, rows: Iterable[Row]) -> "CatalogSnapshot":
+        """
+        Snapshot where a product name has exactly some products
+        :param product_name: the product name
+        :param rows: all the products of that name
+        :return: the snapshot, see `with_rows`
+        """
+        rows = list(rows)
+        ids = {row[0] for row in rows}
+        removed = [
+            product_id
+            for product_id in self.product_ids(product_name)
+            if product_id not in ids
+        ]
+        return self.with_rows(rows, removed)
+
+
+class ProductCatalog:
+    """
+    The current catalog snapshot of this worker.
+
+    It is loaded with a single query on the first read, then patched with the
+    product changes committed by this worker, including those committed while it
+    was loaded. The product names changed by the other workers are read again from
+    the database the next time they are asked for.
+    """
+
+    def __init__(self):
+        # serializes the patches, the reads don't take it
+        self._lock = threading.Lock()
+        # one load at a time
+        self._loading = threading.Lock()
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._stale: Set[str] = set()
+        # patches committed while a snapshot is built, applied on top of it
+        self._pending: Optional[List[Callable]] = None
+        # bumped by `reset`, a load running meanwhile isn't kept
+        self._generation = 0
+
+    @property
+    def loaded(self) -> bool:
+        return self._snapshot is not None
+
+    @staticmethod
+    def _query(db: Session):
+        return db.query(
+            models.Product.id,
+            models.Product.product_name,
+            models.Product.amount_available,
+            models.Product.cost,
+            models.Product.seller_id,
+        )
+
+    def load(self, db: Session) -> CatalogSnapshot:
+        """
+        (Re)build the snapshot from the product table
+        :param db: db session
+        :return: the new snapshot
+        """
+        with self._loading:
+            return self._load(db)
+
+    def _load(self, db: Session) -> CatalogSnapshot:
+        with cache_loads.reading():
+            with self._lock:
+                generation = self._generation
+                stale = set(self._stale)
+            rows = self._query(db).all()
+            with self._lock:
+                # the commits waited for the query, their patches come after it
+                self._pending = []
+        snapshot = CatalogSnapshot.build(rows)
+        with self._lock:
+            for patch in self._pending:
+                snapshot = patch(snapshot)
+            self._pending = None
+            if self._generation == generation:
+                self._snapshot = snapshot
+                self._stale -= stale
+        return snapshot
+
+    def _swap(self, patch: Callable[[CatalogSnapshot], CatalogSnapshot]):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append(patch)
+            if self._snapshot is not None:
+                # otherwise the next read loads it from the database
+                self._snapshot = patch(self._snapshot)
+
+    def put(self, row: Row, stock_delta: int):
+        """
+        Apply a committed product creation or update
+        :param row: the product as committed
+        :param stock_delta: what the transaction added to the stock, the stock of
+            the row is only used for a new product: the purchases committed
+            meanwhile may be applied before or after
+        """
+        self._swap(lambda snapshot: snapshot.with_product(row, stock_delta))
+
+    def apply_stock(self, product_id: int, delta: int):
+        """
+        Apply a committed stock change
+        :param product_id: product whose stock changed
+        :param delta: units added (positive) or taken (negative)
+        """
+        self._swap(lambda snapshot: snapshot.add_stock(product_id, delta))
+
+    def discard(self, product_ids: List[int]):
+        """
+        Forget removed products
+        :param product_ids: the product ids
+        """
+        self._swap(lambda snapshot: snapshot.with_rows(removed=product_ids))
+
+    def invalidate(self, product_name: str):
+        """
+        Read the products of a name from the database next time, after another
+        worker changed them
+        :param product_name: the product name
+        """
+        with self._lock:
+            self._stale.add(product_name)
+
+    def reset(self):
+        """
+        Drop the snapshot, the next read loads it again
+        """
+        with self._lock:
+            self._snapshot = None
+            self._stale.clear()
+            self._generation += 1
+
+    def _refresh(self, db: Session, product_name: str) -> CatalogSnapshot:
+        with cache_loads.reading():
+            with self._lock:
+                # invalidated again while it is read, it is added back
+                self._stale.discard(product_name)
+            rows = (
+                self._query(db)
+                .filter(models.Product.product_name == product_name)
+                .all()
+            )
+            self._swap(lambda snapshot: snapshot.with_name(product_name, rows))
+        return self._snapshot or CatalogSnapshot.build(rows)
+
+    def products_json(self, db: Session, product_name: str) -> bytes:
+        """
+        Products of a name encoded as JSON
+        :param db: db session, only used when the snapshot must be read again
+        :param product_name: the product name
+        :return: the JSON body
+        """
+        # `reset` may drop the snapshot at any time, keep the one read
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._loading:
+                # loaded by another read meanwhile
+                snapshot = self._snapshot or self._load(db)
+        elif product_name in self._stale:
+            snapshot = self._refresh(db, product_name)
+        return snapshot.products_json(product_name)
+
+
+catalog = ProductCatalog()
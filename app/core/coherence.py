@@ -0,0 +1,210 @@
+"""
+Cache coherence between the worker processes sharing one sqlite database.
+
+Every transaction which makes a cached value stale writes what it invalidated in
+the `change_log` table, in the same transaction, and so do the stock changes and
+the events the other workers have to apply too. Each worker polls
+`PRAGMA data_version`, which only changes when another connection committed, and
+reads the new rows when it did, so an idle database costs no query at all.
+"""
+
+import logging
+import os
+import threading
+from collections import defaultdict
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from core import models
+from core.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeFeed:
+    """
+    Broadcast cache invalidations to the other workers and apply theirs
+    """
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.origin = os.getpid()
+        self._handlers: Dict[str, List[Callable[[str], None]]] = defaultdict(list)
+        self._followers: Dict[str, List[Tuple[Callable[[int, str], None], bool]]] = (
+            defaultdict(list)
+        )
+        self._last_id = 0
+        self._data_version: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._applied = 0
+
+    def on(self, topic: str, handler: Callable[[str], None]):
+        """
+        Register what to drop when another worker invalidates a key of a topic
+        :param topic: e.g. "product"
+        :param handler: called with the key
+        """
+        self._handlers[topic].append(handler)
+
+    def follow(self, topic: str, handler: Callable[[int, str], None], own: bool = True):
+        """
+        Register what to do with every key of a topic, in the order they were
+        committed: sqlite has one writer at a time, so the row ids are the same
+        sequence in every worker
+        :param topic: e.g. "event"
+        :param handler: called with the row id and the key
+        :param own: if the keys of this worker are followed too
+        """
+        self._followers[topic].append((handler, own))
+
+    def broadcast(self, db: Session, topic: str, key):
+        """
+        Invalidate a key in the other workers once the transaction is committed
+        :param db: db session
+        :param topic: e.g. "product"
+        :param key: what changed, e.g. a product name
+        """
+        if self.enabled:
+            # in order, once
+            db.info.setdefault("broadcast", {})[(topic, str(key))] = None
+
+    def broadcast_delta(self, db: Session, topic: str, key, delta: int):
+        """
+        Send a change to a counter to the other workers once the transaction is
+        committed, the handlers get `"<key>:<delta>"` with the deltas of the
+        transaction summed
+        :param db: db session
+        :param topic: e.g. "fleet"
+        :param key: the counter, e.g. a product id
+        :param delta: what was added to it
+        """
+        if self.enabled:
+            deltas = db.info.setdefault("broadcast_deltas", {})
+            deltas[(topic, str(key))] = deltas.get((topic, str(key)), 0) + delta
+
+    def start(self, engine: Engine, interval: float):
+        """
+        Follow the changes of the other workers from now on
+        :param engine: engine of the shared database
+        :param interval: seconds between two polls
+        """
+        if self._thread is not None:
+            return
+        connection = engine.connect()
+        self._data_version = self._read_data_version(connection)
+        self._last_id = connection.exec_driver_sql(
+            "SELECT COALESCE(MAX(id), 0) FROM change_log"
+        ).scalar()
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(connection, interval),
+            name="change-feed",
+            daemon=True,
+        )
+        self._thread.start()
+
+    @property
+    def last_id(self) -> int:
+        return self._last_id
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self, connection, interval: float):
+        try:
+            while not self._stop.wait(interval):
+                try:
+                    self.poll(connection)
+                except Exception:
+                    logger.exception("Polling the change log failed")
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _read_data_version(connection) -> int:
+        return connection.exec_driver_sql("PRAGMA data_version").scalar()
+
+    def poll(self, connection) -> int:
+        """
+        Apply the invalidations committed by the other workers since the last poll
+        :param connection: connection kept by the poller, `data_version` is
+            per connection
+        :return: number of invalidations applied
+        """
+        data_version = self._read_data_version(connection)
+        if data_version == self._data_version:
+            return 0
+        self._data_version = data_version
+
+        rows = connection.exec_driver_sql(
+            "SELECT id, origin, topic, key FROM change_log WHERE id > ? ORDER BY id",
+            (self._last_id,),
+        ).fetchall()
+        applied = 0
+        for row_id, origin, topic, key in rows:
+            self._last_id = row_id
+            for handler, own in self._followers.get(topic, ()):
+                if own or origin != self.origin:
+                    handler(row_id, key)
+            if origin == self.origin:
+                # applied locally by the transaction itself
+                continue
+            for handler in self._handlers.get(topic, ()):
+                handler(key)
+            applied += 1
+        self._applied += applied
+        return applied
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "origin": self.origin,
+            "last_id": self._last_id,
+            "applied": self._applied,
+        }
+
+
+def prune_change_log(db: Session, created_before: datetime) -> int:
+    """
+    Remove the invalidations every worker had the time to apply
+    :param db: db session
+    :param created_before: rows created before this are removed
+    :return: number of removed rows
+    """
+    return (
+        db.query(models.ChangeLog)
+        .filter(models.ChangeLog.created_at < created_before)
+        .delete(synchronize_session=False)
+    )
+
+
+change_feed = ChangeFeed(enabled=settings.coherence_poll_seconds is not None)
+
+
+@event.listens_for(Session, "before_commit")
+def _write_broadcasts(session: Session):
+    # flushed with the rest of the transaction
+    for topic, key in session.info.pop("broadcast", {}):
+        session.add(models.ChangeLog(origin=change_feed.origin, topic=topic, key=key))
+    for (topic, key), delta in session.info.pop("broadcast_deltas", {}).items():
+        if delta:
+            session.add(
+                models.ChangeLog(
+                    origin=change_feed.origin, topic=topic, key=f"{key}:{delta}"
+                )
+            )
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_broadcasts(session: Session):
+    session.info.pop("broadcast", None)
+    session.info.pop("broadcast_deltas", None)
@@ -1,10 +1,262 @@
-from sqlalchemy import create_engine
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from fastapi import Request
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.pool import StaticPool
+
+from core.request_context import basic_auth_username
+from core.settings import settings
+from core.slow_query import SlowQueryLog
+
+SQLALCHEMY_DATABASE_URL = settings.database_url
+
+
+def _in_memory(parsed) -> bool:
+    return parsed.database in (None, "", ":memory:")
+
+
+def read_only_url(url: str) -> Optional[str]:
+    """
+    Read-only flavour of a database url, only known for the sqlite files
+    :param url: database url
+    :return: a `mode=ro` sqlite uri, or None
+    """
+    parsed = make_url(url)
+    if parsed.get_backend_name() != "sqlite":
+        return None
+    if _in_memory(parsed) or parsed.database.startswith("file:"):
+        return None
+    return f"sqlite:///file:{parsed.database}?mode=ro&uri=true"
+
+
+def connect_args(url: str) -> dict:
+    """
+    DBAPI connect arguments of a database url
+    :param url: database url
+    :return: keyword arguments for `create_engine(connect_args=...)`
+    """
+    if make_url(url).get_backend_name() == "sqlite":
+        # a request's session is opened, used and closed by different threadpool
+        # threads, the session itself is never shared
+        return {"check_same_thread": False}
+    return {}
+
+
+def engine_options(url: str) -> dict:
+    """
+    Keyword arguments of `create_engine` for a database url
+    :param url: database url
+    :return: connect arguments, and the pool of the in-memory sqlite databases
+    """
+    options = {"connect_args": connect_args(url)}
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite" and _in_memory(parsed):
+        # every connection would get its own empty database, the threads share one
+        options["poolclass"] = StaticPool
+    return options
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///my_db"
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, **engine_options(SQLALCHEMY_DATABASE_URL)
+)
+# read-only handlers use their own engine and pool: a replica when configured,
+# a read-only connection to the same sqlite file otherwise
+SQLALCHEMY_READ_DATABASE_URL = settings.read_database_url or read_only_url(
+    SQLALCHEMY_DATABASE_URL
+)
+read_engine = (
+    create_engine(
+        SQLALCHEMY_READ_DATABASE_URL, **engine_options(SQLALCHEMY_READ_DATABASE_URL)
+    )
+    if SQLALCHEMY_READ_DATABASE_URL
+    else engine
+)
+if settings.slow_query_ms is not None:
+    slow_query_log = SlowQueryLog(
+        settings.slow_query_log,
+        settings.slow_query_ms,
+        max_per_second=settings.slow_query_max_per_second,
+    )
+    slow_query_log.install(engine)
+    if read_engine is not engine:
+        slow_query_log.install(read_engine)
+# instances stay usable after the commit, so handlers can return them without a reload
+SessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, expire_on_commit=False, bind=engine
+)
+ReadSessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, expire_on_commit=False, bind=read_engine
+)
 
 Base = declarative_base()
+
+
+class ReadYourWrites:
+    """
+    Remember who wrote recently, their reads stay on the primary for `window`
+    seconds so they always see their own writes, whatever the replica lag is
+    """
+
+    def __init__(self, window: float):
+        self.window = window
+        self._lock = threading.Lock()
+        self._writers: Dict[str, float] = {}
+
+    def touch(self, username: str):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._writers) > 10000:
+                self._writers = {
+                    name: until for name, until in self._writers.items() if until > now
+                }
+            self._writers[username] = now + self.window
+
+    def is_sticky(self, username: Optional[str]) -> bool:
+        if username is None:
+            return False
+        with self._lock:
+            until = self._writers.get(username)
+        return until is not None and until > time.monotonic()
+
+
+read_your_writes = ReadYourWrites(settings.read_your_writes_seconds)
+
+
+# Dependency
+def get_db(request: Request):
+    """
+    Database session for a request, used as a unit of work: the `core.utils` helpers
+    only flush their changes and the handler commits once at the end.
+    Whatever is left uncommitted is rolled back when the session is closed.
+    """
+    db = SessionLocal()
+    username = basic_auth_username(request.scope)
+    if username is not None:
+        db.info["writer"] = username
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+# Dependency
+def get_read_db(request: Request):
+    """
+    Database session for the read-only handlers, bound to the read engine.
+    Users who wrote in the last seconds are kept on the primary.
+    """
+    if read_your_writes.is_sticky(basic_auth_username(request.scope)):
+        db = SessionLocal()
+    else:
+        db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def on_commit(db: Session, callback):
+    """
+    Run a callback once the current transaction of the session is committed.
+    Callbacks of a transaction which is rolled back are dropped.
+    :param db: db session
+    :param callback: callable without arguments
+    """
+    db.info.setdefault("on_commit", []).append(callback)
+
+
+@event.listens_for(Session, "after_commit")
+def _run_on_commit_callbacks(session: Session):
+    if "writer" in session.info:
+        read_your_writes.touch(session.info["writer"])
+    for callback in session.info.pop("on_commit", []):
+        callback()
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_on_commit_callbacks(session: Session):
+    session.info.pop("on_commit", None)
+
+
+class CommitGate:
+    """
+    Keep the in-process caches patched by the commits from racing with their loads.
+
+    The commits of the sessions patching a cache, see `patch_on_commit`, wait while
+    a cache reads the database, and a cache only reads once the patches of the
+    commits in progress are applied: every commit is either in what a load read or
+    patched on top of it, never both nor neither.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+        self._committing = 0
+        self._reading = 0
+        # the waiting reads go first, a steady flow of commits can't starve them
+        self._waiting = 0
+
+    @contextmanager
+    def reading(self):
+        """
+        Read the database for a cache, without any cache lock held
+        """
+        with self._lock:
+            self._waiting += 1
+            while self._committing:
+                self._done.wait()
+            self._waiting -= 1
+            self._reading += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._reading -= 1
+                self._done.notify_all()
+
+    def _enter_commit(self):
+        with self._lock:
+            while self._reading or self._waiting:
+                self._done.wait()
+            self._committing += 1
+
+    def _exit_commit(self):
+        with self._lock:
+            self._committing -= 1
+            self._done.notify_all()
+
+
+cache_loads = CommitGate()
+
+
+def patch_on_commit(db: Session, callback):
+    """
+    Patch an in-process cache once the current transaction of the session is
+    committed, see `CommitGate`
+    :param db: db session
+    :param callback: callable without arguments
+    """
+    db.info["patches_caches"] = True
+    on_commit(db, callback)
+
+
+@event.listens_for(Session, "before_commit")
+def _enter_commit_gate(session: Session):
+    if session.info.pop("patches_caches", False):
+        cache_loads._enter_commit()
+        session.info["in_commit_gate"] = True
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _exit_commit_gate(session: Session, transaction):
+    # after the `after_commit` callbacks, or a rollback
+    if transaction.parent is None:
+        session.info.pop("patches_caches", None)
+        if session.info.pop("in_commit_gate", False):
+            cache_loads._exit_commit()
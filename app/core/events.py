@@ -0,0 +1,184 @@
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.settings import settings
+
+
+def product_state(product) -> Dict[str, Any]:
+    """
+    State of a product as sent in the events
+    :param product: the product
+    :return: camel case product fields
+    """
+    return {
+        "id": product.id,
+        "productName": product.product_name,
+        "amountAvailable": product.amount_available,
+        "cost": product.cost,
+        "sellerId": product.seller_id,
+    }
+
+
+def slot_state(slot) -> Dict[str, Any]:
+    """
+    State of a machine slot as sent in the events
+    :param slot: the machine slot
+    :return: camel case slot fields
+    """
+    return {
+        "machineId": slot.machine_id,
+        "slot": slot.slot,
+        "productId": slot.product_id,
+        "amountAvailable": slot.amount_available,
+    }
+
+
+class Event:
+    __slots__ = ("seq", "type", "key", "data")
+
+    def __init__(self, seq: int, type: str, key: str, data: Dict[str, Any]):
+        self.seq = seq
+        self.type = type
+        self.key = key
+        self.data = data
+
+
+class Subscriber:
+    """
+    Bounded queue of one subscriber. Events are coalesced by key, so a slow
+    consumer only gets the latest event of every key it didn't read yet. When more
+    than `max_pending` keys are waiting the oldest ones are dropped and the
+    consumer is told to resync.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, max_pending: int):
+        self.max_pending = max_pending
+        self._loop = loop
+        self._lock = threading.Lock()
+        self._pending: "OrderedDict[str, Event]" = OrderedDict()
+        self._overflowed = False
+        self._ready = asyncio.Event()
+
+    def push(self, event: Event):
+        """
+        Queue an event, can be called from any thread
+        :param event: the event
+        """
+        with self._lock:
+            self._pending.pop(event.key, None)
+            self._pending[event.key] = event
+            if len(self._pending) > self.max_pending:
+                self._pending.popitem(last=False)
+                self._overflowed = True
+        self._loop.call_soon_threadsafe(self._ready.set)
+
+    def resync(self):
+        with self._lock:
+            self._pending.clear()
+            self._overflowed = True
+        self._loop.call_soon_threadsafe(self._ready.set)
+
+    async def get(self) -> Tuple[List[Event], bool]:
+        """
+        Wait for events
+        :return: the queued events by sequence, and if events were lost in between
+        """
+        await self._ready.wait()
+        self._ready.clear()
+        with self._lock:
+            events = list(self._pending.values())
+            self._pending.clear()
+            overflowed, self._overflowed = self._overflowed, False
+        return events, overflowed
+
+
+class EventBus:
+    """
+    Publish inventory and price changes to the subscribers of the event stream.
+
+    Every event gets a sequence number. The last `history_size` events are kept so
+    a subscriber reconnecting with the last sequence it saw gets what it missed.
+    With several workers the sequence numbers are the ids of the events in the
+    change log, the same in every worker, so a subscriber can resume on any of them.
+    """
+
+    def __init__(self, history_size: int = 1024, max_pending: int = 256):
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._seq = 0
+        # events up to this sequence are no longer in the history
+        self._forgotten = 0
+        self._history: deque = deque(maxlen=history_size)
+        self._subscribers: List[Subscriber] = []
+
+    @property
+    def seq(self) -> int:
+        return self._seq
+
+    def start_at(self, seq: int):
+        """
+        Continue the sequence of events published before this bus existed, a
+        subscriber resuming from an earlier one is asked to resync
+        :param seq: last sequence already used
+        """
+        with self._lock:
+            self._seq = self._forgotten = seq
+            self._history.clear()
+
+    def publish(
+        self, type: str, key: str, data: Dict[str, Any], seq: Optional[int] = None
+    ) -> Event:
+        """
+        Publish an event to all the subscribers
+        :param type: event type, e.g. `product.updated`
+        :param key: entity the event is about, events of a key coalesce
+        :param data: state of the entity
+        :param seq: sequence number given by the change log, the next one otherwise
+        :return: the published event
+        """
+        with self._lock:
+            self._seq = self._seq + 1 if seq is None else seq
+            event = Event(self._seq, type, key, data)
+            if len(self._history) == self._history.maxlen:
+                self._forgotten = self._history[0].seq
+            self._history.append(event)
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber.push(event)
+        return event
+
+    def subscribe(
+        self, loop: asyncio.AbstractEventLoop, last_seq: Optional[int] = None
+    ) -> Subscriber:
+        """
+        Start receiving events
+        :param loop: event loop of the consumer
+        :param last_seq: last sequence seen before a reconnection
+        :return: the subscriber queue
+        """
+        subscriber = Subscriber(loop, self.max_pending)
+        with self._lock:
+            self._subscribers.append(subscriber)
+            if last_seq is None:
+                return subscriber
+
+            if last_seq > self._seq or last_seq < self._forgotten:
+                # the events in between are gone, or the server restarted
+                subscriber.resync()
+            else:
+                for event in self._history:
+                    if event.seq > last_seq:
+                        subscriber.push(event)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+
+
+event_bus = EventBus(
+    history_size=settings.event_history_size, max_pending=settings.event_queue_size
+)
@@ -0,0 +1,133 @@
+import threading
+from typing import Dict, Optional
+
+from sqlalchemy import func, true
+from sqlalchemy.orm import Session
+
+from core import models
+from core.database import cache_loads
+
+
+class FleetStock:
+    """
+    Fleet-wide stock of every product, summed over the slots of all the machines.
+
+    The totals are loaded with a single aggregate query and then kept up to date
+    from the stock changes of the committed transactions, so reading them never
+    scans the slots.
+
+    The commits of this worker never race with a load, see
+    `core.database.CommitGate`. The changes of the other workers carry the id of
+    their change log row, those the load already read are skipped.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals: Optional[Dict[int, int]] = None
+        # last change log row the totals include
+        self._log_id = 0
+
+    @property
+    def loaded(self) -> bool:
+        return self._totals is not None
+
+    def load(self, db: Session) -> Dict[int, int]:
+        """
+        (Re)build the totals from the slots
+        :param db: db session
+        :return: the new totals
+        """
+        with cache_loads.reading():
+            totals, log_id = self._read(db)
+            with self._lock:
+                self._totals, self._log_id = totals, log_id
+        return totals
+
+    @staticmethod
+    def _read(db: Session):
+        # one statement, so the totals and the change log are read at the same point
+        slots = (
+            db.query(
+                models.MachineSlot.product_id.label("product_id"),
+                func.sum(models.MachineSlot.amount_available).label("total"),
+            )
+            .group_by(models.MachineSlot.product_id)
+            .subquery()
+        )
+        last_change = db.query(
+            func.coalesce(func.max(models.ChangeLog.id), 0).label("id")
+        ).subquery()
+        rows = (
+            db.query(last_change.c.id, slots.c.product_id, slots.c.total)
+            .select_from(last_change)
+            .outerjoin(slots, true())
+            .all()
+        )
+        totals = {
+            product_id: int(total or 0)
+            for _, product_id, total in rows
+            if product_id is not None
+        }
+        return totals, rows[0][0]
+
+    def apply(self, product_id: int, delta: int, log_id: Optional[int] = None):
+        """
+        Apply a committed stock change
+        :param product_id: product whose stock changed
+        :param delta: units added (positive) or taken (negative)
+        :param log_id: change log row of a change made by another worker
+        """
+        with self._lock:
+            if self._totals is None:
+                # the next load reads it from the database
+                return
+            if log_id is not None and log_id <= self._log_id:
+                # already read by the last load
+                return
+            self._totals[product_id] = self._totals.get(product_id, 0) + delta
+
+    def discard(self, product_id: int):
+        """
+        Forget a removed product
+        :param product_id: the product id
+        """
+        with self._lock:
+            if self._totals is not None:
+                self._totals.pop(product_id, None)
+
+    def reset(self):
+        """
+        Drop all the totals, the next read loads them again from the slots
+        """
+        with self._lock:
+            self._totals = None
+            self._log_id = 0
+
+    def total(self, db: Session, product_id: int) -> int:
+        """
+        Fleet-wide stock of a product
+        :param db: db session, only used when the totals were never loaded
+        :param product_id: the product id
+        :return: units available over all the machines
+        """
+        # `reset` may drop the totals at any time, keep the ones read
+        totals = self._totals
+        if totals is None:
+            totals = self.load(db)
+        with self._lock:
+            return totals.get(product_id, 0)
+
+    def totals(self, db: Session) -> Dict[int, int]:
+        """
+        Fleet-wide stock of all the products
+        :param db: db session, only used when the totals were never loaded
+        :return: product id -> units available over all the machines
+        """
+        totals = self._totals
+        if totals is None:
+            totals = self.load(db)
+        with self._lock:
+            return dict(totals)
+
+
+fleet_stock = FleetStock()
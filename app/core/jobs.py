@@ -0,0 +1,195 @@
+from datetime import datetime, timedelta
+from functools import wraps
+from typing import Any, Callable, Optional
+
+from sqlalchemy.exc import IntegrityError
+
+from core import utils
+from core.backup import SnapshotError, create_snapshot, database_path, prune_snapshots
+from core.catalog import catalog
+from core.coherence import change_feed, prune_change_log
+from core.database import SessionLocal
+from core.fleet import fleet_stock
+from core.scheduler import LeaderLock, Scheduler
+from core.settings import settings
+
+LOW_STOCK = "low_stock"
+
+
+def _leader_lock_path() -> Optional[str]:
+    if settings.scheduler_leader_lock:
+        return settings.scheduler_leader_lock
+    try:
+        return database_path(settings.database_url) + "-jobs.lock"
+    except SnapshotError:
+        # an in-memory database has a single worker
+        return None
+
+
+# the snapshots and the cleanups run in one worker, the others would only repeat
+# them and collide; the caches of every worker and the low stock alerts raised by
+# its purchases are kept up to date by each worker
+leader = LeaderLock(_leader_lock_path())
+
+
+def in_leader(func: Callable[[], Any]) -> Callable[[], Any]:
+    """
+    Run a job only in the worker elected by `leader`
+    :param func: the job
+    :return: the job, doing nothing in the other workers
+    """
+
+    @wraps(func)
+    def run():
+        if leader.acquire():
+            return func()
+
+    return run
+
+
+def notify_low_stock():
+    """
+    Notify the sellers of their products running out of stock, once per product.
+    The notification is removed when the product is restocked so it can be raised again.
+    """
+    db = SessionLocal()
+    try:
+        threshold = settings.low_stock_threshold
+        notified = utils.get_notification_keys(db, LOW_STOCK)
+        low = set()
+        for db_product in utils.get_low_stock_products(db, threshold):
+            key = (db_product.seller_id, str(db_product.id))
+            low.add(key)
+            if key not in notified:
+                utils.create_notification(
+                    db,
+                    db_product.seller_id,
+                    LOW_STOCK,
+                    str(db_product.id),
+                    f"Only {db_product.amount_available} pcs of "
+                    f"{db_product.product_name} left",
+                )
+        for user_id, key in notified - low:
+            utils.remove_notification(db, user_id, LOW_STOCK, key)
+        db.commit()
+    except IntegrityError:
+        # the job of another worker raised the same notifications, flushed with
+        # the first one already
+        db.rollback()
+    finally:
+        db.close()
+
+
+def refresh_fleet_stock():
+    """
+    Rebuild the fleet-wide stock, which also fixes any drift of the incremental updates
+    """
+    db = SessionLocal()
+    try:
+        fleet_stock.load(db)
+    finally:
+        db.close()
+
+
+def refresh_catalog():
+    """
+    Rebuild the product catalog snapshot once it is used, which also fixes any drift
+    of the patches
+    """
+    if not catalog.loaded:
+        return
+    db = SessionLocal()
+    try:
+        catalog.load(db)
+    finally:
+        db.close()
+
+
+def cleanup_notifications():
+    """
+    Remove the notifications past their retention, but the low stock alerts of the
+    products still low: `notify_low_stock` would raise them again
+    """
+    db = SessionLocal()
+    try:
+        utils.remove_notifications_before(
+            db,
+            datetime.utcnow()
+            - timedelta(seconds=settings.notification_retention_seconds),
+            low_stock_kind=LOW_STOCK,
+            low_stock_threshold=settings.low_stock_threshold,
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def prune_changes():
+    """
+    Remove the changes of the change log every worker had the time to apply
+    """
+    db = SessionLocal()
+    try:
+        prune_change_log(
+            db,
+            datetime.utcnow() - timedelta(seconds=settings.coherence_retention_seconds),
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def take_snapshot():
+    """
+    Snapshot the database and remove the oldest snapshots
+    """
+    create_snapshot(
+        database_path(settings.database_url),
+        settings.snapshot_dir,
+        pages=settings.snapshot_pages,
+        pause=settings.snapshot_pause_seconds,
+    )
+    prune_snapshots(settings.snapshot_dir, settings.snapshot_keep)
+
+
+def register_jobs(scheduler: Scheduler):
+    """
+    Add the background jobs of the app to the scheduler
+    :param scheduler: the scheduler
+    """
+    jitter = settings.scheduler_jitter_seconds
+    scheduler.add_job(
+        LOW_STOCK, notify_low_stock, settings.low_stock_interval_seconds, jitter
+    )
+    scheduler.add_job(
+        "fleet_refresh",
+        refresh_fleet_stock,
+        settings.fleet_refresh_interval_seconds,
+        jitter,
+    )
+    scheduler.add_job(
+        "catalog_refresh",
+        refresh_catalog,
+        settings.catalog_refresh_interval_seconds,
+        jitter,
+    )
+    scheduler.add_job(
+        "cleanup",
+        in_leader(cleanup_notifications),
+        settings.cleanup_interval_seconds,
+        jitter,
+    )
+    if settings.snapshot_interval_seconds is not None:
+        scheduler.add_job(
+            "snapshot",
+            in_leader(take_snapshot),
+            settings.snapshot_interval_seconds,
+            jitter,
+        )
+    if change_feed.enabled:
+        scheduler.add_job(
+            "change_log_prune",
+            in_leader(prune_changes),
+            settings.cleanup_interval_seconds,
+            jitter,
+        )
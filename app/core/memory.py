@@ -0,0 +1,504 @@
+import itertools
+import json
+import threading
+import zlib
+from dataclasses import asdict, dataclass, replace
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+from core import utils
+from core.events import event_bus, product_state
+from core.repository import (
+    PurchaseConflict,
+    Repository,
+    UsernameTaken,
+    WriteConflict,
+)
+from product.serializers import ProductCreate
+from user.serializers import UserBase, User
+
+
+@dataclass
+class UserRecord:
+    id: int
+    username: str
+    password: str
+    deposit: int
+    role: str
+
+
+@dataclass
+class ProductRecord:
+    id: int
+    product_name: str
+    amount_available: int
+    cost: int
+    seller_id: int
+
+
+class InMemoryStore:
+    """
+    Users and products kept in dicts, with the indexes the lookups need.
+
+    The dicts only hold committed rows, they are changed by `InMemoryRepository.commit`
+    under `_lock`. Readers don't take any lock. A repository holds the lock of a row
+    from its first write to the row until its commit or rollback. The rows share a
+    fixed number of locks, the writes of different rows only wait for each other
+    when their rows fall on the same lock.
+    """
+
+    def __init__(self, lock_timeout: float = 5, lock_stripes: int = 1024):
+        self.lock_timeout = lock_timeout
+        self._lock = threading.Lock()
+        self.row_locks = [threading.Lock() for _ in range(lock_stripes)]
+        self._user_ids = itertools.count(1)
+        self._product_ids = itertools.count(1)
+        self.users: Dict[int, UserRecord] = {}
+        self.user_by_name: Dict[str, int] = {}
+        self.products: Dict[int, ProductRecord] = {}
+        # product name -> ids, in creation order
+        self.products_by_name: Dict[str, Dict[int, None]] = {}
+        self.product_by_seller: Dict[Tuple[int, str], int] = {}
+
+    def lock_index(self, key: Hashable) -> int:
+        """
+        Index in `row_locks` of the lock of a row, e.g. ("user", 1), the same in every
+        run of the process
+        """
+        return zlib.crc32(repr(key).encode()) % len(self.row_locks)
+
+    def next_user_id(self) -> int:
+        with self._lock:
+            return next(self._user_ids)
+
+    def next_product_id(self) -> int:
+        with self._lock:
+            return next(self._product_ids)
+
+    def apply(
+        self,
+        users: Dict[int, Optional[UserRecord]],
+        products: Dict[int, Optional[ProductRecord]],
+    ):
+        """
+        Store the rows written by a transaction, None for the deleted ones
+        """
+        with self._lock:
+            for user_id, record in users.items():
+                self._put_user(user_id, record)
+            for product_id, record in products.items():
+                self._put_product(product_id, record)
+
+    def _put_user(self, user_id: int, record: Optional[UserRecord]):
+        old = self.users.pop(user_id, None)
+        if old is not None and self.user_by_name.get(old.username) == user_id:
+            del self.user_by_name[old.username]
+        if record is not None:
+            self.users[user_id] = record
+            self.user_by_name[record.username] = user_id
+
+    def _put_product(self, product_id: int, record: Optional[ProductRecord]):
+        old = self.products.pop(product_id, None)
+        if old is not None:
+            key = (old.seller_id, old.product_name)
+            if self.product_by_seller.get(key) == product_id:
+                del self.product_by_seller[key]
+            if record is None or record.product_name != old.product_name:
+                self._unindex_name(old.product_name, product_id)
+        if record is not None:
+            self.products[product_id] = record
+            self.products_by_name.setdefault(record.product_name, {})[product_id] = None
+            self.product_by_seller[(record.seller_id, record.product_name)] = product_id
+
+    def _unindex_name(self, product_name: str, product_id: int):
+        ids = self.products_by_name.get(product_name)
+        if ids is not None:
+            ids.pop(product_id, None)
+            if not ids:
+                del self.products_by_name[product_name]
+
+
+class InMemoryRepository(Repository):
+    """
+    Repository on top of an `InMemoryStore`, with the transactions of a database.
+
+    Writes are kept by the repository until `commit`, which stores them and runs
+    their side effects (events, cache invalidations); `rollback` drops them. The
+    repository reads its own writes, the others only see the committed rows. Rows
+    are returned as copies, like the instances of a session they don't change under
+    the caller.
+
+    Every written row stays locked until the commit or rollback: the writers of a
+    row wait for each other, like the writers of a sqlite database. A writer waiting
+    longer than `store.lock_timeout` gets a `WriteConflict`.
+    """
+
+    def __init__(self, store: InMemoryStore):
+        self.store = store
+        self._users: Dict[int, Optional[UserRecord]] = {}
+        self._products: Dict[int, Optional[ProductRecord]] = {}
+        # lock index -> lock, a lock is taken once whatever the rows on it
+        self._held: Dict[int, threading.Lock] = {}
+        self._on_commit: List[Callable[[], None]] = []
+        # deposit of the users handed out, what `update_user_deposit` starts from
+        self._loaded_deposits: Dict[int, int] = {}
+
+    def _lock_rows(self, *keys: Hashable):
+        """
+        Take the locks of some rows until the end of the transaction, in the same
+        order for every repository
+        """
+        indexes = {self.store.lock_index(key) for key in keys}
+        for index in sorted(indexes - self._held.keys()):
+            lock = self.store.row_locks[index]
+            if not lock.acquire(timeout=self.store.lock_timeout):
+                self.rollback()
+                raise WriteConflict()
+            self._held[index] = lock
+
+    def _user_by_id(self, user_id: int) -> Optional[UserRecord]:
+        if user_id in self._users:
+            return self._users[user_id]
+        return self.store.users.get(user_id)
+
+    def _user(self, username: str) -> Optional[UserRecord]:
+        for record in self._users.values():
+            if record is not None and record.username == username:
+                return record
+        user_id = self.store.user_by_name.get(username)
+        if user_id is None or user_id in self._users:
+            # deleted or renamed by this transaction
+            return None
+        return self.store.users.get(user_id)
+
+    def _product(self, product_id: int) -> Optional[ProductRecord]:
+        if product_id in self._products:
+            return self._products[product_id]
+        return self.store.products.get(product_id)
+
+    def _product_for_user(self, product_name: str, seller_id: int):
+        for record in self._products.values():
+            if (
+                record is not None
+                and record.seller_id == seller_id
+                and record.product_name == product_name
+            ):
+                return record
+        product_id = self.store.product_by_seller.get((seller_id, product_name))
+        if product_id is None or product_id in self._products:
+            return None
+        return self.store.products.get(product_id)
+
+    def _publish(self, type: str, record: ProductRecord):
+        data = product_state(record)
+        self._on_commit.append(
+            lambda: event_bus.publish(type, f"product:{record.id}", data)
+        )
+
+    def _forget(self, *product_names: str):
+        def forget():
+            for product_name in product_names:
+                utils.product_reads.forget(product_name)
+
+        self._on_commit.append(forget)
+
+    def authenticate_user(
+        self,
+        username: str,
+        password: str,
+        *,
+        admin_requester=False,
+        buyer_requester=False,
+    ):
+        return utils.check_credentials(
+            self.get_user(username),
+            password,
+            admin_requester=admin_requester,
+            buyer_requester=buyer_requester,
+        )
+
+    def _loaded_user(self, record: Optional[UserRecord]):
+        if record is None:
+            return None
+        self._loaded_deposits[record.id] = record.deposit
+        return replace(record)
+
+    def get_user(self, username: str):
+        return self._loaded_user(self._user(username))
+
+    def get_user_by_id(self, user_id: int):
+        return self._loaded_user(self._user_by_id(user_id))
+
+    def create_user(self, user: User):
+        self._lock_rows(("username", user.username))
+        if self._user(user.username) is not None:
+            self.rollback()
+            raise UsernameTaken()
+        record = UserRecord(
+            self.store.next_user_id(),
+            user.username,
+            utils.hash_password(user.password),
+            user.deposit,
+            user.role,
+        )
+        self._users[record.id] = record
+        return replace(record)
+
+    def update_user(self, username: str, new_user_details: UserBase):
+        record = self._user(username)
+        if record is None:
+            return None
+        self._lock_rows(("user", record.id))
+        record = replace(self._user_by_id(record.id), **new_user_details.dict())
+        self._users[record.id] = record
+        self._loaded_deposits[record.id] = record.deposit
+        return replace(record)
+
+    def update_user_deposit(self, username: str, deposit: int):
+        record = self._user(username)
+        if record is None:
+            return None
+        self._lock_rows(("user", record.id))
+        # read again under the lock, a transaction may have committed meanwhile
+        record = self._user_by_id(record.id)
+        if record.deposit != self._loaded_deposits.get(record.id, record.deposit):
+            self.rollback()
+            raise WriteConflict()
+        record = replace(record, deposit=deposit)
+        self._users[record.id] = record
+        self._loaded_deposits[record.id] = deposit
+        return replace(record)
+
+    def remove_user(self, username: str) -> int:
+        record = self._user(username)
+        if record is None:
+            return 0
+        self._lock_rows(("user", record.id))
+        self._users[record.id] = None
+        return 1
+
+    def remove_users(self, usernames: List[str]) -> Dict[str, str]:
+        records = {}
+        for username in usernames:
+            record = self._user(username)
+            if record is not None:
+                records[record.id] = record
+        self._lock_rows(*(("user", user_id) for user_id in records))
+        products = [
+            record for record in self._all_products() if record.seller_id in records
+        ]
+        self._lock_rows(*(("product", record.id) for record in products))
+        for user_id in records:
+            self._users[user_id] = None
+        for record in products:
+            self._remove_product(record)
+        deleted = {record.username for record in records.values()}
+        return {
+            username: utils.DELETED if username in deleted else utils.NOT_FOUND
+            for username in usernames
+        }
+
+    def reset_deposits(
+        self,
+        usernames: Optional[List[str]] = None,
+        min_deposit: Optional[int] = None,
+        max_deposit: Optional[int] = None,
+    ) -> Dict[str, str]:
+        if usernames is not None:
+            records = [self._user(username) for username in usernames]
+            found = {
+                record.username: record for record in records if record is not None
+            }
+        else:
+            found = {
+                record.username: record
+                for record in self._all_users()
+                if record.role == "buyer"
+                and (min_deposit is None or record.deposit >= min_deposit)
+                and (max_deposit is None or record.deposit <= max_deposit)
+            }
+            usernames = list(found)
+        buyers = [record for record in found.values() if record.role == "buyer"]
+        self._lock_rows(*(("user", record.id) for record in buyers))
+        for record in buyers:
+            record = replace(self._user_by_id(record.id), deposit=0)
+            self._users[record.id] = record
+            self._loaded_deposits[record.id] = 0
+        outcomes = {}
+        for username in usernames:
+            if username not in found:
+                outcomes[username] = utils.NOT_FOUND
+            elif found[username].role == "buyer":
+                outcomes[username] = utils.RESET
+            else:
+                outcomes[username] = utils.NOT_BUYER
+        return outcomes
+
+    def change_roles(self, usernames: List[str], role: str) -> Dict[str, str]:
+        records = [self._user(username) for username in usernames]
+        found = {record.username: record for record in records if record is not None}
+        changed = [record for record in found.values() if record.role != role]
+        self._lock_rows(*(("user", record.id) for record in changed))
+        for record in changed:
+            self._users[record.id] = replace(self._user_by_id(record.id), role=role)
+        changed_names = {record.username for record in changed}
+        outcomes = {}
+        for username in usernames:
+            if username not in found:
+                outcomes[username] = utils.NOT_FOUND
+            elif username in changed_names:
+                outcomes[username] = utils.UPDATED
+            else:
+                outcomes[username] = utils.UNCHANGED
+        return outcomes
+
+    def _all_users(self) -> List[UserRecord]:
+        users = [
+            record
+            for user_id, record in list(self.store.users.items())
+            if user_id not in self._users
+        ]
+        return users + [record for record in self._users.values() if record is not None]
+
+    def _all_products(self) -> List[ProductRecord]:
+        products = [
+            record
+            for product_id, record in list(self.store.products.items())
+            if product_id not in self._products
+        ]
+        return products + [
+            record for record in self._products.values() if record is not None
+        ]
+
+    def create_user_product(self, product: ProductCreate, seller_id: int):
+        record = ProductRecord(
+            self.store.next_product_id(),
+            product.product_name,
+            product.amount_available,
+            product.cost,
+            seller_id,
+        )
+        self._products[record.id] = record
+        self._forget(record.product_name)
+        self._publish("product.created", record)
+        return replace(record)
+
+    def get_product_for_user(self, product_name: str, seller_id: int):
+        record = self._product_for_user(product_name, seller_id)
+        return replace(record) if record is not None else None
+
+    def get_product_by_id(self, product_id: int):
+        record = self._product(product_id)
+        return replace(record) if record is not None else None
+
+    def get_all_products(self, product_name: str):
+        products = self.store.products
+        records = [
+            products[product_id]
+            for product_id in list(self.store.products_by_name.get(product_name, ()))
+            if product_id in products and product_id not in self._products
+        ]
+        records += [
+            record
+            for record in self._products.values()
+            if record is not None and record.product_name == product_name
+        ]
+        return [replace(record) for record in records]
+
+    def get_products_json(self, product_name: str) -> bytes:
+        products = self.get_all_products(product_name)
+        return json.dumps([asdict(record) for record in products]).encode()
+
+    def remove_product(self, product_name: str, seller_id: int) -> int:
+        record = self._product_for_user(product_name, seller_id)
+        if record is None:
+            return 0
+        self._lock_rows(("product", record.id))
+        self._remove_product(record)
+        return 1
+
+    def _remove_product(self, record: ProductRecord):
+        self._products[record.id] = None
+        self._forget(record.product_name)
+        product_id = record.id
+        data = {
+            "id": product_id,
+            "productName": record.product_name,
+            "sellerId": record.seller_id,
+        }
+        self._on_commit.append(
+            lambda: event_bus.publish("product.deleted", f"product:{product_id}", data)
+        )
+
+    def update_product(
+        self, product_name: str, seller_id: int, new_product_details: ProductCreate
+    ):
+        record = self._product_for_user(product_name, seller_id)
+        if record is None:
+            return None
+        self._lock_rows(("product", record.id))
+        record = replace(
+            self._product(record.id),
+            product_name=new_product_details.product_name,
+            amount_available=new_product_details.amount_available,
+            cost=new_product_details.cost,
+        )
+        self._products[record.id] = record
+        self._forget(product_name, new_product_details.product_name)
+        self._publish("product.updated", record)
+        return replace(record)
+
+    def update_product_amount_available_by_id(
+        self, product_id: int, new_available_amount: int
+    ):
+        if self._product(product_id) is None:
+            return None
+        self._lock_rows(("product", product_id))
+        record = replace(
+            self._product(product_id), amount_available=new_available_amount
+        )
+        self._products[product_id] = record
+        self._forget(record.product_name)
+        self._publish("product.stock", record)
+        return replace(record)
+
+    def purchase(self, user, product, amount: int) -> int:
+        self._lock_rows(("product", product.id), ("user", user.id))
+        # checked again under the locks, the view checked a copy
+        user_record = self._user_by_id(user.id)
+        product_record = self._product(product.id)
+        if (
+            user_record is None
+            or product_record is None
+            or user_record.deposit < amount * product_record.cost
+            or product_record.amount_available < amount
+        ):
+            self.rollback()
+            raise PurchaseConflict()
+        user_record = replace(
+            user_record, deposit=user_record.deposit - amount * product_record.cost
+        )
+        product_record = replace(
+            product_record, amount_available=product_record.amount_available - amount
+        )
+        self._users[user_record.id] = user_record
+        self._products[product_record.id] = product_record
+        self._loaded_deposits[user_record.id] = user_record.deposit
+        self._forget(product_record.product_name)
+        self._publish("product.stock", product_record)
+        return user_record.deposit
+
+    def commit(self):
+        self.store.apply(self._users, self._products)
+        callbacks = self._on_commit
+        self._end()
+        for callback in callbacks:
+            callback()
+
+    def rollback(self):
+        self._end()
+
+    def _end(self):
+        self._users, self._products, self._on_commit = {}, {}, []
+        held, self._held = self._held, {}
+        for lock in held.values():
+            lock.release()
@@ -1,4 +1,15 @@
-from sqlalchemy import Column, Integer, String, ForeignKey
+from datetime import datetime
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    UniqueConstraint,
+    inspect,
+)
 from sqlalchemy.orm import relationship
 
 from core.database import Base
@@ -6,11 +17,17 @@ from core.database import Base
 
 class User(Base):
     __tablename__ = "user"
+    # the stale deposits report scans only the buyers, the oldest deposits first
+    __table_args__ = (
+        Index("ix_user_role_deposit_updated_at", "role", "deposit_updated_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String, unique=True, index=True)
     password = Column(String)
     deposit = Column(Integer, default=0)
+    # last time the deposit changed, see `core.utils.get_stale_deposits`
+    deposit_updated_at = Column(DateTime, default=datetime.utcnow)
     role = Column(String)
 
     product = relationship("Product", back_populates="seller")
@@ -26,3 +43,96 @@ class Product(Base):
     seller_id = Column(Integer, ForeignKey("user.id"))
 
     seller = relationship("User", back_populates="product")
+
+
+class Machine(Base):
+    __tablename__ = "machine"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True, index=True)
+
+    slots = relationship("MachineSlot", back_populates="machine")
+
+
+class MachineSlot(Base):
+    """
+    Stock of a product in one slot of a machine. Every machine owns its rows, so
+    purchases on different machines never write to the same row.
+    """
+
+    __tablename__ = "machine_slot"
+    __table_args__ = (
+        UniqueConstraint("machine_id", "slot"),
+        Index("ix_machine_slot_machine_id_product_id", "machine_id", "product_id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    machine_id = Column(Integer, ForeignKey("machine.id"))
+    slot = Column(String)
+    product_id = Column(Integer, ForeignKey("product.id"))
+    amount_available = Column(Integer)
+
+    machine = relationship("Machine", back_populates="slots")
+    product = relationship("Product")
+
+
+class Notification(Base):
+    """
+    Notification raised by a background job for a user, e.g. a low stock alert.
+    `key` identifies what it is about so the same alert isn't raised twice.
+    """
+
+    __tablename__ = "notification"
+    __table_args__ = (UniqueConstraint("user_id", "kind", "key"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("user.id"), index=True)
+    kind = Column(String)
+    key = Column(String)
+    message = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class ChangeLog(Base):
+    """
+    Invalidation broadcast by a worker process, the other workers sharing the
+    database drop what they cached about `key`. See `core.coherence`.
+    """
+
+    __tablename__ = "change_log"
+    # ids are never reused, even once the oldest rows are pruned
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    id = Column(Integer, primary_key=True)
+    origin = Column(Integer)
+    topic = Column(String)
+    key = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+def create_schema(engine):
+    """
+    Create the missing tables, and the columns and indexes added to the existing
+    ones since.
+    A sqlite database is switched to WAL journaling: the reads don't wait for the
+    writes, and the online snapshots of `core.backup` never restart.
+    :param engine: database engine
+    """
+    Base.metadata.create_all(bind=engine)
+    if engine.dialect.name == "sqlite":
+        with engine.connect() as connection:
+            # persistent, every later connection uses it, a no-op in memory
+            connection.exec_driver_sql("PRAGMA journal_mode=WAL")
+    with engine.begin() as connection:
+        columns = {column["name"] for column in inspect(connection).get_columns("user")}
+        if "deposit_updated_at" not in columns:
+            connection.exec_driver_sql(
+                'ALTER TABLE "user" ADD COLUMN deposit_updated_at DATETIME'
+            )
+            # the deposits are considered changed at the upgrade
+            connection.execute(
+                User.__table__.update().values(deposit_updated_at=datetime.utcnow())
+            )
+    # `create_all` leaves the indexes of the existing tables alone
+    for index in User.__table__.indexes:
+        index.create(engine, checkfirst=True)
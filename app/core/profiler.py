@@ -0,0 +1,259 @@
+import json
+import os
+import random
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Dict, Optional, Set, Tuple
+
+import fastapi.concurrency
+import fastapi.dependencies.utils
+import fastapi.routing
+from starlette.concurrency import run_in_threadpool
+
+from core.request_context import route_template
+
+PROFILE_HEADER = b"x-profile"
+
+Stack = Tuple[Tuple[str, str, int], ...]
+
+
+def _frame_stack(frame) -> Stack:
+    """
+    Turn a frame into a root first stack of (function, file, line) tuples
+    """
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+        frame = frame.f_back
+    stack.reverse()
+    return tuple(stack)
+
+
+class RequestSampler:
+    """
+    Sampling profiler for a single request.
+
+    A background thread snapshots the stacks of the event loop thread and of the
+    thread pool workers while they run work of this request (sync dependencies and
+    endpoints, response validation), every `interval` seconds.
+    """
+
+    def __init__(self, scope, interval: float):
+        self.scope = scope
+        self.interval = interval
+        self.loop_thread = threading.get_ident()
+        self.samples: Counter = Counter()
+        self._lock = threading.Lock()
+        self._workers: Set[int] = set()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="request-sampler", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def enter_worker(self):
+        """
+        The current thread pool worker starts running work of the request
+        """
+        with self._lock:
+            self._workers.add(threading.get_ident())
+
+    def exit_worker(self):
+        with self._lock:
+            self._workers.discard(threading.get_ident())
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                workers = set(self._workers)
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.loop_thread:
+                    self.samples[("event-loop", _frame_stack(frame))] += 1
+                elif thread_id in workers:
+                    self.samples[("worker", _frame_stack(frame))] += 1
+
+
+# sampler of the request being handled, None when it isn't profiled
+_active_sampler: ContextVar[Optional[RequestSampler]] = ContextVar(
+    "active_sampler", default=None
+)
+
+
+async def _run_in_threadpool(func, *args, **kwargs):
+    """
+    `run_in_threadpool` telling the sampler of a profiled request which worker runs
+    its work
+    """
+    sampler = _active_sampler.get()
+    if sampler is None:
+        return await run_in_threadpool(func, *args, **kwargs)
+
+    def tracked():
+        sampler.enter_worker()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            sampler.exit_worker()
+
+    return await run_in_threadpool(tracked)
+
+
+def track_threadpool_work():
+    """
+    Send the thread pool work of FastAPI through `_run_in_threadpool`
+    """
+    for module in (fastapi.routing, fastapi.dependencies.utils, fastapi.concurrency):
+        module.run_in_threadpool = _run_in_threadpool
+
+
+def _frame_name(frame: Tuple[str, str, int]) -> str:
+    name, filename, line = frame
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+def write_profile(
+    output_dir: str, samples: Counter, interval: float, metadata: Dict
+) -> str:
+    """
+    Save the samples of a request as collapsed stacks (`.folded`), a speedscope
+    profile (`.speedscope.json`) and the request metadata (`.meta.json`)
+    :param output_dir: directory to write in
+    :param samples: (thread kind, stack) -> number of samples
+    :param interval: sampling interval in seconds
+    :param metadata: route, method, status and latency of the request
+    :return: common path prefix of the written files
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    route = (
+        metadata["route"].strip("/").replace("/", "_").replace("{", "").replace("}", "")
+    )
+    stem = os.path.join(
+        output_dir,
+        f"{time.strftime('%Y%m%dT%H%M%S')}-{secrets.token_hex(3)}-"
+        f"{metadata['method']}-{route or 'root'}-{metadata['latency_ms']:.0f}ms",
+    )
+
+    with open(f"{stem}.folded", "w") as folded:
+        for (kind, stack), count in samples.most_common():
+            frames = ";".join([kind] + [_frame_name(frame) for frame in stack])
+            folded.write(f"{frames} {count}\n")
+
+    frames, frame_index, speedscope_samples, weights = [], {}, [], []
+    for (kind, stack), count in samples.items():
+        indexes = []
+        for frame in ((kind, "", 0),) + stack:
+            if frame not in frame_index:
+                frame_index[frame] = len(frames)
+                frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+            indexes.append(frame_index[frame])
+        speedscope_samples.append(indexes)
+        weights.append(count * interval)
+    with open(f"{stem}.speedscope.json", "w") as speedscope:
+        json.dump(
+            {
+                "$schema": "https://www.speedscope.app/file-format-schema.json",
+                "exporter": "vending-machine-api",
+                "name": f"{metadata['method']} {metadata['route']}",
+                "shared": {"frames": frames},
+                "profiles": [
+                    {
+                        "type": "sampled",
+                        "name": f"{metadata['method']} {metadata['route']}",
+                        "unit": "seconds",
+                        "startValue": 0,
+                        "endValue": sum(weights),
+                        "samples": speedscope_samples,
+                        "weights": weights,
+                    }
+                ],
+            },
+            speedscope,
+        )
+
+    with open(f"{stem}.meta.json", "w") as meta:
+        json.dump(
+            dict(metadata, samples=sum(samples.values()), interval=interval), meta
+        )
+
+    return stem
+
+
+class ProfilerMiddleware:
+    """
+    Profile the requests carrying the `X-Profile: <token>` header, plus a random
+    `sample_rate` share of all the requests. Only added to the app when profiling
+    is configured, so it costs nothing otherwise.
+    """
+
+    def __init__(
+        self,
+        app,
+        output_dir: str,
+        token: Optional[str] = None,
+        sample_rate: float = 0.0,
+        interval: float = 0.005,
+    ):
+        self.app = app
+        self.output_dir = output_dir
+        self.token = token.encode() if token else None
+        self.sample_rate = sample_rate
+        self.interval = interval
+        # only once profiling is configured, the work of the other requests just
+        # goes through one more function call
+        track_threadpool_work()
+
+    def _should_profile(self, scope) -> bool:
+        if self.token is not None:
+            for name, value in scope.get("headers", []):
+                if name == PROFILE_HEADER and secrets.compare_digest(value, self.token):
+                    return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        status = {}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        sampler = RequestSampler(scope, self.interval)
+        token = _active_sampler.set(sampler)
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            latency = time.perf_counter() - started
+            sampler.stop()
+            _active_sampler.reset(token)
+            metadata = {
+                "route": route_template(scope),
+                "path": scope.get("path"),
+                "method": scope.get("method"),
+                "status": status.get("code"),
+                "latency_ms": latency * 1000,
+                "started_at": time.time() - latency,
+            }
+            await run_in_threadpool(
+                write_profile,
+                self.output_dir,
+                sampler.samples,
+                self.interval,
+                metadata,
+            )
@@ -0,0 +1,278 @@
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+
+from core import utils
+from product.serializers import ProductCreate
+from user.serializers import UserBase, User
+
+
+class WriteConflict(Exception):
+    """
+    A row changed between the moment it was read and the moment it was written,
+    what was written in the transaction is rolled back
+    """
+
+
+class PurchaseConflict(WriteConflict):
+    """
+    The deposit of the buyer or the stock of the product changed while buying
+    """
+
+
+class UsernameTaken(WriteConflict):
+    """
+    Another transaction registered the username since it was checked
+    """
+
+
+class Repository(ABC):
+    """
+    Storage of the users, products and purchases used by the views.
+    Writes become visible to everyone when `commit` is called, `rollback` drops them.
+    """
+
+    @abstractmethod
+    def authenticate_user(
+        self,
+        username: str,
+        password: str,
+        *,
+        admin_requester=False,
+        buyer_requester=False
+    ):
+        """
+        Authenticate a user, see `core.utils.authenticate_user`
+        :return: (True, user) or (False, status code, reason)
+        """
+
+    @abstractmethod
+    def get_user(self, username: str):
+        pass
+
+    @abstractmethod
+    def get_user_by_id(self, user_id: int):
+        pass
+
+    @abstractmethod
+    def create_user(self, user: User):
+        """
+        Create a user
+        :raise UsernameTaken: when the username was registered meanwhile
+        """
+
+    @abstractmethod
+    def update_user(self, username: str, new_user_details: UserBase):
+        pass
+
+    @abstractmethod
+    def update_user_deposit(self, username: str, deposit: int):
+        """
+        Set the deposit of a user, computed from the deposit it was loaded with
+        :raise WriteConflict: when the deposit changed since it was loaded
+        """
+
+    @abstractmethod
+    def remove_user(self, username: str) -> int:
+        pass
+
+    @abstractmethod
+    def remove_users(self, usernames: List[str]) -> Dict[str, str]:
+        """
+        Remove users, with the products of the sellers
+        :return: username -> `utils.DELETED` or `utils.NOT_FOUND`
+        """
+
+    @abstractmethod
+    def reset_deposits(
+        self,
+        usernames: Optional[List[str]] = None,
+        min_deposit: Optional[int] = None,
+        max_deposit: Optional[int] = None,
+    ) -> Dict[str, str]:
+        """
+        Reset the deposit of some buyers to zero, see `core.utils.reset_deposits`
+        :return: username -> `utils.RESET`, `utils.NOT_BUYER` or `utils.NOT_FOUND`
+        """
+
+    @abstractmethod
+    def change_roles(self, usernames: List[str], role: str) -> Dict[str, str]:
+        """
+        Give the same role to some users
+        :return: username -> `utils.UPDATED`, `utils.UNCHANGED` or `utils.NOT_FOUND`
+        """
+
+    @abstractmethod
+    def create_user_product(self, product: ProductCreate, seller_id: int):
+        pass
+
+    @abstractmethod
+    def get_product_for_user(self, product_name: str, seller_id: int):
+        pass
+
+    @abstractmethod
+    def get_product_by_id(self, product_id: int):
+        pass
+
+    @abstractmethod
+    def get_all_products(self, product_name: str):
+        pass
+
+    @abstractmethod
+    def get_products_json(self, product_name: str) -> bytes:
+        """
+        Same products as `get_all_products`, encoded as the JSON body of a response
+        """
+
+    @abstractmethod
+    def remove_product(self, product_name: str, seller_id: int) -> int:
+        pass
+
+    @abstractmethod
+    def update_product(
+        self, product_name: str, seller_id: int, new_product_details: ProductCreate
+    ):
+        pass
+
+    @abstractmethod
+    def update_product_amount_available_by_id(
+        self, product_id: int, new_available_amount: int
+    ):
+        pass
+
+    @abstractmethod
+    def purchase(self, user, product, amount: int) -> int:
+        """
+        Take the cost of `amount` products from the buyer deposit and the amount from
+        the product stock
+        :param user: the buyer, as returned by the repository
+        :param product: the product, as returned by the repository
+        :param amount: amount of product
+        :return: the deposit left to the buyer
+        :raise PurchaseConflict: when the deposit or stock isn't enough anymore
+        """
+
+    @abstractmethod
+    def commit(self):
+        pass
+
+    @abstractmethod
+    def rollback(self):
+        pass
+
+
+class SqlAlchemyRepository(Repository):
+    """
+    Repository on top of a SQLAlchemy session and the `core.utils` helpers
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def authenticate_user(
+        self,
+        username: str,
+        password: str,
+        *,
+        admin_requester=False,
+        buyer_requester=False
+    ):
+        return utils.authenticate_user(
+            self.db,
+            username,
+            password,
+            admin_requester=admin_requester,
+            buyer_requester=buyer_requester,
+        )
+
+    def get_user(self, username: str):
+        return utils.get_user(self.db, username)
+
+    def get_user_by_id(self, user_id: int):
+        return utils.get_user_by_id(self.db, user_id)
+
+    def create_user(self, user: User):
+        try:
+            return utils.create_user(self.db, user)
+        except IntegrityError:
+            self.db.rollback()
+            raise UsernameTaken()
+
+    def update_user(self, username: str, new_user_details: UserBase):
+        return utils.update_user(self.db, username, new_user_details)
+
+    def update_user_deposit(self, username: str, deposit: int):
+        try:
+            return utils.update_user_deposit(self.db, username, deposit)
+        except StaleDataError:
+            self.db.rollback()
+            raise WriteConflict()
+
+    def remove_user(self, username: str) -> int:
+        return utils.remove_user(self.db, username)
+
+    def remove_users(self, usernames: List[str]) -> Dict[str, str]:
+        return utils.remove_users(self.db, usernames)
+
+    def reset_deposits(
+        self,
+        usernames: Optional[List[str]] = None,
+        min_deposit: Optional[int] = None,
+        max_deposit: Optional[int] = None,
+    ) -> Dict[str, str]:
+        return utils.reset_deposits(self.db, usernames, min_deposit, max_deposit)
+
+    def change_roles(self, usernames: List[str], role: str) -> Dict[str, str]:
+        return utils.change_roles(self.db, usernames, role)
+
+    def create_user_product(self, product: ProductCreate, seller_id: int):
+        return utils.create_user_product(self.db, product, seller_id)
+
+    def get_product_for_user(self, product_name: str, seller_id: int):
+        return utils.get_product_for_user(self.db, product_name, seller_id)
+
+    def get_product_by_id(self, product_id: int):
+        return utils.get_product_by_id(self.db, product_id)
+
+    def get_all_products(self, product_name: str):
+        return utils.get_all_products(self.db, product_name)
+
+    def get_products_json(self, product_name: str) -> bytes:
+        return utils.get_products_json(self.db, product_name)
+
+    def remove_product(self, product_name: str, seller_id: int) -> int:
+        return utils.remove_product(self.db, product_name, seller_id)
+
+    def update_product(
+        self, product_name: str, seller_id: int, new_product_details: ProductCreate
+    ):
+        return utils.update_product(
+            self.db, product_name, seller_id, new_product_details
+        )
+
+    def update_product_amount_available_by_id(
+        self, product_id: int, new_available_amount: int
+    ):
+        return utils.update_product_amount_available_by_id(
+            self.db, product_id, new_available_amount
+        )
+
+    def purchase(self, user, product, amount: int) -> int:
+        # conditional decrements, a concurrent purchase can't take the same money
+        # or stock twice
+        db_user = utils.take_user_deposit(self.db, user.id, amount * product.cost)
+        if db_user is None or not utils.take_product_amount(
+            self.db, product.id, amount
+        ):
+            self.db.rollback()
+            raise PurchaseConflict()
+        return db_user.deposit
+
+    def commit(self):
+        self.db.commit()
+
+    def rollback(self):
+        self.db.rollback()
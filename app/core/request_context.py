@@ -0,0 +1,74 @@
+import base64
+from contextvars import ContextVar
+from typing import Optional
+
+from starlette.routing import Match
+
+
+def route_template(scope) -> str:
+    """
+    Path template of the route matching the request, e.g. `/product/{product_name}`
+    :param scope: ASGI scope of the request
+    :return: the route path, or the raw path when no route matches
+    """
+    app = scope.get("app")
+    for route in getattr(getattr(app, "router", None), "routes", []):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return scope.get("path", "")
+
+
+def basic_auth_username(scope) -> Optional[str]:
+    """
+    Username of the basic auth credentials of a request, the password is ignored
+    :param scope: ASGI scope of the request
+    :return: the username or None
+    """
+    for name, value in scope.get("headers", []):
+        if name == b"authorization":
+            scheme, _, credentials = value.decode("latin-1").partition(" ")
+            if scheme.lower() != "basic":
+                return None
+            try:
+                decoded = base64.b64decode(credentials).decode("utf-8")
+            except ValueError:
+                return None
+            return decoded.partition(":")[0]
+    return None
+
+
+# ASGI scope of the request being served, visible from the thread pool as well
+current_scope: ContextVar[Optional[dict]] = ContextVar("current_scope", default=None)
+
+
+def current_route() -> Optional[str]:
+    """
+    Route template of the request being served
+    :return: the route path or None outside of a request
+    """
+    scope = current_scope.get()
+    if scope is None:
+        return None
+    return f"{scope.get('method')} {route_template(scope)}"
+
+
+class RequestContextMiddleware:
+    """
+    Make the request being served reachable through `current_scope`.
+    The route itself is only resolved when someone asks for it.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        token = current_scope.set(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_scope.reset(token)
@@ -0,0 +1,203 @@
+import asyncio
+import fcntl
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from core.settings import settings
+
+
+class Job:
+    """
+    A sync function run in the thread pool, every `interval` seconds (plus up to
+    `jitter` seconds) and/or whenever it's triggered
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[], Any],
+        interval: Optional[float] = None,
+        jitter: float = 0.0,
+    ):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+        self.pending = 0
+        self.waiting = False
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.last_started: Optional[float] = None
+        self.last_duration: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.wakeup: Optional[asyncio.Event] = None
+
+    def next_delay(self) -> Optional[float]:
+        if self.interval is None:
+            return None
+        return self.interval + random.uniform(0, self.jitter)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "interval": self.interval,
+            "running": self.running,
+            "waiting": self.waiting,
+            "pending_triggers": self.pending,
+            "runs": self.runs,
+            "failures": self.failures,
+            "last_run": self.last_started,
+            "last_duration": self.last_duration,
+            "last_error": self.last_error,
+        }
+
+
+class LeaderLock:
+    """
+    Elects the worker process running the jobs only one of the workers sharing a
+    database must run: the one holding an exclusive lock on a file. The others try
+    again at every run, one of them takes over when the leader exits.
+    """
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def acquire(self) -> bool:
+        """
+        Become the leader if there is none
+        :return: whether this process is the leader, always without a lock file
+        """
+        if self.path is None:
+            return True
+        with self._lock:
+            if self._file is None:
+                file = open(self.path, "a")
+                try:
+                    fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    file.close()
+                    return False
+                self._file = file
+            return True
+
+    def release(self):
+        with self._lock:
+            if self._file is not None:
+                # closing the file releases the lock
+                self._file.close()
+                self._file = None
+
+
+class Scheduler:
+    """
+    In-process asyncio scheduler of the background jobs, so that batch work never
+    runs on the request path. At most `max_concurrency` jobs run at the same time,
+    triggers received while a job waits or runs are coalesced into one more run.
+    """
+
+    def __init__(self, max_concurrency: int = 2):
+        self.max_concurrency = max_concurrency
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def add_job(
+        self,
+        name: str,
+        func: Callable[[], Any],
+        interval: Optional[float] = None,
+        jitter: float = 0.0,
+    ) -> Job:
+        """
+        Register a job, before the scheduler is started
+        :param name: unique job name
+        :param func: sync function to run
+        :param interval: seconds between two runs, None for triggered only jobs
+        :param jitter: random seconds added to every interval
+        :return: the job
+        """
+        job = Job(name, func, interval, jitter)
+        self._jobs[name] = job
+        return job
+
+    def trigger(self, name: str):
+        """
+        Ask for a run of a job as soon as possible, can be called from any thread
+        :param name: job name
+        """
+        job = self._jobs.get(name)
+        if job is None:
+            return
+        with self._lock:
+            job.pending += 1
+            loop = self._loop
+        if loop is not None and job.wakeup is not None:
+            loop.call_soon_threadsafe(job.wakeup.set)
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        for job in self._jobs.values():
+            job.wakeup = asyncio.Event()
+            if job.pending:
+                job.wakeup.set()
+            self._tasks.append(asyncio.create_task(self._run_job(job)))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._loop = None
+
+    async def _run_job(self, job: Job):
+        while True:
+            try:
+                await asyncio.wait_for(job.wakeup.wait(), job.next_delay())
+            except asyncio.TimeoutError:
+                pass
+            job.wakeup.clear()
+
+            job.waiting = True
+            async with self._slots:
+                job.waiting = False
+                with self._lock:
+                    job.pending = 0
+                job.running = True
+                job.last_started = time.time()
+                started = time.perf_counter()
+                try:
+                    await self._loop.run_in_executor(None, job.func)
+                    job.last_error = None
+                except Exception as e:
+                    job.failures += 1
+                    job.last_error = repr(e)
+                finally:
+                    job.running = False
+                    job.runs += 1
+                    job.last_duration = time.perf_counter() - started
+
+    def status(self) -> Dict[str, Any]:
+        """
+        Status of the scheduler and its jobs
+        :return: last run, duration and backlog of every job
+        """
+        jobs = [job.status() for job in self._jobs.values()]
+        return {
+            "running": self._loop is not None,
+            "max_concurrency": self.max_concurrency,
+            "backlog": sum(
+                1 for job in self._jobs.values() if job.waiting or job.pending
+            ),
+            "jobs": jobs,
+        }
+
+
+scheduler = Scheduler(max_concurrency=settings.scheduler_max_concurrency)
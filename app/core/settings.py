@@ -0,0 +1,95 @@
+from typing import Literal, Optional
+
+from pydantic import BaseSettings
+
+
+class Settings(BaseSettings):
+    """
+    Runtime settings, every field can be overridden with a `VENDING_` env variable
+    (e.g. VENDING_PRODUCT_READ_STALE_SECONDS=1)
+    """
+
+    # where the users and products are stored: the database through SQLAlchemy,
+    # or an in-memory store living as long as the process (machines, fleet stock
+    # and background jobs need the database)
+    storage_backend: Literal["sqlalchemy", "memory"] = "sqlalchemy"
+
+    # primary database, all the writes go there
+    database_url: str = "sqlite:///my_db"
+    # replica used by the read-only handlers, a read-only connection to the
+    # primary sqlite file when unset
+    read_database_url: Optional[str] = None
+    # seconds the reads of a user stay on the primary after they wrote
+    read_your_writes_seconds: float = 5
+
+    # how long a finished product read can still be shared with new requests
+    product_read_stale_seconds: float = 0.5
+
+    # requests sending `X-Profile: <profile_token>` are profiled
+    profile_token: Optional[str] = None
+    # share of all the requests profiled at random, between 0 and 1
+    profile_sample_rate: float = 0.0
+    # seconds between two stack samples of a profiled request
+    profile_interval: float = 0.005
+    # where the collapsed stacks and speedscope files are saved
+    profile_dir: str = "profiles"
+
+    # statements slower than this many milliseconds are logged, disabled when unset
+    slow_query_ms: Optional[float] = None
+    # JSON lines file of the slow statements
+    slow_query_log: str = "slow_queries.jsonl"
+    # at most this many slow statements are logged per second
+    slow_query_max_per_second: float = 10
+
+    # when set, every request is recorded to this JSON lines file for `replay.py`
+    capture_path: Optional[str] = None
+
+    # events kept for the subscribers resuming the event stream
+    event_history_size: int = 1024
+    # keys a slow subscriber can have waiting before being asked to resync
+    event_queue_size: int = 256
+    # seconds between two keepalive comments of an idle event stream
+    event_keepalive_seconds: float = 15
+
+    # background jobs, started with the app
+    scheduler_enabled: bool = True
+    scheduler_max_concurrency: int = 2
+    # random seconds added to the interval of the periodic jobs
+    scheduler_jitter_seconds: float = 5
+    # file locked by the worker running the jobs only one worker must run, next to
+    # the sqlite database file when None
+    scheduler_leader_lock: Optional[str] = None
+    # products with this stock or less raise a notification to their seller
+    low_stock_threshold: int = 3
+    low_stock_interval_seconds: float = 300
+    # seconds between two rebuilds of the fleet-wide stock
+    fleet_refresh_interval_seconds: float = 600
+    # seconds between two rebuilds of the product catalog snapshot
+    catalog_refresh_interval_seconds: float = 600
+    # deposits left untouched this long are reported as stale
+    stale_deposit_seconds: float = 7 * 24 * 3600
+    # notifications older than this are removed
+    notification_retention_seconds: float = 30 * 24 * 3600
+    cleanup_interval_seconds: float = 3600
+
+    # multi-worker mode (see `serve.py`): seconds between two polls of the changes
+    # committed by the other workers, None when this is the only process
+    coherence_poll_seconds: Optional[float] = None
+    # changes older than this are pruned from the change log
+    coherence_retention_seconds: float = 600
+
+    # online snapshots of the database, see `core.backup`
+    snapshot_dir: str = "snapshots"
+    # seconds between two scheduled snapshots, None to only take them on demand
+    snapshot_interval_seconds: Optional[float] = None
+    # snapshots kept, the oldest are removed
+    snapshot_keep: int = 24
+    # pages copied per step, and seconds the copy pauses between two steps
+    snapshot_pages: int = 64
+    snapshot_pause_seconds: float = 0.002
+
+    class Config:
+        env_prefix = "VENDING_"
+
+
+settings = Settings()
@@ -0,0 +1,113 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class _Call:
+    """
+    One in-flight (or recently finished) execution shared by all the callers of a key
+    """
+
+    __slots__ = ("done", "result", "error", "finished_at")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.finished_at: Optional[float] = None
+
+
+class SingleFlight:
+    """
+    Collapse concurrent identical calls into a single execution.
+
+    Callers asking for a key while a call for it is in flight wait for that call
+    and get its result. Callers arriving up to `stale_seconds` after it finished
+    reuse the same result instead of running the call again.
+    """
+
+    def __init__(self, stale_seconds: float = 0.0, max_keys: int = 1024):
+        self.stale_seconds = stale_seconds
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._requests = 0
+        self._executions = 0
+
+    def _is_fresh(self, call: _Call, now: float) -> bool:
+        return call.finished_at is None or now - call.finished_at <= self.stale_seconds
+
+    def _sweep(self, now: float):
+        """
+        Drop the finished calls which are out of the staleness window
+        :param now: current monotonic time
+        """
+        for key in [k for k, c in self._calls.items() if not self._is_fresh(c, now)]:
+            del self._calls[key]
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Run `fn` for `key`, or join the call already running for it
+        :param key: what identifies identical calls
+        :param fn: the call to run when there's nothing to share
+        :return: the result of `fn`
+        """
+        with self._lock:
+            self._requests += 1
+            now = time.monotonic()
+            call = self._calls.get(key)
+            leader = call is None or not self._is_fresh(call, now)
+            if leader:
+                if len(self._calls) >= self.max_keys:
+                    self._sweep(now)
+                call = self._calls[key] = _Call()
+                self._executions += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                call.finished_at = time.monotonic()
+                # errors are never shared past the callers already waiting for them
+                if (
+                    call.error is not None or self.stale_seconds <= 0
+                ) and self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+
+        return call.result
+
+    def forget(self, key: Hashable):
+        """
+        Stop sharing the result of a key, e.g. after it was written to. A call still
+        in flight may have read before the write: the callers already waiting get
+        its result, the new callers start a fresh call.
+        :param key: key to forget
+        """
+        with self._lock:
+            self._calls.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Coalescing metrics
+        :return: requests, executions, coalesced requests and coalescing ratio
+        """
+        with self._lock:
+            requests, executions = self._requests, self._executions
+        coalesced = requests - executions
+        return {
+            "requests": requests,
+            "executions": executions,
+            "coalesced": coalesced,
+            "coalescing_ratio": coalesced / requests if requests else 0.0,
+            "stale_seconds": self.stale_seconds,
+        }
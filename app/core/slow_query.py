@@ -0,0 +1,187 @@
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from core.request_context import current_route
+
+MASK = "***"
+EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+
+def _calling_function(module: str = "core.utils") -> Optional[str]:
+    """
+    Name of the closest function of `module` in the current stack
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        if frame.f_globals.get("__name__") == module:
+            return frame.f_code.co_name
+        frame = frame.f_back
+    return None
+
+
+def _parameters(context, parameters):
+    """
+    Bound parameters of a statement, with the password ones masked
+    """
+    compiled = getattr(context, "compiled", None)
+    names = getattr(compiled, "positiontup", None)
+    if isinstance(parameters, dict):
+        return {
+            name: MASK if "password" in name else value
+            for name, value in parameters.items()
+        }
+    if names and len(names) == len(parameters):
+        return {
+            name: MASK if "password" in name else value
+            for name, value in zip(names, parameters)
+        }
+    return list(parameters)
+
+
+class _TokenBucket:
+    """
+    Allow `rate` events per second, with bursts up to `rate` events
+    """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self) -> bool:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class SlowQueryLog:
+    """
+    Log the statements slower than `threshold_ms` as JSON lines: statement, bound
+    parameters, duration, calling `core.utils` function and route. The first time a
+    statement is seen slow its `EXPLAIN QUERY PLAN` is logged too, for at most
+    `max_explained` statements.
+
+    Records are rate limited to `max_per_second` and written by a background thread,
+    so the log never slows down the queries themselves.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        threshold_ms: float,
+        max_per_second: float = 10,
+        max_explained: int = 1000,
+    ):
+        self.threshold = threshold_ms / 1000
+        self.max_explained = max_explained
+        self._bucket = _TokenBucket(max_per_second)
+        self._explained = set()
+        # set once `max_explained` statements were explained, no new plan after it
+        self._over_cap = max_explained <= 0
+        self._dropped = 0
+        self._lock = threading.Lock()
+
+        self.logger = logging.getLogger(f"vending.slow_query.{id(self)}")
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        records = queue.SimpleQueue()
+        self.logger.addHandler(QueueHandler(records))
+        file_handler = logging.FileHandler(path)
+        file_handler.setFormatter(logging.Formatter("%(message)s"))
+        self._listener = QueueListener(records, file_handler)
+        self._listener.start()
+
+    def install(self, engine: Engine):
+        """
+        Start timing the statements run by the engine
+        :param engine: engine to watch
+        """
+        event.listen(engine, "before_cursor_execute", self._before_execute)
+        event.listen(engine, "after_cursor_execute", self._after_execute)
+        event.listen(engine, "handle_error", self._handle_error)
+
+    def uninstall(self, engine: Engine):
+        event.remove(engine, "before_cursor_execute", self._before_execute)
+        event.remove(engine, "after_cursor_execute", self._after_execute)
+        event.remove(engine, "handle_error", self._handle_error)
+
+    def close(self):
+        """
+        Write the pending records and stop the writer thread
+        """
+        self._listener.stop()
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, many):
+        conn.info.setdefault("slow_query_started", []).append(time.perf_counter())
+
+    def _handle_error(self, context):
+        # a failed statement has no after_cursor_execute, drop its start time
+        conn = context.connection
+        started = conn.info.get("slow_query_started") if conn is not None else None
+        if started:
+            started.pop()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, many):
+        started = conn.info.get("slow_query_started")
+        if not started:
+            return
+        duration = time.perf_counter() - started.pop()
+        if duration < self.threshold:
+            return
+
+        if not self._bucket.take():
+            with self._lock:
+                self._dropped += 1
+            return
+
+        with self._lock:
+            dropped, self._dropped = self._dropped, 0
+            first_sighting = not self._over_cap and statement not in self._explained
+            if first_sighting:
+                self._explained.add(statement)
+                self._over_cap = len(self._explained) >= self.max_explained
+
+        record = {
+            "ts": time.time(),
+            "duration_ms": round(duration * 1000, 3),
+            "statement": statement,
+            "parameters": None if many else _parameters(context, parameters),
+            "function": _calling_function(),
+            "route": current_route(),
+        }
+        if dropped:
+            record["dropped_since_last"] = dropped
+        if (
+            first_sighting
+            and not many
+            and conn.dialect.name == "sqlite"
+            and statement.lstrip().upper().startswith(EXPLAINABLE)
+        ):
+            record["query_plan"] = self._query_plan(cursor, statement, parameters)
+
+        self.logger.info(json.dumps(record, default=str))
+
+    @staticmethod
+    def _query_plan(cursor, statement, parameters):
+        try:
+            rows = cursor.connection.execute(
+                f"EXPLAIN QUERY PLAN {statement}", parameters
+            ).fetchall()
+        except Exception as e:
+            return f"unavailable: {e}"
+        return [row[-1] for row in rows]
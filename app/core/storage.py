@@ -0,0 +1,35 @@
+from fastapi import Depends
+from sqlalchemy.orm import Session
+
+from core.database import get_db, get_read_db
+from core.memory import InMemoryRepository, InMemoryStore
+from core.repository import Repository, SqlAlchemyRepository
+from core.settings import settings
+
+# the in-memory store lives as long as the process
+memory_store = InMemoryStore() if settings.storage_backend == "memory" else None
+
+
+def get_sqlalchemy_repository(db: Session = Depends(get_db)) -> Repository:
+    return SqlAlchemyRepository(db)
+
+
+def get_sqlalchemy_read_repository(db: Session = Depends(get_read_db)) -> Repository:
+    return SqlAlchemyRepository(db)
+
+
+def get_memory_repository() -> Repository:
+    # like a session which is closed, whatever is left uncommitted is rolled back
+    repo = InMemoryRepository(memory_store)
+    try:
+        yield repo
+    finally:
+        repo.rollback()
+
+
+# Dependencies, the backend is picked once at startup
+if settings.storage_backend == "memory":
+    get_repository = get_read_repository = get_memory_repository
+else:
+    get_repository = get_sqlalchemy_repository
+    get_read_repository = get_sqlalchemy_read_repository
@@ -0,0 +1,126 @@
+import json
+import queue
+import threading
+import time
+from typing import Any
+from urllib.parse import quote
+
+from core.request_context import basic_auth_username, route_template
+
+# value written instead of any password found in a captured body
+REDACTED = "<redacted>"
+
+
+def sanitize(value: Any) -> Any:
+    """
+    Drop the passwords of a JSON body
+    :param value: decoded JSON body
+    :return: the same body with every `*password*` value redacted
+    """
+    if isinstance(value, dict):
+        return {
+            key: REDACTED if "password" in key.lower() else sanitize(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [sanitize(item) for item in value]
+    return value
+
+
+def raw_path(scope) -> str:
+    """
+    Path of a request as it was sent, still percent-encoded
+    :param scope: ASGI scope
+    :return: the path, replayed as is
+    """
+    raw = scope.get("raw_path")
+    if raw is None:
+        # not given by every server, the decoded path is encoded again
+        return quote(scope["path"])
+    return raw.decode("latin-1")
+
+
+class CaptureWriter:
+    """
+    Append-only JSON lines log written by a background thread
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._records = queue.SimpleQueue()
+        self._thread = threading.Thread(
+            target=self._run, name="traffic-capture", daemon=True
+        )
+        self._thread.start()
+
+    def write(self, record: dict):
+        self._records.put(record)
+
+    def close(self):
+        self._records.put(None)
+        self._thread.join()
+
+    def _run(self):
+        with open(self.path, "a") as capture:
+            while True:
+                record = self._records.get()
+                if record is None:
+                    return
+                capture.write(json.dumps(record, separators=(",", ":")) + "\n")
+                if self._records.empty():
+                    capture.flush()
+
+
+class CaptureMiddleware:
+    """
+    Record every request (route, params, body, status and timing) so it can be
+    replayed later with `replay.py`. Passwords are never written: only the username
+    of the credentials is kept and password fields of the bodies are redacted.
+    """
+
+    def __init__(self, app, path: str):
+        self.app = app
+        self.writer = CaptureWriter(path)
+        self.started = time.monotonic()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        body = []
+        status = {}
+
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] == "http.request":
+                body.append(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            duration = time.monotonic() - started
+            try:
+                payload = sanitize(json.loads(b"".join(body))) if any(body) else None
+            except ValueError:
+                payload = None
+            self.writer.write(
+                {
+                    "t": round(started - self.started, 6),
+                    "method": scope["method"],
+                    "route": route_template(scope),
+                    "path": raw_path(scope),
+                    "query": scope.get("query_string", b"").decode("latin-1"),
+                    "user": basic_auth_username(scope),
+                    "body": payload,
+                    "status": status.get("code"),
+                    "duration_ms": round(duration * 1000, 3),
+                }
+            )
@@ -1,10 +1,59 @@
+import json
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import String, and_, cast, update
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.exc import StaleDataError
 
 from core import models
+from core.catalog import catalog
+from core.coherence import change_feed
+from core.database import on_commit, patch_on_commit
+from core.events import event_bus, product_state, slot_state
+from core.fleet import fleet_stock
+from core.scheduler import scheduler
 from core.models import User
+from core.settings import settings
+from core.singleflight import SingleFlight
 from user.serializers import UserBase
 from product.serializers import ProductCreate
 
+# outcomes of the bulk operations, for every username
+DELETED = "deleted"
+RESET = "reset"
+UPDATED = "updated"
+UNCHANGED = "unchanged"
+NOT_FOUND = "not_found"
+NOT_BUYER = "not_buyer"
+
+# concurrent reads of the same product name share one query, see `get_all_products`
+product_reads = SingleFlight(stale_seconds=settings.product_read_stale_seconds)
+# what the other workers changed, see `core.coherence`
+change_feed.on("product", product_reads.forget)
+change_feed.on("product", catalog.invalidate)
+# skipped by the fleet stock when its last load already read them
+change_feed.follow(
+    "fleet",
+    lambda row_id, change: fleet_stock.apply(*_parse_delta(change), log_id=row_id),
+    own=False,
+)
+change_feed.on("fleet.removed", lambda key: fleet_stock.discard(int(key)))
+# the events of every worker, this one included, reach the event streams numbered
+# by the change log, see `_publish`
+change_feed.follow(
+    "event", lambda row_id, event: event_bus.publish(*json.loads(event), seq=row_id)
+)
+
+
+def _parse_delta(change: str):
+    """
+    Product id and delta of a stock change broadcast by `_record_stock_change`
+    """
+    product_id, _, delta = change.rpartition(":")
+    return int(product_id), int(delta)
+
 
 def authenticate_user(
     db: Session,
@@ -12,7 +61,7 @@ def authenticate_user(
     password: str,
     *,
     admin_requester=False,
-    buyer_requester=False
+    buyer_requester=False,
 ):
     """
     Method used to authenticate a user
@@ -23,7 +72,25 @@ def authenticate_user(
     :param buyer_requester: if the user should be a buyer
     :return: Bool
     """
-    check_user = get_user(db, username)
+    return check_credentials(
+        get_user(db, username),
+        password,
+        admin_requester=admin_requester,
+        buyer_requester=buyer_requester,
+    )
+
+
+def check_credentials(
+    check_user, password: str, *, admin_requester=False, buyer_requester=False
+):
+    """
+    Method used to check the password and role of a loaded user
+    :param check_user: the user, None when it doesn't exist
+    :param password: the password
+    :param admin_requester: if the user should be a admin
+    :param buyer_requester: if the user should be a buyer
+    :return: (True, user) or (False, status code, reason)
+    """
     if check_user is None or check_user.password != password:
         return False, 401, "Wrong credentials. Please try again"
 
@@ -38,6 +105,40 @@ def authenticate_user(
     return True, check_user
 
 
+def _get_loaded(db: Session, model, **filters):
+    """
+    Look for an instance the session already loaded, so it can be reused without a query
+    :param db: db session
+    :param model: model class of the instance
+    :param filters: attribute values the instance must have
+    :return: the instance or None
+    """
+    for instance in db.identity_map.values():
+        # an expired attribute would be loaded again, one query per instance
+        loaded = instance.__dict__
+        if type(instance) is model and all(
+            name in loaded and loaded[name] == value for name, value in filters.items()
+        ):
+            return instance
+    return None
+
+
+def _publish(db: Session, type: str, key: str, data: dict):
+    """
+    Publish an event to the event stream once the transaction is committed
+    :param db: db session
+    :param type: event type
+    :param key: entity the event is about
+    :param data: state of the entity, taken now
+    """
+    if change_feed.enabled:
+        # published by every worker once it reads it back from the change log,
+        # this one included, so the sequence numbers are the same everywhere
+        change_feed.broadcast(db, "event", json.dumps([type, key, data]))
+    else:
+        on_commit(db, lambda: event_bus.publish(type, key, data))
+
+
 def get_user(db: Session, username: str):
     """
     Method used to get the user info by username
@@ -45,6 +146,10 @@ def get_user(db: Session, username: str):
     :param username: username to get info for
     :return: user info
     """
+    # the user who authenticated the request is usually loaded already
+    db_user = _get_loaded(db, models.User, username=username)
+    if db_user is not None:
+        return db_user
     return db.query(models.User).filter(models.User.username == username).first()
 
 
@@ -65,9 +170,118 @@ def remove_user(db: Session, username: str):
     :param username: username to remove
     :return: removed user info
     """
-    stmt = db.query(models.User).filter(models.User.username == username).delete()
-    db.commit()
-    return stmt
+    return db.query(models.User).filter(models.User.username == username).delete()
+
+
+def remove_users(db: Session, usernames: List[str]) -> Dict[str, str]:
+    """
+    Remove users by username, with the products of the sellers, in a few set-based
+    statements
+    :param db: db session
+    :param usernames: usernames to remove
+    :return: username -> DELETED or NOT_FOUND
+    """
+    found = dict(
+        db.query(models.User.username, models.User.id).filter(
+            models.User.username.in_(usernames)
+        )
+    )
+    user_ids = list(found.values())
+    if user_ids:
+        _remove_products(
+            db,
+            db.query(
+                models.Product.id, models.Product.product_name, models.Product.seller_id
+            )
+            .filter(models.Product.seller_id.in_(user_ids))
+            .all(),
+        )
+        db.query(models.Notification).filter(
+            models.Notification.user_id.in_(user_ids)
+        ).delete(synchronize_session=False)
+        db.query(models.User).filter(models.User.id.in_(user_ids)).delete()
+    return {
+        username: DELETED if username in found else NOT_FOUND for username in usernames
+    }
+
+
+def reset_deposits(
+    db: Session,
+    usernames: Optional[List[str]] = None,
+    min_deposit: Optional[int] = None,
+    max_deposit: Optional[int] = None,
+) -> Dict[str, str]:
+    """
+    Reset the deposit of some buyers to zero with one statement
+    :param db: db session
+    :param usernames: the buyers, all the buyers matching the deposit filter if None
+    :param min_deposit: only the buyers holding at least this when filtering
+    :param max_deposit: only the buyers holding at most this when filtering
+    :return: username -> RESET, NOT_BUYER or NOT_FOUND
+    """
+    query = db.query(models.User.username, models.User.id, models.User.role)
+    if usernames is not None:
+        query = query.filter(models.User.username.in_(usernames))
+    else:
+        query = query.filter(models.User.role == "buyer")
+        if min_deposit is not None:
+            query = query.filter(models.User.deposit >= min_deposit)
+        if max_deposit is not None:
+            query = query.filter(models.User.deposit <= max_deposit)
+    rows = query.order_by(models.User.id).all()
+    found = {username: role for username, _, role in rows}
+    buyer_ids = [user_id for _, user_id, role in rows if role == "buyer"]
+    if buyer_ids:
+        db.query(models.User).filter(models.User.id.in_(buyer_ids)).update(
+            {
+                models.User.deposit: 0,
+                models.User.deposit_updated_at: datetime.utcnow(),
+            }
+        )
+    outcomes = {}
+    for username in found if usernames is None else usernames:
+        role = found.get(username)
+        if role is None:
+            outcomes[username] = NOT_FOUND
+        else:
+            outcomes[username] = RESET if role == "buyer" else NOT_BUYER
+    return outcomes
+
+
+def change_roles(db: Session, usernames: List[str], role: str) -> Dict[str, str]:
+    """
+    Give the same role to some users with one statement
+    :param db: db session
+    :param usernames: usernames to update
+    :param role: the new role
+    :return: username -> UPDATED, UNCHANGED or NOT_FOUND
+    """
+    found = dict(
+        db.query(models.User.username, models.User.role).filter(
+            models.User.username.in_(usernames)
+        )
+    )
+    changed = [username for username, old in found.items() if old != role]
+    if changed:
+        db.query(models.User).filter(models.User.username.in_(changed)).update(
+            {models.User.role: role}
+        )
+    outcomes = {}
+    for username in usernames:
+        if username not in found:
+            outcomes[username] = NOT_FOUND
+        else:
+            outcomes[username] = UPDATED if found[username] != role else UNCHANGED
+    return outcomes
+
+
+def hash_password(password: str) -> str:
+    """
+    Method used to turn a password into what is stored for the user
+    :param password: the password
+    :return: the stored password
+    """
+    return password + "notreallyhashed"
 
 
 def create_user(db: Session, user: User):
@@ -77,7 +291,7 @@ def create_user(db: Session, user: User):
     :param user: user info to use while creating it
     :return: the newly created user info
     """
-    fake_hash_password = user.password + "notreallyhashed"
+    fake_hash_password = hash_password(user.password)
     db_user = models.User(
         username=user.username,
         password=fake_hash_password,
@@ -85,8 +299,7 @@ def create_user(db: Session, user: User):
         role=user.role,
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    db.flush()
 
     return db_user
 
@@ -99,30 +312,108 @@ def update_user(db: Session, username: str, new_user_details: UserBase):
     :param new_user_details: new user info to update
     :return: newly updated user info
     """
-    db.query(models.User).filter(models.User.username == username).update(
-        new_user_details.dict()
-    )
+    db_user = get_user(db, username)
+    if db_user is None:
+        return None
 
-    db.commit()
+    if new_user_details.deposit != db_user.deposit:
+        db_user.deposit_updated_at = datetime.utcnow()
+    for field, value in new_user_details.dict().items():
+        setattr(db_user, field, value)
+    db.flush()
 
-    return get_user(db, username)
+    return db_user
 
 
 def update_user_deposit(db: Session, username: str, deposit: int):
     """
-    Update user deposit
+    Update user deposit, only if it's still the deposit the user was loaded with
     :param db: db session
     :param username: username to update
     :param deposit: deposit to add
     :return: updated user info
+    :raise StaleDataError: when the deposit was changed by someone else meanwhile
     """
-    db.query(models.User).filter(models.User.username == username).update(
-        {models.User.deposit: deposit}
+    db_user = get_user(db, username)
+    if db_user is None:
+        return None
+
+    db.flush()
+    now = datetime.utcnow()
+    # the new deposit was computed from the loaded one, so both must still match
+    result = db.execute(
+        update(models.User)
+        .where(models.User.id == db_user.id, models.User.deposit == db_user.deposit)
+        .values(deposit=deposit, deposit_updated_at=now)
+        .execution_options(synchronize_session=False)
     )
+    if result.rowcount != 1:
+        raise StaleDataError(f"The deposit of {username} changed meanwhile")
+    set_committed_value(db_user, "deposit", deposit)
+    set_committed_value(db_user, "deposit_updated_at", now)
 
-    db.commit()
+    return db_user
 
-    return get_user(db, username)
+
+def _take(db: Session, instance, field: str, amount: int, *criteria, **values):
+    """
+    Take an amount from a counter of a loaded instance in a single statement, never
+    below zero. The statement expects the loaded value, so the new one is known
+    without reading it back; only when it changed meanwhile is the amount taken
+    from whatever is left and the new value read.
+    :param db: db session
+    :param instance: the instance, as loaded by the session
+    :param field: name of the counter
+    :param amount: amount to take
+    :param criteria: more conditions the row must meet
+    :param values: other fields to set
+    :return: True when taken, False when less than `amount` is left
+    """
+    model = type(instance)
+    column = getattr(model, field)
+    loaded = getattr(instance, field)
+    db.flush()
+    if loaded >= amount:
+        result = db.execute(
+            update(model)
+            .where(model.id == instance.id, column == loaded, *criteria)
+            .values({field: loaded - amount, **values})
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 1:
+            set_committed_value(instance, field, loaded - amount)
+            for name, value in values.items():
+                set_committed_value(instance, name, value)
+            return True
+
+    result = db.execute(
+        update(model)
+        .where(model.id == instance.id, column >= amount, *criteria)
+        .values({field: column - amount, **values})
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        return False
+    db.refresh(instance, [field, *values])
+    return True
+
+
+def take_user_deposit(db: Session, user_id: int, total: int):
+    """
+    Take money from a user deposit in a single statement, never below zero
+    :param db: db session
+    :param user_id: user id
+    :param total: money to take
+    :return: updated user info, None when the deposit is lower than `total`
+    """
+    # `get` is answered from the identity map, the user is loaded by the auth
+    db_user = db.get(models.User, user_id)
+    if db_user is None or not _take(
+        db, db_user, "deposit", total, deposit_updated_at=datetime.utcnow()
+    ):
+        return None
+
+    return db_user
 
 
 def create_user_product(db: Session, product: ProductCreate, seller_id: int):
@@ -135,8 +426,10 @@ def create_user_product(db: Session, product: ProductCreate, seller_id: int):
     """
     db_item = models.Product(**product.dict(), seller_id=seller_id)
     db.add(db_item)
-    db.commit()
-    db.refresh(db_item)
+    db.flush()
+    _forget_product_reads(db, db_item.product_name)
+    _put_in_catalog(db, db_item, db_item.amount_available)
+    _publish(db, "product.created", f"product:{db_item.id}", product_state(db_item))
 
     return db_item
 
@@ -189,6 +482,16 @@ def get_all_products(db: Session, product_name: str):
     )
 
 
+def get_products_json(db: Session, product_name: str):
+    """
+    Get all product by name from the catalog snapshot, already encoded as JSON
+    :param db: db session, only queried when the snapshot must be read again
+    :param product_name: product name to get
+    :return: JSON list of products
+    """
+    return catalog.products_json(db, product_name)
+
+
 def remove_product(db: Session, product_name: str, seller_id: int):
     """
     Remove a product by name for seller id
@@ -197,15 +500,49 @@ def remove_product(db: Session, product_name: str, seller_id: int):
     :param seller_id: seller id for the product
     :return: removed product info
     """
-    stmt = (
-        db.query(models.Product)
+    products = (
+        db.query(
+            models.Product.id, models.Product.product_name, models.Product.seller_id
+        )
         .filter(
             models.Product.product_name == product_name,
             models.Product.seller_id == seller_id,
         )
-        .delete()
+        .all()
     )
-    db.commit()
+    return _remove_products(db, products)
+
+
+def _remove_products(db: Session, products):
+    """
+    Remove products, with their machine slots
+    :param db: db session
+    :param products: (id, product name, seller id) of the products
+    :return: removed products count
+    """
+    product_ids = [product_id for product_id, _, _ in products]
+    for product_id, product_name, seller_id in products:
+        _publish(
+            db,
+            "product.deleted",
+            f"product:{product_id}",
+            {"id": product_id, "productName": product_name, "sellerId": seller_id},
+        )
+    # the machines don't sell a removed product anymore
+    db.query(models.MachineSlot).filter(
+        models.MachineSlot.product_id.in_(product_ids)
+    ).delete(synchronize_session=False)
+    stmt = db.query(models.Product).filter(models.Product.id.in_(product_ids)).delete()
+
+    def forget():
+        for product_id in product_ids:
+            fleet_stock.discard(product_id)
+        catalog.discard(product_ids)
+
+    _forget_product_reads(db, *dict.fromkeys(name for _, name, _ in products))
+    patch_on_commit(db, forget)
+    for product_id in product_ids:
+        change_feed.broadcast(db, "fleet.removed", product_id)
     return stmt
 
 
@@ -220,14 +557,24 @@ def update_product(
     :param new_product_details: new product info to update
     :return: newly updated product info
     """
-    db.query(models.Product).filter(
-        models.Product.product_name == product_name,
-        models.Product.seller_id == seller_id,
-    ).update(new_product_details.dict())
-
-    db.commit()
+    db_product = _get_loaded(
+        db, models.Product, product_name=product_name, seller_id=seller_id
+    ) or get_product_for_user(db, product_name, seller_id)
+    if db_product is None:
+        return None
+
+    amount_available = db_product.amount_available
+    for field, value in new_product_details.dict().items():
+        setattr(db_product, field, value)
+    db.flush()
+
+    _forget_product_reads(db, product_name, new_product_details.product_name)
+    _put_in_catalog(db, db_product, db_product.amount_available - amount_available)
+    _publish(
+        db, "product.updated", f"product:{db_product.id}", product_state(db_product)
+    )
 
-    return get_product_for_user(db, product_name, seller_id)
+    return db_product
 
 
 def update_product_amount_available_by_id(
@@ -240,10 +587,401 @@ def update_product_amount_available_by_id(
     :param new_available_amount: new available amount
     :return: new updated product info
     """
-    db.query(models.Product).filter(models.Product.id == product_id).update(
-        {models.Product.amount_available: new_available_amount}
+    # `get` is answered from the identity map when the product was already loaded
+    db_product = db.get(models.Product, product_id)
+    if db_product is None:
+        return None
+
+    stock_delta = new_available_amount - db_product.amount_available
+    db_product.amount_available = new_available_amount
+    db.flush()
+    _product_stock_changed(db, db_product)
+    _put_in_catalog(db, db_product, stock_delta)
+
+    return db_product
+
+
+def take_product_amount(db: Session, product_id: int, amount: int):
+    """
+    Take an amount from the product stock in a single statement, never below zero
+    :param db: db session
+    :param product_id: product id
+    :param amount: amount to take
+    :return: updated product info, None when less than `amount` is available
+    """
+    # `get` is answered from the identity map when the product was already loaded
+    db_product = db.get(models.Product, product_id)
+    if db_product is None or not _take(db, db_product, "amount_available", amount):
+        return None
+
+    _product_stock_changed(db, db_product)
+    # a delta, the purchases committed meanwhile may be applied in any order
+    patch_on_commit(db, lambda: catalog.apply_stock(product_id, -amount))
+
+    return db_product
+
+
+def _product_stock_changed(db: Session, db_product: models.Product):
+    """
+    Invalidate and announce a new product stock once the transaction is committed
+    :param db: db session
+    :param db_product: product whose stock changed
+    """
+    _forget_product_reads(db, db_product.product_name)
+    if db_product.amount_available <= settings.low_stock_threshold:
+        # the seller gets notified in the background, not while buying
+        on_commit(db, lambda: scheduler.trigger("low_stock"))
+    _publish(db, "product.stock", f"product:{db_product.id}", product_state(db_product))
+
+
+def _put_in_catalog(db: Session, db_product: models.Product, stock_delta: int):
+    """
+    Put a product as it is now in the catalog snapshot once the transaction is
+    committed
+    :param db: db session
+    :param db_product: product created or updated
+    :param stock_delta: what the transaction added to its stock
+    """
+    row = (
+        db_product.id,
+        db_product.product_name,
+        db_product.amount_available,
+        db_product.cost,
+        db_product.seller_id,
     )
+    patch_on_commit(db, lambda: catalog.put(row, stock_delta))
+
+
+def _record_stock_change(db: Session, product_id: int, delta: int):
+    """
+    Keep the fleet-wide stock in sync once the transaction is committed
+    :param db: db session
+    :param product_id: product whose stock changed
+    :param delta: units added (positive) or taken (negative)
+    """
+    if delta:
+        patch_on_commit(db, lambda: fleet_stock.apply(product_id, delta))
+        change_feed.broadcast_delta(db, "fleet", product_id, delta)
+
+
+def _forget_product_reads(db: Session, *product_names: str):
+    """
+    Drop the cached reads of some product names once the transaction is committed,
+    in every worker
+    :param db: db session
+    :param product_names: product names whose reads are stale
+    """
+
+    def forget():
+        for product_name in product_names:
+            product_reads.forget(product_name)
+
+    patch_on_commit(db, forget)
+    for product_name in product_names:
+        change_feed.broadcast(db, "product", product_name)
 
-    db.commit()
 
-    return get_product_by_id(db, product_id)
+def create_machine(db: Session, name: str):
+    """
+    Create a machine
+    :param db: db session
+    :param name: unique machine name
+    :return: the newly created machine
+    """
+    db_machine = models.Machine(name=name)
+    db.add(db_machine)
+    db.flush()
+
+    return db_machine
+
+
+def get_machine(db: Session, machine_id: int):
+    """
+    Get a machine by id
+    :param db: db session
+    :param machine_id: machine id
+    :return: machine info
+    """
+    return db.get(models.Machine, machine_id)
+
+
+def get_machine_by_name(db: Session, name: str):
+    """
+    Get a machine by name
+    :param db: db session
+    :param name: machine name
+    :return: machine info
+    """
+    return db.query(models.Machine).filter(models.Machine.name == name).first()
+
+
+def get_machine_slots(db: Session, machine_id: int):
+    """
+    Get the inventory of a machine
+    :param db: db session
+    :param machine_id: machine id
+    :return: list of slots
+    """
+    return (
+        db.query(models.MachineSlot)
+        .filter(models.MachineSlot.machine_id == machine_id)
+        .order_by(models.MachineSlot.slot)
+        .all()
+    )
+
+
+def get_machine_slot(db: Session, machine_id: int, slot: str):
+    """
+    Get a slot of a machine
+    :param db: db session
+    :param machine_id: machine id
+    :param slot: slot code, e.g. `A1`
+    :return: slot info
+    """
+    return (
+        db.query(models.MachineSlot)
+        .filter(
+            models.MachineSlot.machine_id == machine_id,
+            models.MachineSlot.slot == slot,
+        )
+        .first()
+    )
+
+
+def get_machine_slot_for_product(db: Session, machine_id: int, product_id: int):
+    """
+    Get the slot of a machine selling a product
+    :param db: db session
+    :param machine_id: machine id
+    :param product_id: product id
+    :return: slot info
+    """
+    return (
+        db.query(models.MachineSlot)
+        .filter(
+            models.MachineSlot.machine_id == machine_id,
+            models.MachineSlot.product_id == product_id,
+        )
+        .first()
+    )
+
+
+def stock_machine_slot(
+    db: Session, machine_id: int, slot: str, product_id: int, amount_available: int
+):
+    """
+    Put a product with its stock in a slot of a machine, replacing what the slot held
+    :param db: db session
+    :param machine_id: machine id
+    :param slot: slot code
+    :param product_id: product id
+    :param amount_available: stock of the slot
+    :return: slot info
+    """
+    db_slot = get_machine_slot(db, machine_id, slot)
+    if db_slot is None:
+        db_slot = models.MachineSlot(
+            machine_id=machine_id, slot=slot, product_id=product_id, amount_available=0
+        )
+        db.add(db_slot)
+    elif db_slot.product_id != product_id:
+        _record_stock_change(db, db_slot.product_id, -db_slot.amount_available)
+        db_slot.product_id = product_id
+        db_slot.amount_available = 0
+
+    _record_stock_change(db, product_id, amount_available - db_slot.amount_available)
+    db_slot.amount_available = amount_available
+    db.flush()
+    _publish(db, "machine.stock", f"slot:{machine_id}:{slot}", slot_state(db_slot))
+
+    return db_slot
+
+
+def update_machine_slot_amount_available(
+    db: Session, db_slot: models.MachineSlot, new_available_amount: int
+):
+    """
+    Update the stock of a machine slot
+    :param db: db session
+    :param db_slot: the slot, as loaded by the session
+    :param new_available_amount: new available amount
+    :return: updated slot info
+    """
+    _record_stock_change(
+        db, db_slot.product_id, new_available_amount - db_slot.amount_available
+    )
+    db_slot.amount_available = new_available_amount
+    db.flush()
+    _publish(
+        db,
+        "machine.stock",
+        f"slot:{db_slot.machine_id}:{db_slot.slot}",
+        slot_state(db_slot),
+    )
+
+    return db_slot
+
+
+def take_machine_slot_amount(db: Session, db_slot: models.MachineSlot, amount: int):
+    """
+    Take an amount from the stock of a machine slot in a single statement, never
+    below zero
+    :param db: db session
+    :param db_slot: the slot, as loaded by the session
+    :param amount: amount to take
+    :return: updated slot info, None when less than `amount` is available
+    """
+    if not _take(
+        db,
+        db_slot,
+        "amount_available",
+        amount,
+        models.MachineSlot.product_id == db_slot.product_id,
+    ):
+        return None
+
+    _record_stock_change(db, db_slot.product_id, -amount)
+    _publish(
+        db,
+        "machine.stock",
+        f"slot:{db_slot.machine_id}:{db_slot.slot}",
+        slot_state(db_slot),
+    )
+
+    return db_slot
+
+
+def get_low_stock_products(db: Session, threshold: int):
+    """
+    Get the products running out of stock
+    :param db: db session
+    :param threshold: highest stock considered low
+    :return: list of products
+    """
+    return (
+        db.query(models.Product)
+        .filter(models.Product.amount_available <= threshold)
+        .all()
+    )
+
+
+def get_notifications(db: Session, user_id: int, kind: str = None):
+    """
+    Get the notifications of a user, the newest first
+    :param db: db session
+    :param user_id: user id
+    :param kind: only the notifications of this kind when given
+    :return: list of notifications
+    """
+    query = db.query(models.Notification).filter(models.Notification.user_id == user_id)
+    if kind is not None:
+        query = query.filter(models.Notification.kind == kind)
+    return query.order_by(models.Notification.created_at.desc()).all()
+
+
+def get_notification_keys(db: Session, kind: str):
+    """
+    Get the (user id, key) pairs of the notifications of a kind
+    :param db: db session
+    :param kind: notification kind
+    :return: set of (user id, key)
+    """
+    return set(
+        db.query(models.Notification.user_id, models.Notification.key).filter(
+            models.Notification.kind == kind
+        )
+    )
+
+
+def create_notification(db: Session, user_id: int, kind: str, key: str, message: str):
+    """
+    Create a notification for a user
+    :param db: db session
+    :param user_id: user to notify
+    :param kind: notification kind
+    :param key: what the notification is about
+    :param message: notification text
+    :return: the notification
+    """
+    db_notification = models.Notification(
+        user_id=user_id, kind=kind, key=key, message=message
+    )
+    db.add(db_notification)
+    db.flush()
+
+    return db_notification
+
+
+def remove_notification(db: Session, user_id: int, kind: str, key: str):
+    """
+    Remove a notification of a user
+    :param db: db session
+    :param user_id: notified user
+    :param kind: notification kind
+    :param key: what the notification is about
+    :return: removed notifications count
+    """
+    return (
+        db.query(models.Notification)
+        .filter(
+            models.Notification.user_id == user_id,
+            models.Notification.kind == kind,
+            models.Notification.key == key,
+        )
+        .delete(synchronize_session=False)
+    )
+
+
+def remove_notifications_before(
+    db: Session,
+    created_before: datetime,
+    low_stock_kind: str = None,
+    low_stock_threshold: int = None,
+):
+    """
+    Remove the old notifications, except the low stock ones still true
+    :param db: db session
+    :param created_before: notifications created before this are removed
+    :param low_stock_kind: kind of the low stock notifications, keyed by product id
+    :param low_stock_threshold: the `low_stock_kind` notifications of the products
+    still at or below it are kept
+    :return: removed notifications count
+    """
+    query = db.query(models.Notification).filter(
+        models.Notification.created_at < created_before
+    )
+    if low_stock_kind is not None:
+        still_low = (
+            db.query(models.Product.id)
+            .filter(
+                cast(models.Product.id, String) == models.Notification.key,
+                models.Product.seller_id == models.Notification.user_id,
+                models.Product.amount_available <= low_stock_threshold,
+            )
+            .exists()
+        )
+        query = query.filter(
+            ~and_(models.Notification.kind == low_stock_kind, still_low)
+        )
+    return query.delete(synchronize_session=False)
+
+
+def get_stale_deposits(db: Session, updated_before: datetime):
+    """
+    Get the buyers holding a deposit unchanged since a date, the oldest first
+    :param db: db session
+    :param updated_before: deposits changed after this aren't stale
+    :return: list of (username, deposit, deposit updated at)
+    """
+    return (
+        db.query(
+            models.User.username, models.User.deposit, models.User.deposit_updated_at
+        )
+        .filter(
+            models.User.role == "buyer",
+            models.User.deposit > 0,
+            models.User.deposit_updated_at < updated_before,
+        )
+        .order_by(models.User.deposit_updated_at)
+        .all()
+    )
@@ -0,0 +1,60 @@
+import asyncio
+import json
+from typing import Optional
+
+from fastapi import APIRouter, Header, Request
+from fastapi.responses import StreamingResponse
+
+from core.events import event_bus
+from core.settings import settings
+
+router = APIRouter()
+
+
+def format_event(seq: int, type: str, data: dict) -> str:
+    return f"id: {seq}\nevent: {type}\ndata: {json.dumps(data)}\n\n"
+
+
+@router.get("/events")
+async def stream_events(
+    request: Request,
+    since: Optional[int] = None,
+    last_event_id: Optional[int] = Header(None),
+) -> StreamingResponse:
+    """
+    Server-sent events of the product and machine stock changes.
+    Events of the same product or slot are coalesced for slow consumers, a
+    `resync` event tells the consumer it missed events and should reload the state.
+    :param request: the request
+    :param since: last sequence seen, to resume the stream
+    :param last_event_id: same as `since`, sent by the browsers when reconnecting
+    :return: the event stream
+    """
+    last_seq = last_event_id if last_event_id is not None else since
+    subscriber = event_bus.subscribe(asyncio.get_running_loop(), last_seq)
+
+    async def stream():
+        try:
+            while not await request.is_disconnected():
+                try:
+                    events, missed = await asyncio.wait_for(
+                        subscriber.get(), timeout=settings.event_keepalive_seconds
+                    )
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+
+                if missed:
+                    yield format_event(event_bus.seq, "resync", {"seq": event_bus.seq})
+                for event in events:
+                    yield format_event(
+                        event.seq, event.type, dict(event.data, seq=event.seq)
+                    )
+        finally:
+            event_bus.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
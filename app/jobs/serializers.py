@@ -0,0 +1,14 @@
+from datetime import datetime
+
+from core.serializers import CamelModel
+
+
+class Notification(CamelModel):
+    id: int
+    kind: str
+    key: str
+    message: str
+    created_at: datetime
+
+    class Config:
+        orm_mode = True
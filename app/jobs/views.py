@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+from typing import List
+
+from fastapi import Depends, APIRouter
+from sqlalchemy.orm import Session
+
+from core import utils
+from core.auth import require_read_admin, require_read_user
+from core.database import get_read_db
+from core.scheduler import scheduler
+from core.settings import settings
+from jobs.serializers import Notification
+
+router = APIRouter()
+
+
+@router.get("/jobs")
+def read_jobs_status(
+    auth_user=Depends(require_read_admin),
+):
+    """
+    Status of the background jobs
+    :param auth_user: the logged admin
+    :return: last run, duration, backlog and last error of every job
+    """
+    return scheduler.status()
+
+
+@router.get("/jobs/stale-deposits")
+def read_stale_deposits(
+    db: Session = Depends(get_read_db),
+    auth_user=Depends(require_read_admin),
+):
+    """
+    Report of the buyer deposits left untouched for long
+    :param db: database session
+    :param auth_user: the logged admin
+    :return: the stale deposits, the oldest first
+    """
+    now = datetime.utcnow()
+    stale = utils.get_stale_deposits(
+        db, now - timedelta(seconds=settings.stale_deposit_seconds)
+    )
+    return {
+        "generated_at": now,
+        "deposits": [
+            {
+                "username": username,
+                "deposit": deposit,
+                "unchanged_for": (now - updated_at).total_seconds(),
+            }
+            for username, deposit, updated_at in stale
+        ],
+    }
+
+
+@router.get("/notifications", response_model=List[Notification])
+def read_notifications(
+    db: Session = Depends(get_read_db),
+    auth_user=Depends(require_read_user),
+):
+    """
+    Notifications of the logged user, e.g. the low stock alerts of a seller
+    :param db: database session
+    :param auth_user: the logged user
+    :return: list of notifications
+    """
+    return utils.get_notifications(db, auth_user.id)
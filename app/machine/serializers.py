@@ -0,0 +1,30 @@
+from core.serializers import CamelModel
+
+
+class MachineCreate(CamelModel):
+    name: str
+
+
+class Machine(MachineCreate):
+    id: int
+
+    class Config:
+        orm_mode = True
+
+
+class SlotStock(CamelModel):
+    product_id: int
+    amount_available: int
+
+
+class MachineSlot(SlotStock):
+    machine_id: int
+    slot: str
+
+    class Config:
+        orm_mode = True
+
+
+class FleetProductStock(CamelModel):
+    product_id: int
+    amount_available: int
@@ -0,0 +1,188 @@
+from typing import List
+
+from fastapi import Depends, HTTPException, APIRouter
+from sqlalchemy.orm import Session
+
+from core import utils
+from core.auth import require_admin, require_buyer, require_seller
+from core.database import get_db, get_read_db
+from core.fleet import fleet_stock
+from machine.serializers import (
+    FleetProductStock,
+    Machine,
+    MachineCreate,
+    MachineSlot,
+    SlotStock,
+)
+from product.views import check_purchase
+
+router = APIRouter()
+
+
+def get_machine_or_404(db: Session, machine_id: int):
+    db_machine = utils.get_machine(db, machine_id)
+    if db_machine is None:
+        raise HTTPException(status_code=404, detail="Machine not found")
+    return db_machine
+
+
+@router.post("/machine", response_model=Machine)
+def create_machine(
+    machine: MachineCreate,
+    db: Session = Depends(get_db),
+    auth_user=Depends(require_admin),
+):
+    """
+    Register a machine of the fleet
+    :param machine: machine info
+    :param db: database session
+    :param auth_user: the logged admin
+    :return: the created machine
+    """
+    if utils.get_machine_by_name(db, machine.name):
+        raise HTTPException(status_code=400, detail="Machine already registered")
+
+    db_machine = utils.create_machine(db, machine.name)
+    db.commit()
+    return db_machine
+
+
+@router.get("/machine/{machine_id}/inventory", response_model=List[MachineSlot])
+def read_machine_inventory(machine_id: int, db: Session = Depends(get_read_db)):
+    """
+    Get the slots of a machine with their stock
+    :param machine_id: the machine id
+    :param db: database session
+    :return: list of slots
+    """
+    get_machine_or_404(db, machine_id)
+    return utils.get_machine_slots(db, machine_id)
+
+
+@router.put("/machine/{machine_id}/slot/{slot}", response_model=MachineSlot)
+def stock_machine_slot(
+    machine_id: int,
+    slot: str,
+    stock: SlotStock,
+    db: Session = Depends(get_db),
+    auth_user=Depends(require_seller),
+):
+    """
+    Put one of the seller products in a slot of a machine
+    :param machine_id: the machine id
+    :param slot: the slot code, e.g. `A1`
+    :param stock: product and stock of the slot
+    :param db: database session
+    :param auth_user: the logged seller
+    :return: the slot info
+    """
+    if stock.amount_available < 0:
+        raise HTTPException(status_code=400, detail="Stock can't be negative")
+
+    get_machine_or_404(db, machine_id)
+    db_product = utils.get_product_by_id(db, stock.product_id)
+    if db_product is None or db_product.seller_id != auth_user.id:
+        raise HTTPException(
+            status_code=400, detail="Product can't be found for the user"
+        )
+
+    # a seller only replaces what its own products left in the slot
+    db_slot = utils.get_machine_slot(db, machine_id, slot)
+    if db_slot is not None and db_slot.product_id != stock.product_id:
+        db_slot_product = utils.get_product_by_id(db, db_slot.product_id)
+        if db_slot_product is not None and db_slot_product.seller_id != auth_user.id:
+            raise HTTPException(
+                status_code=400,
+                detail="Slot is stocked with a product of another seller",
+            )
+
+    db_slot = utils.get_machine_slot_for_product(db, machine_id, stock.product_id)
+    if db_slot is not None and db_slot.slot != slot:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Product is already sold from slot {db_slot.slot} of the machine",
+        )
+
+    db_slot = utils.stock_machine_slot(
+        db, machine_id, slot, stock.product_id, stock.amount_available
+    )
+    db.commit()
+    return db_slot
+
+
+@router.get("/machine/{machine_id}/buy")
+def buy_product_from_machine(
+    machine_id: int,
+    product_id: int,
+    amount: int,
+    db: Session = Depends(get_db),
+    auth_user=Depends(require_buyer),
+):
+    """
+    Buy a product from the stock of one machine
+    :param machine_id: the machine the user buys from
+    :param product_id: the product id the user want to buy
+    :param amount: amount of product
+    :param db: database session
+    :param auth_user: the logged buyer
+    :return: total_spent, product_name, change
+    """
+    if amount <= 0:
+        raise HTTPException(status_code=400, detail="Amount must be positive")
+
+    db_slot = utils.get_machine_slot_for_product(db, machine_id, product_id)
+    if db_slot is None:
+        raise HTTPException(
+            status_code=400, detail="Product is not sold by this machine"
+        )
+    product_info = utils.get_product_by_id(db, product_id)
+
+    check_purchase(
+        auth_user.deposit, product_info.cost, db_slot.amount_available, amount
+    )
+
+    # only the slot row of this machine is written, never the product row;
+    # conditional decrements, a concurrent purchase can't take the same money
+    # or stock twice
+    db_user = utils.take_user_deposit(db, auth_user.id, amount * product_info.cost)
+    if db_user is None or not utils.take_machine_slot_amount(db, db_slot, amount):
+        db.rollback()
+        raise HTTPException(
+            status_code=409,
+            detail="Your deposit or the product stock changed. Please try again",
+        )
+    user_change = db_user.deposit
+    db.commit()
+
+    return {
+        "total_spent": amount,
+        "product_name": product_info.product_name,
+        "change": user_change,
+        "machine_id": machine_id,
+    }
+
+
+@router.get("/fleet/stock", response_model=List[FleetProductStock])
+def read_fleet_stock(db: Session = Depends(get_read_db)):
+    """
+    Get the stock of every product summed over all the machines
+    :param db: database session
+    :return: list of product stocks
+    """
+    return [
+        FleetProductStock(product_id=product_id, amount_available=total)
+        for product_id, total in sorted(fleet_stock.totals(db).items())
+    ]
+
+
+@router.get("/fleet/stock/{product_id}", response_model=FleetProductStock)
+def read_fleet_product_stock(product_id: int, db: Session = Depends(get_read_db)):
+    """
+    Get the stock of a product summed over all the machines
+    :param product_id: the product id
+    :param db: database session
+    :return: product stock
+    """
+    return FleetProductStock(
+        product_id=product_id, amount_available=fleet_stock.total(db, product_id)
+    )
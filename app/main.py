@@ -1,4 +1,18 @@
 from fastapi import FastAPI
+
+from admin.views import router as admin_api
+from core.coherence import change_feed
+from core.database import engine
+from core.events import event_bus
+from core.jobs import leader, register_jobs
+from core.profiler import ProfilerMiddleware
+from core.request_context import RequestContextMiddleware
+from core.scheduler import scheduler
+from core.settings import settings
+from core.traffic import CaptureMiddleware
+from events.views import router as events_api
+from jobs.views import router as jobs_api
+from machine.views import router as machine_api
 from product.views import router as product_api
 from user.views import router as user_api
 
@@ -13,3 +27,59 @@ app = FastAPI(
 ###
 app.include_router(product_api, tags=["Product"])
 app.include_router(user_api, tags=["User"])
+app.include_router(events_api, tags=["Events"])
+if settings.storage_backend == "sqlalchemy":
+    # machines, background jobs and snapshots only run on the database
+    app.include_router(machine_api, tags=["Machine"])
+    app.include_router(jobs_api, tags=["Jobs"])
+    app.include_router(admin_api, tags=["Admin"])
+
+###
+# Register middlewares
+###
+if settings.capture_path:
+    app.add_middleware(CaptureMiddleware, path=settings.capture_path)
+if settings.slow_query_ms is not None:
+    # lets the slow query log know the route of a query
+    app.add_middleware(RequestContextMiddleware)
+if settings.profile_token or settings.profile_sample_rate > 0:
+    app.add_middleware(
+        ProfilerMiddleware,
+        output_dir=settings.profile_dir,
+        token=settings.profile_token,
+        sample_rate=settings.profile_sample_rate,
+        interval=settings.profile_interval,
+    )
+
+
+###
+# Background jobs
+###
+@app.on_event("startup")
+async def start_scheduler():
+    if settings.scheduler_enabled and settings.storage_backend == "sqlalchemy":
+        register_jobs(scheduler)
+        await scheduler.start()
+
+
+@app.on_event("shutdown")
+async def stop_scheduler():
+    await scheduler.stop()
+    # another worker takes the singleton jobs over
+    leader.release()
+
+
+###
+# Cache coherence between the workers, see `serve.py`
+###
+@app.on_event("startup")
+def start_change_feed():
+    if change_feed.enabled and settings.storage_backend == "sqlalchemy":
+        change_feed.start(engine, settings.coherence_poll_seconds)
+        # the events are numbered by the change log, see `core.utils._publish`
+        event_bus.start_at(change_feed.last_id)
+
+
+@app.on_event("shutdown")
+def stop_change_feed():
+    change_feed.stop()
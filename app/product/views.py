@@ -1,97 +1,137 @@
 from fastapi import Depends, HTTPException, APIRouter
-from fastapi.security import HTTPBasicCredentials, HTTPBasic
-from sqlalchemy.orm import Session
-from fastapi.responses import JSONResponse
+from fastapi.responses import Response
 
 from core import utils, models
-from core.database import engine, SessionLocal
+from core.auth import require_buyer, require_user
+
+# re-exported, overriding it overrides the credentials of every view
+from core.auth import security
+from core.database import engine
+from core.repository import PurchaseConflict, Repository
+from core.settings import settings
+from core.storage import get_repository, get_read_repository
 from product.serializers import ProductCreate, Product
 
-models.Base.metadata.create_all(bind=engine)
+if settings.storage_backend == "sqlalchemy":
+    models.create_schema(engine)
 
 router = APIRouter()
-security = HTTPBasic()
 
 
-# Dependency
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+def check_purchase(user_deposit: int, cost: int, amount_available: int, amount: int):
+    """
+    Check if a buyer can buy an amount of a product, raise the reason otherwise
+    :param user_deposit: deposit of the buyer
+    :param cost: cost of one product
+    :param amount_available: stock the product is bought from
+    :param amount: amount the buyer wants
+    """
+    # check if user have enough deposit to buy the requested amount
+    if user_deposit < (amount * cost):
+        if user_deposit == 0:
+            raise HTTPException(
+                status_code=400, detail="Your balance is 0. Please refill your account"
+            )
+
+        # tell the user what amount he can buy
+        max_items_can_buy = user_deposit // cost
+        if max_items_can_buy > 0:
+            raise HTTPException(
+                status_code=400, detail=f"You can buy: {max_items_can_buy} pcs!"
+            )
+
+        # the user is not able to buy any item
+        raise HTTPException(
+            status_code=400,
+            detail=f"You can buy no pcs. Try deposit or chose another product!",
+        )
+
+    # check if the amount of product is available for sale
+    if amount_available < amount:
+        if amount_available == 0:
+            raise HTTPException(
+                status_code=400,
+                detail="No product amount available. Please try another product",
+            )
+        raise HTTPException(
+            status_code=400,
+            detail=f"Only {amount_available} pcs available",
+        )
 
 
 @router.post("/product", response_model=Product)
 def create_product_for_user(
     product: ProductCreate,
-    db: Session = Depends(get_db),
-    credentials: HTTPBasicCredentials = Depends(security),
+    repo: Repository = Depends(get_repository),
+    auth_user=Depends(require_user),
 ):
     """
     Create a product for the user
     :param product: product info
-    :param db: database session
-    :param credentials: user credentials
+    :param repo: users and products storage
+    :param auth_user: the logged user
     :return: the created product
     """
-    # first check if the credentials are ok
-    auth_user = utils.authenticate_user(db, credentials.username, credentials.password)
-    if not auth_user[0]:
-        raise HTTPException(status_code=auth_user[1], detail=auth_user[2])
-
-    if auth_user[1].role != "seller":
+    if auth_user.role != "seller":
         raise HTTPException(
             status_code=400, detail="Sorry but you have to be a seller to add a product"
         )
 
     # check if the product already exists fot the user
-    db_product = utils.get_product_for_user(
-        db, product_name=product.product_name, seller_id=auth_user[1].id
+    db_product = repo.get_product_for_user(
+        product_name=product.product_name, seller_id=auth_user.id
     )
     if db_product:
         raise HTTPException(
             status_code=400, detail="Product for user already registered"
         )
-    return utils.create_user_product(db=db, product=product, seller_id=auth_user[1].id)
+    db_product = repo.create_user_product(product=product, seller_id=auth_user.id)
+    repo.commit()
+    return db_product
 
 
 @router.get("/product/{product_name}")
 def read_product_by_product_name(
-    product_name: str, db: Session = Depends(get_db)
-) -> JSONResponse:
+    product_name: str, repo: Repository = Depends(get_read_repository)
+) -> Response:
     """
     Get a product info by name
     :param product_name: product ma,e
-    :param db: database session
+    :param repo: users and products storage
     :return: product info
     """
-    db_product = utils.get_all_products(db, product_name=product_name)
-    if db_product is None:
-        raise HTTPException(status_code=400, detail="Product not found")
-    return db_product
+    # identical lookups running at the same time share a single query, the body
+    # comes encoded already
+    body = utils.product_reads.do(
+        product_name, lambda: repo.get_products_json(product_name=product_name)
+    )
+    return Response(content=body, media_type="application/json")
+
+
+@router.get("/metrics/product-reads")
+def product_reads_metrics():
+    """
+    Coalescing metrics of the product read path
+    :return: requests, executions, coalesced requests and coalescing ratio
+    """
+    return utils.product_reads.stats()
 
 
 @router.delete("/product/{product_name}")
 def remove_product(
     product_name: str,
-    db: Session = Depends(get_db),
-    credentials: HTTPBasicCredentials = Depends(security),
+    repo: Repository = Depends(get_repository),
+    auth_user=Depends(require_user),
 ):
     """
     Remove a product for the logged user
     :param product_name: the product name
-    :param db: database session
-    :param credentials: user credentials
+    :param repo: users and products storage
+    :param auth_user: the logged user
     :return: the removed product
     """
-    # first check if the credentials are ok
-    auth_user = utils.authenticate_user(db, credentials.username, credentials.password)
-    if not auth_user[0]:
-        raise HTTPException(status_code=auth_user[1], detail=auth_user[2])
-
-    db_product = utils.get_product_for_user(
-        db, product_name=product_name, seller_id=auth_user[1].id
+    db_product = repo.get_product_for_user(
+        product_name=product_name, seller_id=auth_user.id
     )
 
     if not db_product:
@@ -100,7 +140,8 @@ def remove_product(
             detail="Sorry but can't find the product with the specified name for the user",
         )
 
-    utils.remove_product(db, product_name, auth_user[1].id)
+    repo.remove_product(product_name, auth_user.id)
+    repo.commit()
 
     return db_product
 
@@ -109,23 +150,18 @@ def remove_product(
 def update_product(
     product_name: str,
     new_product_details: ProductCreate,
-    db: Session = Depends(get_db),
-    credentials: HTTPBasicCredentials = Depends(security),
+    repo: Repository = Depends(get_repository),
+    auth_user=Depends(require_user),
 ):
     """
 
     :param product_name: the product name
     :param new_product_details: new product details to update
-    :param db: database session
-    :param credentials: user credentials
+    :param repo: users and products storage
+    :param auth_user: the logged user
     :return: new product info
     """
-    # first check if the credentials are ok
-    auth_user = utils.authenticate_user(db, credentials.username, credentials.password)
-    if not auth_user[0]:
-        raise HTTPException(status_code=auth_user[1], detail=auth_user[2])
-
-    db_product = utils.get_product_for_user(db, product_name, auth_user[1].id)
+    db_product = repo.get_product_for_user(product_name, auth_user.id)
 
     if not db_product:
         raise HTTPException(
@@ -133,86 +169,50 @@ def update_product(
         )
 
     # check if the new product_name is already taken
-    if utils.get_product_for_user(
-        db, new_product_details.product_name, auth_user[1].id
-    ):
+    if repo.get_product_for_user(new_product_details.product_name, auth_user.id):
         raise HTTPException(
             status_code=400, detail="Sorry but there's already a product with this name"
         )
 
-    return utils.update_product(db, product_name, auth_user[1].id, new_product_details)
+    db_product = repo.update_product(product_name, auth_user.id, new_product_details)
+    repo.commit()
+    return db_product
 
 
 @router.get("/buy")
 def buy_product(
     product_id: int,
     amount: int,
-    db: Session = Depends(get_db),
-    credentials: HTTPBasicCredentials = Depends(security),
+    repo: Repository = Depends(get_repository),
+    auth_user=Depends(require_buyer),
 ):
     """
 
     :param product_id: the product id the user want to buy
     :param amount: amount of product
-    :param db: database session
-    :param credentials: user credentials
+    :param repo: users and products storage
+    :param auth_user: the logged buyer
     :return: total_spent, product_name, change
     """
-    # first check if the credentials/role are ok
-    auth_user = utils.authenticate_user(
-        db, credentials.username, credentials.password, buyer_requester=True
-    )
-    if not auth_user[0]:
-        if auth_user[1] == 401:
-            raise HTTPException(status_code=auth_user[1], detail=auth_user[2])
-        if auth_user[1] == 400:
-            raise HTTPException(
-                status_code=auth_user[1],
-                detail=auth_user[2],
-            )
+    if amount <= 0:
+        raise HTTPException(status_code=400, detail="Amount must be positive")
 
     # get product info
-    product_info = utils.get_product_by_id(db, product_id)
-
-    # check if user have enough deposit to buy the requested amount
-    if (user_deposit := auth_user[1].deposit) < (amount * product_info.cost):
-        if user_deposit == 0:
-            raise HTTPException(
-                status_code=400, detail="Your balance is 0. Please refill your account"
-            )
+    product_info = repo.get_product_by_id(product_id)
 
-        # tell the user what amount he can buy
-        max_items_can_buy = user_deposit // product_info.cost
-        if max_items_can_buy > 0:
-            raise HTTPException(
-                status_code=400, detail=f"You can buy: {max_items_can_buy} pcs!"
-            )
-
-        # the user is not able to buy any item
-        raise HTTPException(
-            status_code=400,
-            detail=f"You can buy no pcs. Try deposit or chose another product!",
-        )
+    check_purchase(
+        auth_user.deposit, product_info.cost, product_info.amount_available, amount
+    )
 
-    # check if the amount of product is available for sale
-    if (product_amount := product_info.amount_available) < amount:
-        if product_amount == 0:
-            raise HTTPException(
-                status_code=400,
-                detail="No product amount available. Please try another product",
-            )
+    try:
+        user_change = repo.purchase(auth_user, product_info, amount)
+    except PurchaseConflict:
         raise HTTPException(
-            status_code=400,
-            detail=f"Only {product_info.amount_available} pcs available",
+            status_code=409,
+            detail="Your deposit or the product stock changed. Please try again",
         )
-
-    new_product_amount_available = product_info.amount_available - amount
-    user_change = auth_user[1].deposit - (amount * product_info.cost)
-
-    utils.update_user_deposit(db, credentials.username, user_change)
-    utils.update_product_amount_available_by_id(
-        db, product_id, new_product_amount_available
-    )
+    # deposit and stock change are committed together
+    repo.commit()
 
     return {
         "total_spent": amount,
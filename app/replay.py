@@ -0,0 +1,288 @@
+"""
+Replay a traffic capture (see `core.traffic.CaptureMiddleware`) against one or two
+builds of the app, each one running on a freshly seeded local database.
+
+    python replay.py capture.jsonl --build . --build ../../other/app --seed seed.json
+    python replay.py capture.jsonl --build . --speed 10      # 10x the original speed
+    python replay.py capture.jsonl --build . --speed 0       # as fast as possible
+
+The seed file is a JSON object like:
+
+    {
+        "users": [{"username": "bob", "role": "buyer", "deposit": 100}],
+        "products": [
+            {"product_name": "Cola", "amount_available": 10, "cost": 5, "seller": "ann"}
+        ]
+    }
+
+Each build is replayed in its own process, from a temporary directory holding its
+`my_db`. Latency distributions of every build and the responses which differ
+between the builds (or from the captured status, for a single build) are reported
+as JSON.
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# password given to every seeded user
+REPLAY_PASSWORD = "replay-password"
+# must match `core.traffic.REDACTED`, kept here so the replay imports nothing of the build
+REDACTED = "<redacted>"
+DATABASE = "my_db"
+
+
+def read_capture(path: str):
+    with open(path) as capture:
+        return [json.loads(line) for line in capture if line.strip()]
+
+
+def restore_passwords(value):
+    """
+    Put the replay password back where the capture redacted one
+    """
+    if isinstance(value, dict):
+        return {key: restore_passwords(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [restore_passwords(item) for item in value]
+    return REPLAY_PASSWORD if value == REDACTED else value
+
+
+def seed_database(path: str, seed: dict):
+    """
+    Insert the seed users and products, the tables must already exist
+    :param path: sqlite database file
+    :param seed: seed content, see the module doc
+    """
+    with sqlite3.connect(path) as db:
+        for user in seed.get("users", []):
+            db.execute(
+                "INSERT INTO user (username, password, deposit, role) VALUES (?, ?, ?, ?)",
+                (
+                    user["username"],
+                    REPLAY_PASSWORD,
+                    user.get("deposit", 0),
+                    user["role"],
+                ),
+            )
+        for product in seed.get("products", []):
+            db.execute(
+                "INSERT INTO product (product_name, amount_available, cost, seller_id) "
+                "SELECT ?, ?, ?, id FROM user WHERE username = ?",
+                (
+                    product["product_name"],
+                    product["amount_available"],
+                    product["cost"],
+                    product["seller"],
+                ),
+            )
+
+
+def stored_password(username: str):
+    """
+    The app compares the stored password as is, so the replay logs in with it.
+    This also covers the users created or updated during the replay.
+    """
+    with sqlite3.connect(DATABASE) as db:
+        row = db.execute(
+            "SELECT password FROM user WHERE username = ?", (username,)
+        ).fetchone()
+    return row[0] if row else REPLAY_PASSWORD
+
+
+def replay_one(client, index: int, record: dict):
+    # captured percent-encoded, sent as is
+    url = record["path"] + (f"?{record['query']}" if record["query"] else "")
+    auth = None
+    if record["user"] is not None:
+        auth = (record["user"], stored_password(record["user"]))
+    body = restore_passwords(record["body"]) if record["body"] is not None else None
+
+    started = time.perf_counter()
+    response = client.request(record["method"], url, json=body, auth=auth)
+    latency = time.perf_counter() - started
+
+    try:
+        content = response.json()
+    except ValueError:
+        content = response.text
+    return {
+        "index": index,
+        "route": f"{record['method']} {record['route']}",
+        "status": response.status_code,
+        "captured_status": record["status"],
+        "body": content,
+        "latency_ms": latency * 1000,
+    }
+
+
+def run_worker(args):
+    """
+    Replay the capture in-process against the build found in `args.build`,
+    the current directory is the temporary directory of the database
+    """
+    sys.path.insert(0, os.path.abspath(args.build))
+    from starlette.testclient import TestClient
+    from main import app
+
+    if args.seed:
+        with open(args.seed) as seed:
+            seed_database(DATABASE, json.load(seed))
+
+    records = read_capture(args.capture)
+    with TestClient(app) as client:
+        client.auth = None
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            started = time.perf_counter()
+            futures = []
+            for index, record in enumerate(records):
+                if args.speed > 0:
+                    delay = started + record["t"] / args.speed - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                futures.append(pool.submit(replay_one, client, index, record))
+            results = [future.result() for future in futures]
+            elapsed = time.perf_counter() - started
+
+    with open(args.output, "w") as output:
+        json.dump({"elapsed": elapsed, "results": results}, output)
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    if not latencies:
+        return {}
+
+    def pick(share):
+        return round(latencies[min(len(latencies) - 1, int(share * len(latencies)))], 3)
+
+    return {
+        "count": len(latencies),
+        "mean": round(statistics.fmean(latencies), 3),
+        "p50": pick(0.50),
+        "p90": pick(0.90),
+        "p99": pick(0.99),
+        "max": round(latencies[-1], 3),
+    }
+
+
+def summarize(run: dict):
+    by_route = defaultdict(list)
+    for result in run["results"]:
+        by_route[result["route"]].append(result["latency_ms"])
+    latencies = [result["latency_ms"] for result in run["results"]]
+    return {
+        "elapsed_s": round(run["elapsed"], 3),
+        "requests_per_s": (
+            round(len(latencies) / run["elapsed"], 1) if run["elapsed"] else None
+        ),
+        "latency_ms": percentiles(latencies),
+        "latency_ms_by_route": {
+            route: percentiles(values) for route, values in sorted(by_route.items())
+        },
+    }
+
+
+def divergences(runs, limit: int):
+    found = []
+    if len(runs) == 1:
+        for result in runs[0]["results"]:
+            if result["status"] != result["captured_status"]:
+                found.append(
+                    {
+                        "index": result["index"],
+                        "route": result["route"],
+                        "captured_status": result["captured_status"],
+                        "status": result["status"],
+                    }
+                )
+    else:
+        for first, second in zip(runs[0]["results"], runs[1]["results"]):
+            if (first["status"], first["body"]) != (second["status"], second["body"]):
+                found.append(
+                    {
+                        "index": first["index"],
+                        "route": first["route"],
+                        "first": {"status": first["status"], "body": first["body"]},
+                        "second": {"status": second["status"], "body": second["body"]},
+                    }
+                )
+    return {"count": len(found), "first": found[:limit]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("capture", help="JSON lines capture file")
+    parser.add_argument(
+        "--build",
+        action="append",
+        required=True,
+        help="`app` directory of a build, give it twice to compare two builds",
+    )
+    parser.add_argument("--seed", help="JSON seed file")
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="1 for the original speed, N for N times faster, 0 for as fast as possible",
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=1, help="requests replayed at the same time"
+    )
+    parser.add_argument("--max-divergences", type=int, default=20)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        args.build = args.build[0]
+        run_worker(args)
+        return
+
+    if len(args.build) > 2:
+        parser.error("at most two builds can be compared")
+
+    runs = []
+    for build in args.build:
+        with tempfile.TemporaryDirectory() as workdir:
+            output = os.path.join(workdir, "results.json")
+            command = [
+                sys.executable,
+                os.path.abspath(__file__),
+                os.path.abspath(args.capture),
+                "--worker",
+                "--build",
+                os.path.abspath(build),
+                "--speed",
+                str(args.speed),
+                "--concurrency",
+                str(args.concurrency),
+                "--output",
+                output,
+            ]
+            if args.seed:
+                command += ["--seed", os.path.abspath(args.seed)]
+            # the capture settings of the current environment must not leak in
+            env = {k: v for k, v in os.environ.items() if not k.startswith("VENDING_")}
+            subprocess.run(command, cwd=workdir, env=env, check=True)
+            with open(output) as results:
+                runs.append(json.load(results))
+
+    report = {
+        "builds": {build: summarize(run) for build, run in zip(args.build, runs)},
+        "divergences": divergences(runs, args.max_divergences),
+    }
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Run the app with several uvicorn worker processes sharing the sqlite database.
+
+    python serve.py                           # one worker per core on 127.0.0.1:8000
+    python serve.py --workers 4 --host 0.0.0.0 --port 8080
+
+The workers keep their caches coherent through the change log, see
+`core.coherence`. The database is switched to WAL journaling first, see
+`core.models.create_schema`, so the reads of a worker don't wait for the writes of
+another. The jobs which must only run once, like the snapshots, run in one of the
+workers, see `core.jobs`.
+"""
+
+import argparse
+import os
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def prepare_database():
+    """
+    Create the tables once and switch to WAL, before the workers race to do it
+    """
+    from core import models
+    from core.database import engine
+
+    models.create_schema(engine)
+    engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=0.05,
+        help="seconds between two polls of the changes of the other workers",
+    )
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        # read by the settings of every worker
+        os.environ.setdefault("VENDING_COHERENCE_POLL_SECONDS", str(args.poll_interval))
+
+    from core.settings import settings
+
+    if settings.storage_backend == "memory" and args.workers > 1:
+        parser.error("the in-memory storage can't be shared by several workers")
+
+    import uvicorn
+
+    prepare_database()
+    uvicorn.run(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        app_dir=APP_DIR,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Take, list and restore the online snapshots of the database (see `core.backup`).
+
+    python snapshot.py create
+    python snapshot.py list
+    python snapshot.py restore restored_db                    # the latest snapshot
+    python snapshot.py restore restored_db --at 2022-07-01T12:00:00
+
+The database and the snapshot directory are the ones of the settings, e.g.
+VENDING_DATABASE_URL and VENDING_SNAPSHOT_DIR. A snapshot is always restored into a
+new file, point the app at it to use it.
+"""
+
+import argparse
+import json
+import sys
+from datetime import datetime
+
+from core.backup import (
+    SnapshotError,
+    create_snapshot,
+    database_path,
+    find_snapshot,
+    list_snapshots,
+    restore_snapshot,
+)
+from core.settings import settings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("create", help="snapshot the database now")
+    commands.add_parser("list", help="list the snapshots")
+    restore = commands.add_parser("restore", help="restore a snapshot")
+    restore.add_argument("target", help="database file to create")
+    restore.add_argument(
+        "--at",
+        type=datetime.fromisoformat,
+        help="UTC time to restore the database at, the latest snapshot by default",
+    )
+    args = parser.parse_args()
+
+    try:
+        if args.command == "create":
+            result = create_snapshot(
+                database_path(settings.database_url),
+                settings.snapshot_dir,
+                pages=settings.snapshot_pages,
+                pause=settings.snapshot_pause_seconds,
+            )
+        elif args.command == "list":
+            result = list_snapshots(settings.snapshot_dir)
+        else:
+            meta = find_snapshot(settings.snapshot_dir, args.at)
+            result = restore_snapshot(settings.snapshot_dir, meta["name"], args.target)
+    except SnapshotError as e:
+        sys.exit(str(e))
+    json.dump(result, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,374 @@
+"""
+Fire concurrent buys and deposits at a seeded local database, then check that no
+product was oversold and no money was lost or created.
+
+    python stress.py                                  # levels 1, 4, 16 and 1 process
+    python stress.py --levels 1,8,32 --processes 4 --operations 5000
+    python stress.py --snapshot-interval 0.5   # p99 while snapshots are taken
+
+Every concurrency level starts from a freshly seeded `my_db` in a temporary
+directory. `--processes` worker processes share it, like uvicorn workers would,
+each one running `level` threads which call the app in-process. Once they are done
+the database is checked against what the workers were told:
+
+    - units sold by the successful buys == units taken from the stock
+    - seeded deposits + successful deposits == deposits left + money spent
+    - no deposit and no stock below zero
+    - no buy of a zero or negative amount (`--bad-share` of the buys) accepted
+
+The throughput, latencies, response statuses and invariant results of every level
+are reported as JSON, the exit code is 1 when an invariant is broken. With
+`--snapshot-interval`, online snapshots (see `core.backup`) are taken all along,
+compare the latencies with a run without it.
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from core.backup import SnapshotError, create_snapshot
+from replay import percentiles
+
+# password given to every seeded user, the app compares it as stored
+STRESS_PASSWORD = "stress-password"
+DATABASE = "my_db"
+COINS = (5, 10, 20, 50, 100)
+# amounts no buy should accept
+BAD_AMOUNTS = (0, -1, -3)
+
+
+def seed_database(path: str, args):
+    """
+    Insert the buyers, one seller and its products, the tables must already exist
+    :param path: sqlite database file
+    :param args: command line arguments
+    """
+    with sqlite3.connect(path) as db:
+        db.execute(
+            "INSERT INTO user (username, password, deposit, role) VALUES (?, ?, 0, ?)",
+            ("stress-seller", STRESS_PASSWORD, "seller"),
+        )
+        seller_id = db.execute("SELECT last_insert_rowid()").fetchone()[0]
+        for index in range(args.buyers):
+            db.execute(
+                "INSERT INTO user (username, password, deposit, role) "
+                "VALUES (?, ?, ?, ?)",
+                (f"buyer-{index}", STRESS_PASSWORD, args.deposit, "buyer"),
+            )
+        for index in range(args.products):
+            db.execute(
+                "INSERT INTO product (product_name, amount_available, cost, seller_id) "
+                "VALUES (?, ?, ?, ?)",
+                (f"product-{index}", args.stock, 5 * (index % 4 + 1), seller_id),
+            )
+
+
+def database_totals(path: str):
+    with sqlite3.connect(path) as db:
+        deposits = db.execute(
+            "SELECT COALESCE(SUM(deposit), 0), MIN(deposit) FROM user WHERE role = 'buyer'"
+        ).fetchone()
+        stock = db.execute(
+            "SELECT COALESCE(SUM(amount_available), 0), MIN(amount_available) "
+            "FROM product"
+        ).fetchone()
+        costs = dict(db.execute("SELECT id, cost FROM product"))
+    return {
+        "deposits": deposits[0],
+        "min_deposit": deposits[1],
+        "stock": stock[0],
+        "min_stock": stock[1],
+        "costs": costs,
+    }
+
+
+def run_operations(client, rng: random.Random, count: int, costs: dict, args, out):
+    buyers = [f"buyer-{index}" for index in range(args.buyers)]
+    product_ids = sorted(costs)
+    for _ in range(count):
+        buyer = rng.choice(buyers)
+        auth = (buyer, STRESS_PASSWORD)
+        if rng.random() < args.buy_share:
+            product_id = rng.choice(product_ids)
+            bad = rng.random() < args.bad_share
+            amount = rng.choice(BAD_AMOUNTS) if bad else rng.randint(1, 3)
+            started = time.perf_counter()
+            response = client.get(
+                "/buy", params={"product_id": product_id, "amount": amount}, auth=auth
+            )
+            latency = time.perf_counter() - started
+            kind = "bad buy" if bad else "buy"
+            out["statuses"][f"{kind} {response.status_code}"] += 1
+            if response.status_code == 200:
+                out["units"] += amount
+                out["spent"] += amount * costs[product_id]
+        else:
+            coin = rng.choice(COINS)
+            started = time.perf_counter()
+            response = client.put("/deposit", json={"coin_value": coin}, auth=auth)
+            latency = time.perf_counter() - started
+            out["statuses"][f"deposit {response.status_code}"] += 1
+            if response.status_code == 200:
+                out["deposited"] += coin
+        out["latencies"].append(latency * 1000)
+
+
+def run_worker(args):
+    """
+    Run `args.threads` threads against the app of the current directory's database
+    """
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from starlette.testclient import TestClient
+    from main import app
+
+    if args.setup:
+        # importing the app created the tables
+        seed_database(DATABASE, args)
+        return
+
+    costs = {int(key): value for key, value in json.loads(args.costs).items()}
+    outs = [
+        {"statuses": Counter(), "units": 0, "spent": 0, "deposited": 0, "latencies": []}
+        for _ in range(args.threads)
+    ]
+    with TestClient(app, raise_server_exceptions=False) as client:
+        threads = [
+            threading.Thread(
+                target=run_operations,
+                args=(
+                    client,
+                    random.Random(f"{args.seed}-{args.worker_index}-{index}"),
+                    args.operations,
+                    costs,
+                    args,
+                    out,
+                ),
+            )
+            for index, out in enumerate(outs)
+        ]
+        started = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        finished = time.time()
+
+    with open(args.output, "w") as output:
+        json.dump(
+            {
+                "started": started,
+                "finished": finished,
+                "statuses": sum((out["statuses"] for out in outs), Counter()),
+                "units": sum(out["units"] for out in outs),
+                "spent": sum(out["spent"] for out in outs),
+                "deposited": sum(out["deposited"] for out in outs),
+                "latencies": [value for out in outs for value in out["latencies"]],
+            },
+            output,
+        )
+
+
+def worker_command(args, *extra):
+    command = [
+        sys.executable,
+        os.path.abspath(__file__),
+        "--worker",
+        "--buyers",
+        str(args.buyers),
+        "--products",
+        str(args.products),
+        "--stock",
+        str(args.stock),
+        "--deposit",
+        str(args.deposit),
+        "--buy-share",
+        str(args.buy_share),
+        "--seed",
+        str(args.seed),
+        "--bad-share",
+        str(args.bad_share),
+    ]
+    return command + list(extra)
+
+
+def run_level(args, level: int, env: dict):
+    with tempfile.TemporaryDirectory() as workdir:
+        database = os.path.join(workdir, DATABASE)
+        subprocess.run(
+            worker_command(args, "--setup"), cwd=workdir, env=env, check=True
+        )
+        before = database_totals(database)
+
+        # the operations are spread over the threads of every process
+        per_thread = max(1, args.operations // (level * args.processes))
+        outputs = [
+            os.path.join(workdir, f"worker-{index}.json")
+            for index in range(args.processes)
+        ]
+        workers = [
+            subprocess.Popen(
+                worker_command(
+                    args,
+                    "--threads",
+                    str(level),
+                    "--operations",
+                    str(per_thread),
+                    "--worker-index",
+                    str(index),
+                    "--costs",
+                    json.dumps(before["costs"]),
+                    "--output",
+                    output,
+                ),
+                cwd=workdir,
+                env=env,
+            )
+            for index, output in enumerate(outputs)
+        ]
+        snapshots = []
+        stop_snapshots = threading.Event()
+        snapshotter = threading.Thread(
+            target=take_snapshots,
+            args=(args, database, os.path.join(workdir, "snapshots")),
+            kwargs={"stop": stop_snapshots, "out": snapshots},
+        )
+        if args.snapshot_interval:
+            snapshotter.start()
+        for worker in workers:
+            if worker.wait() != 0:
+                raise SystemExit(f"a worker of level {level} failed")
+        stop_snapshots.set()
+        if args.snapshot_interval:
+            snapshotter.join()
+        runs = []
+        for output in outputs:
+            with open(output) as results:
+                runs.append(json.load(results))
+        after = database_totals(database)
+
+    units = sum(run["units"] for run in runs)
+    spent = sum(run["spent"] for run in runs)
+    deposited = sum(run["deposited"] for run in runs)
+    invariants = {
+        "units_sold_match_stock": units == before["stock"] - after["stock"],
+        "money_conserved": before["deposits"] + deposited == after["deposits"] + spent,
+        "no_negative_deposit": after["min_deposit"] >= 0,
+        "no_negative_stock": after["min_stock"] >= 0,
+    }
+    latencies = [value for run in runs for value in run["latencies"]]
+    elapsed = max(run["finished"] for run in runs) - min(run["started"] for run in runs)
+    statuses = sum((Counter(run["statuses"]) for run in runs), Counter())
+    invariants["bad_amounts_rejected"] = statuses["bad buy 200"] == 0
+    report = {
+        "threads": level * args.processes,
+        "operations": len(latencies),
+        "elapsed_s": round(elapsed, 3),
+        "operations_per_s": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "latency_ms": percentiles(latencies),
+        "statuses": dict(sorted(statuses.items())),
+        "units_sold": units,
+        "stock_taken": before["stock"] - after["stock"],
+        "money": {
+            "seeded": before["deposits"],
+            "deposited": deposited,
+            "spent": spent,
+            "left": after["deposits"],
+        },
+        "invariants": invariants,
+    }
+    if args.snapshot_interval:
+        given_up = snapshots.count(None)
+        snapshots = [meta for meta in snapshots if meta is not None]
+        report["snapshots"] = {
+            "count": len(snapshots),
+            "given_up": given_up,
+            "restarts": sum(meta["restarts"] for meta in snapshots),
+            "copy_ms": percentiles([meta["copy_seconds"] * 1000 for meta in snapshots]),
+        }
+    return report
+
+
+def take_snapshots(args, database: str, directory: str, stop, out: list):
+    """
+    Snapshot the database every `args.snapshot_interval` seconds until stopped
+    """
+    while not stop.wait(args.snapshot_interval):
+        try:
+            meta = create_snapshot(
+                database,
+                directory,
+                pages=args.snapshot_pages,
+                pause=args.snapshot_pause,
+            )
+        except SnapshotError:
+            # the database kept changing, taken again at the next interval
+            meta = None
+        out.append(meta)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--levels",
+        default="1,4,16",
+        help="comma separated threads per process, one run per level",
+    )
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument(
+        "--operations", type=int, default=2000, help="operations per level"
+    )
+    parser.add_argument("--buyers", type=int, default=8)
+    parser.add_argument("--products", type=int, default=4)
+    parser.add_argument("--stock", type=int, default=200, help="stock of each product")
+    parser.add_argument("--deposit", type=int, default=100, help="seeded deposit")
+    parser.add_argument(
+        "--buy-share", type=float, default=0.7, help="share of buys, deposits otherwise"
+    )
+    parser.add_argument(
+        "--bad-share",
+        type=float,
+        default=0.05,
+        help="share of the buys asking for a zero or negative amount",
+    )
+    parser.add_argument("--seed", default="stress")
+    parser.add_argument(
+        "--snapshot-interval",
+        type=float,
+        help="seconds between two online snapshots taken during each level",
+    )
+    parser.add_argument("--snapshot-pages", type=int, default=64)
+    parser.add_argument("--snapshot-pause", type=float, default=0.002)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--setup", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--threads", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--worker-index", type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument("--costs", help=argparse.SUPPRESS)
+    parser.add_argument("--output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    # the capture, profiler or database settings of the environment must not leak in
+    env = {k: v for k, v in os.environ.items() if not k.startswith("VENDING_")}
+    levels = [int(level) for level in args.levels.split(",")]
+    report = {"levels": [run_level(args, level, env) for level in levels]}
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    broken = any(
+        not ok for level in report["levels"] for ok in level["invariants"].values()
+    )
+    sys.exit(1 if broken else 0)
+
+
+if __name__ == "__main__":
+    main()
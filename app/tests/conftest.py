@@ -1,6 +1,20 @@
+import os
+import sqlite3
+
+# read when `main` is imported: the app gets an in-memory database of its own in
+# every test worker instead of `my_db`
+os.environ.setdefault("VENDING_DATABASE_URL", "sqlite://")
+
 import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 from starlette.testclient import TestClient
 
+from core import models, utils
+from core.catalog import catalog
+from core.database import get_db, get_read_db
+from core.fleet import fleet_stock
 from main import app
 
 USERNAME = "test2"
@@ -17,3 +31,74 @@ def test_client():
     client.auth = (USERNAME, USER_PASSWORD)
 
     yield TestClient(app)
+
+
+def memory_engine(connection: sqlite3.Connection):
+    """
+    Engine whose sessions all use one in-memory database, from any thread
+    """
+    return create_engine("sqlite://", creator=lambda: connection, poolclass=StaticPool)
+
+
+@pytest.fixture(scope="session")
+def schema():
+    """
+    In-memory database with the tables of the app, created once per test worker
+    """
+    connection = sqlite3.connect(":memory:", check_same_thread=False)
+    # disposing of the engine would close the connection
+    models.create_schema(memory_engine(connection))
+    yield connection
+    connection.close()
+
+
+@pytest.fixture
+def engine(schema):
+    """
+    Engine on a copy of the schema, every test starts from empty tables
+    """
+    connection = sqlite3.connect(":memory:", check_same_thread=False)
+    schema.backup(connection)
+    engine = memory_engine(connection)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def db(engine):
+    """
+    Return a session on the database of the test
+    """
+    session = sessionmaker(bind=engine, expire_on_commit=False)()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def client(engine, monkeypatch):
+    """
+    API client running the real views, `core.utils` and authentication on the
+    database of the test, log in with the users of `tests.factories`
+    """
+    session_factory = sessionmaker(
+        autocommit=False, autoflush=False, expire_on_commit=False, bind=engine
+    )
+
+    def get_test_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    # without the credentials overridden by the modules testing with mocks
+    monkeypatch.setattr(
+        app, "dependency_overrides", {get_db: get_test_db, get_read_db: get_test_db}
+    )
+    # nothing cached by the process may come from the database of another test
+    monkeypatch.setattr(utils.product_reads, "stale_seconds", 0)
+    catalog.reset()
+    fleet_stock.reset()
+    yield TestClient(app)
+    catalog.reset()
+    fleet_stock.reset()
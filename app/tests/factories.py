@@ -0,0 +1,54 @@
+from itertools import count
+
+from sqlalchemy.orm import Session
+
+from core import models
+
+# unique names within a test worker, whatever the order the tests run in
+_sequence = count(1)
+
+
+def make_user(
+    db: Session,
+    *,
+    username: str = None,
+    password: str = "test",
+    deposit: int = 0,
+    role: str = "buyer",
+) -> models.User:
+    """
+    Add a committed user, log in with `(user.username, user.password)`
+    """
+    db_user = models.User(
+        username=username or f"user-{next(_sequence)}",
+        password=password,
+        deposit=deposit,
+        role=role,
+    )
+    db.add(db_user)
+    db.commit()
+    return db_user
+
+
+def make_product(
+    db: Session,
+    seller: models.User = None,
+    *,
+    product_name: str = None,
+    amount_available: int = 10,
+    cost: int = 5,
+) -> models.Product:
+    """
+    Add a committed product, of a new seller unless one is given
+    """
+    if seller is None:
+        seller = make_user(db, role="seller")
+    db_product = models.Product(
+        product_name=product_name or f"product-{next(_sequence)}",
+        amount_available=amount_available,
+        cost=cost,
+        seller_id=seller.id,
+    )
+    db.add(db_product)
+    db.commit()
+    return db_product
@@ -0,0 +1,114 @@
+from starlette import status
+
+from core import models, utils
+from core.catalog import catalog
+from core.fleet import fleet_stock
+from tests.factories import make_product, make_user
+from tests.test_api import login
+
+
+def outcomes(response):
+    return {o["username"]: o["outcome"] for o in response.json()}
+
+
+def test_removing_a_seller_removes_what_they_sell(client, db):
+    admin = make_user(db, role="admin")
+    seller = make_user(db, role="seller")
+    buyer = make_user(db)
+    cola = make_product(db, seller, product_name="Cola")
+    fanta = make_product(db, seller, product_name="Fanta")
+    water = make_product(db, product_name="Water")
+    machine = utils.create_machine(db, "lobby")
+    utils.stock_machine_slot(db, machine.id, "A1", cola.id, 4)
+    utils.stock_machine_slot(db, machine.id, "A2", water.id, 6)
+    utils.create_notification(db, seller.id, "low_stock", "product:1", "Cola is low")
+    utils.create_notification(db, buyer.id, "stale_deposit", "deposit", "Buy something")
+    db.commit()
+    # the caches of the process hold the products before they are removed
+    assert client.get("/product/Cola").json()[0]["id"] == cola.id
+    assert fleet_stock.totals(db) == {cola.id: 4, water.id: 6}
+
+    response = client.post(
+        "/admin/users/delete",
+        json={"usernames": [seller.username, "ghost", buyer.username]},
+        auth=login(admin),
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert outcomes(response) == {
+        seller.username: "deleted",
+        "ghost": "not_found",
+        buyer.username: "deleted",
+    }
+
+    assert [u.id for u in db.query(models.User)] == [admin.id, water.seller_id]
+    assert [p.id for p in db.query(models.Product)] == [water.id]
+    assert [s.slot for s in db.query(models.MachineSlot)] == ["A2"]
+    assert db.query(models.Notification).count() == 0
+    assert client.get("/product/Cola").json() == []
+    assert client.get("/product/Fanta").json() == []
+    assert catalog.load(db).row(fanta.id) is None
+    assert fleet_stock.totals(db) == {water.id: 6}
+
+
+def test_admins_cannot_remove_themselves(client, db):
+    admin = make_user(db, role="admin")
+    buyer = make_user(db)
+
+    response = client.post(
+        "/admin/users/delete",
+        json={"usernames": [buyer.username, admin.username]},
+        auth=login(admin),
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["detail"] == "Sorry but you can't remove yourself"
+    assert db.query(models.User).count() == 2
+
+
+def test_admin_changes_roles(client, db):
+    admin = make_user(db, role="admin")
+    buyer = make_user(db)
+    seller = make_user(db, role="seller")
+
+    response = client.put(
+        "/admin/users/role",
+        json={
+            "usernames": [buyer.username, seller.username, "ghost"],
+            "role": "seller",
+        },
+        auth=login(admin),
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert outcomes(response) == {
+        buyer.username: "updated",
+        seller.username: "unchanged",
+        "ghost": "not_found",
+    }
+    db.expire_all()
+    assert db.get(models.User, buyer.id).role == "seller"
+    assert db.get(models.User, seller.id).role == "seller"
+
+
+def test_admins_cannot_change_their_own_role(client, db):
+    admin = make_user(db, role="admin")
+    buyer = make_user(db)
+
+    response = client.put(
+        "/admin/users/role",
+        json={"usernames": [buyer.username, admin.username], "role": "buyer"},
+        auth=login(admin),
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["detail"] == "Sorry but you can't change your own role"
+    db.expire_all()
+    assert db.get(models.User, admin.id).role == "admin"
+
+    # promoting themselves with others leaves them as they are
+    response = client.put(
+        "/admin/users/role",
+        json={"usernames": [buyer.username, admin.username], "role": "admin"},
+        auth=login(admin),
+    )
+    assert outcomes(response) == {
+        buyer.username: "updated",
+        admin.username: "unchanged",
+    }
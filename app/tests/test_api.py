@@ -0,0 +1,160 @@
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+from starlette import status
+
+from core import models, utils
+from core.repository import SqlAlchemyRepository
+from tests.factories import make_product, make_user
+
+
+def login(user: models.User):
+    return user.username, user.password
+
+
+def test_buyer_deposits_and_buys(client, db):
+    buyer = make_user(db)
+    product = make_product(db, product_name="Cola", amount_available=10, cost=5)
+
+    response = client.put("/deposit", json={"coin_value": 50}, auth=login(buyer))
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["deposit"] == 50
+
+    response = client.get(
+        "/buy", params={"product_id": product.id, "amount": 3}, auth=login(buyer)
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {
+        "total_spent": 3,
+        "product_name": "Cola",
+        "change": 35,
+    }
+
+    products = client.get("/product/Cola").json()
+    assert [(p["id"], p["amount_available"]) for p in products] == [(product.id, 7)]
+    db.expire_all()
+    assert db.get(models.User, buyer.id).deposit == 35
+
+
+def test_buy_reads_the_user_and_the_product_once(client, db, engine):
+    buyer = make_user(db, deposit=20)
+    product = make_product(db, amount_available=10, cost=5)
+
+    selects = []
+
+    def count_selects(conn, cursor, statement, parameters, context, many):
+        if statement.startswith("SELECT"):
+            selects.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count_selects)
+    try:
+        response = client.get(
+            "/buy", params={"product_id": product.id, "amount": 2}, auth=login(buyer)
+        )
+    finally:
+        event.remove(engine, "before_cursor_execute", count_selects)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["change"] == 10
+    # the conditional updates don't read the new deposit and stock back
+    assert len([s for s in selects if "FROM user" in s]) == 1
+    assert len([s for s in selects if "FROM product" in s]) == 1
+    db.expire_all()
+    assert db.get(models.User, buyer.id).deposit == 10
+    assert db.get(models.Product, product.id).amount_available == 8
+
+
+def test_buy_takes_from_a_deposit_changed_since_it_was_loaded(db, engine):
+    buyer = make_user(db, deposit=20)
+
+    other = sessionmaker(bind=engine)()
+    other.get(models.User, buyer.id).deposit = 50
+    other.commit()
+    other.close()
+
+    assert utils.take_user_deposit(db, buyer.id, 15).deposit == 35
+    assert utils.take_user_deposit(db, buyer.id, 40) is None
+
+
+def test_every_test_starts_from_empty_tables(client, db):
+    assert db.query(models.User).count() == 0
+    assert client.get("/product/Cola").json() == []
+
+
+def test_buy_more_than_the_stock(client, db):
+    buyer = make_user(db, deposit=100)
+    product = make_product(db, amount_available=2)
+
+    response = client.get(
+        "/buy", params={"product_id": product.id, "amount": 3}, auth=login(buyer)
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["detail"] == "Only 2 pcs available"
+
+
+def test_sellers_cannot_buy(client, db):
+    seller = make_user(db, role="seller", deposit=100)
+    product = make_product(db, seller)
+
+    response = client.get(
+        "/buy", params={"product_id": product.id, "amount": 1}, auth=login(seller)
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["detail"] == "You should be a buyer to access this endpoint"
+
+
+def test_wrong_password(client, db):
+    buyer = make_user(db)
+
+    response = client.put(
+        "/deposit", json={"coin_value": 5}, auth=(buyer.username, "wrong")
+    )
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test_username_registered_while_signing_up(client, db, monkeypatch):
+    taken = make_user(db)
+    # registered by another request once this one checked the username
+    monkeypatch.setattr(SqlAlchemyRepository, "get_user", lambda self, username: None)
+
+    response = client.post(
+        "/user",
+        json={
+            "username": taken.username,
+            "password": "secret",
+            "deposit": 0,
+            "role": "buyer",
+        },
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["detail"] == "Username already registered"
+
+
+def test_seller_renames_a_product(client, db):
+    seller = make_user(db, role="seller")
+    make_product(db, seller, product_name="Cola", amount_available=4, cost=10)
+
+    response = client.put(
+        "/product/Cola",
+        json={"product_name": "Fanta", "amount_available": 4, "cost": 10},
+        auth=login(seller),
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert client.get("/product/Cola").json() == []
+    assert client.get("/product/Fanta").json()[0]["seller_id"] == seller.id
+
+
+def test_admin_resets_deposits(client, db):
+    admin = make_user(db, role="admin")
+    rich = make_user(db, deposit=100)
+    poor = make_user(db, deposit=5)
+
+    response = client.put(
+        "/admin/users/reset", json={"min_deposit": 50}, auth=login(admin)
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert {o["username"]: o["outcome"] for o in response.json()} == {
+        rich.username: "reset"
+    }
+    db.expire_all()
+    assert db.get(models.User, rich.id).deposit == 0
+    assert db.get(models.User, poor.id).deposit == 5
@@ -0,0 +1,26 @@
+from sqlalchemy import event
+from starlette import status
+
+from tests.factories import make_user
+
+
+def test_deposit_loads_the_user_once(client, db, engine):
+    buyer = make_user(db, deposit=5)
+
+    user_queries = []
+
+    def count_user_queries(conn, cursor, statement, parameters, context, many):
+        if statement.startswith("SELECT") and "FROM user" in statement:
+            user_queries.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count_user_queries)
+    try:
+        response = client.put(
+            "/deposit", json={"coin_value": 10}, auth=(buyer.username, buyer.password)
+        )
+    finally:
+        event.remove(engine, "before_cursor_execute", count_user_queries)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["deposit"] == 15
+    assert len(user_queries) == 1
@@ -0,0 +1,163 @@
+import gc
+import json
+import tracemalloc
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from core import utils, models
+from core.catalog import CatalogSnapshot, catalog
+from product.serializers import ProductCreate
+
+
+@pytest.fixture(autouse=True)
+def empty_catalog():
+    catalog.reset()
+    yield
+    catalog.reset()
+
+
+def seed_products(db):
+    db.add(models.User(id=1, username="seller", password="x", role="seller"))
+    db.add(models.User(id=2, username="other", password="x", role="seller"))
+    db.add(
+        models.Product(
+            id=1, product_name="Cola", amount_available=5, cost=10, seller_id=1
+        )
+    )
+    db.add(
+        models.Product(
+            id=2, product_name="Fanta", amount_available=3, cost=5, seller_id=1
+        )
+    )
+    db.commit()
+
+
+def read(db, product_name):
+    return json.loads(catalog.products_json(db, product_name))
+
+
+def test_snapshot_index_and_patches():
+    snapshot = CatalogSnapshot.build(
+        [(3, "Cola", 5, 10, 1), (1, "Fanta", 2, 5, 1), (2, "Cola", 1, 10, 2)]
+    )
+    assert snapshot.product_ids("Cola") == [2, 3]
+    assert snapshot.product_ids("Col") == []
+
+    cola, fanta = snapshot.products_json("Cola"), snapshot.products_json("Fanta")
+    assert snapshot.add_stock(2, 4) is snapshot
+    assert snapshot.row(2) == (2, "Cola", 5, 10, 2)
+    # only the products of that name are encoded again
+    assert snapshot.products_json("Fanta") is fanta
+    assert json.loads(snapshot.products_json("Cola"))[0]["amount_available"] == 5
+    assert snapshot.products_json("Cola") is not cola
+
+    renamed = snapshot.with_rows([(1, "Cola", 2, 5, 1)], removed=[3, 99])
+    assert renamed.product_ids("Cola") == [1, 2]
+    assert renamed.product_ids("Fanta") == []
+    assert len(renamed) == 2
+
+
+def test_committed_product_changes_are_patched_in(db):
+    seed_products(db)
+    assert read(db, "Cola")[0]["amount_available"] == 5
+
+    utils.create_user_product(
+        db, ProductCreate(product_name="Cola", amount_available=7, cost=15), 2
+    )
+    utils.take_product_amount(db, 1, 2)
+    db.commit()
+    assert [(p["id"], p["amount_available"]) for p in read(db, "Cola")] == [
+        (1, 3),
+        (3, 7),
+    ]
+
+    utils.remove_product(db, "Cola", 2)
+    utils.take_product_amount(db, 2, 1)
+    db.rollback()
+    utils.remove_product(db, "Cola", 2)
+    db.commit()
+    assert [p["id"] for p in read(db, "Cola")] == [1]
+    assert read(db, "Fanta")[0]["amount_available"] == 3
+
+
+def test_an_update_applied_after_a_later_purchase_keeps_it():
+    catalog._snapshot = CatalogSnapshot.build([(1, "Cola", 5, 10, 1)])
+
+    # the seller restocked from 5 to 10, then a buyer took 1: the purchase is
+    # applied first
+    catalog.apply_stock(1, -1)
+    catalog.put((1, "Cola", 10, 10, 1), stock_delta=5)
+    assert catalog._snapshot.row(1) == (1, "Cola", 9, 10, 1)
+
+    catalog.put((1, "Pepsi", 10, 15, 1), stock_delta=0)
+    assert catalog._snapshot.row(1) == (1, "Pepsi", 9, 15, 1)
+
+
+def test_commits_made_while_loading_are_applied_on_top(db, monkeypatch):
+    seed_products(db)
+    build = CatalogSnapshot.build
+
+    def build_while_buying(rows):
+        # committed once the products were read, before the snapshot is swapped in
+        utils.take_product_amount(db, 1, 2)
+        db.commit()
+        return build(rows)
+
+    monkeypatch.setattr(CatalogSnapshot, "build", build_while_buying)
+    assert read(db, "Cola")[0]["amount_available"] == 3
+    monkeypatch.undo()
+
+    assert catalog.loaded
+    assert read(db, "Cola")[0]["amount_available"] == 3
+
+
+def test_names_changed_by_another_worker_are_read_again(db):
+    seed_products(db)
+    read(db, "Cola")
+
+    other = sessionmaker(bind=db.get_bind())()
+    other.query(models.Product).filter(models.Product.id == 1).update(
+        {"amount_available": 1}
+    )
+    other.commit()
+    other.close()
+    assert read(db, "Cola")[0]["amount_available"] == 5
+
+    catalog.invalidate("Cola")
+    assert read(db, "Cola")[0]["amount_available"] == 1
+
+
+def test_snapshot_is_an_order_of_magnitude_smaller_than_orm_instances(db):
+    db.add(models.User(id=1, username="seller", password="x", role="seller"))
+    db.add_all(
+        models.Product(
+            product_name=f"product-{index}",
+            amount_available=1000 + index,
+            cost=500 + index,
+            seller_id=1,
+        )
+        for index in range(2000)
+    )
+    db.commit()
+    db.expunge_all()
+
+    def allocated(load):
+        gc.collect()
+        tracemalloc.start()
+        try:
+            kept = load()
+            gc.collect()
+            return tracemalloc.get_traced_memory()[0], kept
+        finally:
+            tracemalloc.stop()
+
+    # compiled statements are cached on first use
+    CatalogSnapshot.build(catalog._query(db).all())
+    db.query(models.Product).all()
+    db.expunge_all()
+
+    orm, _ = allocated(lambda: db.query(models.Product).all())
+    snapshot, _ = allocated(lambda: CatalogSnapshot.build(catalog._query(db).all()))
+    # about twelve times, with some margin for what the other tests left around
+    assert orm > 8 * snapshot
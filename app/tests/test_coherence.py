@@ -0,0 +1,164 @@
+import json
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from core import models, utils
+from core.coherence import ChangeFeed, change_feed, prune_change_log
+from core.events import EventBus
+from core.fleet import fleet_stock
+from tests.test_events import collect
+from product.serializers import ProductCreate
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'shared.db'}")
+    models.Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def broadcasting(monkeypatch):
+    monkeypatch.setattr(change_feed, "enabled", True)
+
+
+def test_other_workers_apply_committed_invalidations(engine, broadcasting):
+    # another worker, following the same database
+    other = ChangeFeed(enabled=True)
+    other.origin = -1
+    forgotten = []
+    other.on("product", forgotten.append)
+    connection = engine.connect()
+    other.poll(connection)
+
+    db = sessionmaker(bind=engine)()
+    utils.create_user_product(
+        db, ProductCreate(product_name="Cola", amount_available=5, cost=5), 1
+    )
+    assert other.poll(connection) == 0
+    db.commit()
+    # the product read to forget and the product.created event
+    assert other.poll(connection) == 2
+    assert forgotten == ["Cola"]
+    # nothing committed since, the change log isn't even read
+    assert other.poll(connection) == 0
+
+    # the worker which wrote already forgot it locally
+    own = ChangeFeed(enabled=True)
+    own.on("product", forgotten.append)
+    assert own.poll(connection) == 0
+    assert forgotten == ["Cola"]
+
+    db.rollback()
+    utils.update_product_amount_available_by_id(db, 1, 0)
+    db.rollback()
+    assert other.poll(connection) == 0
+
+    assert prune_change_log(db, models.datetime.max) == 2
+    db.commit()
+    db.close()
+    connection.close()
+
+
+def test_stock_deltas_and_events_are_applied_by_the_other_workers(
+    engine, broadcasting, monkeypatch
+):
+    db = sessionmaker(bind=engine)()
+    db.add(models.Product(id=1, product_name="Cola", amount_available=0, cost=5))
+    utils.create_machine(db, "m1")
+    db_slot = utils.stock_machine_slot(db, 1, "A1", 1, 4)
+    utils.update_machine_slot_amount_available(db, db_slot, 3)
+    db.commit()
+
+    changes = db.query(models.ChangeLog.topic, models.ChangeLog.key).all()
+    # the deltas of a transaction are summed, the events keep their order
+    assert ("fleet", "1:3") in changes
+    events = [json.loads(key) for topic, key in changes if topic == "event"]
+    assert [(type, data["amountAvailable"]) for type, _, data in events] == [
+        ("machine.stock", 4),
+        ("machine.stock", 3),
+    ]
+
+    # seen from another worker, whose totals were loaded before the commit
+    monkeypatch.setattr(change_feed, "origin", -1)
+    monkeypatch.setattr(change_feed, "_last_id", 0)
+    monkeypatch.setattr(change_feed, "_data_version", None)
+    monkeypatch.setattr(fleet_stock, "_totals", {})
+    monkeypatch.setattr(utils, "event_bus", EventBus())
+    connection = engine.connect()
+    change_feed.poll(connection)
+
+    assert fleet_stock.total(db, 1) == 3
+    # numbered by the change log
+    event_ids = [
+        row_id
+        for row_id, in db.query(models.ChangeLog.id).filter(
+            models.ChangeLog.topic == "event"
+        )
+    ]
+    assert utils.event_bus.seq == event_ids[-1]
+    connection.close()
+    db.close()
+
+
+def test_nothing_is_logged_by_a_single_worker(engine):
+    db = sessionmaker(bind=engine)()
+    utils.create_user_product(
+        db, ProductCreate(product_name="Cola", amount_available=5, cost=5), 1
+    )
+    db.commit()
+    assert db.query(models.ChangeLog).count() == 0
+    db.close()
+
+
+def test_a_subscriber_resumes_on_another_worker(engine, broadcasting, monkeypatch):
+    monkeypatch.setattr(utils, "event_bus", EventBus())
+    db = sessionmaker(bind=engine)()
+    db.add(models.Product(id=1, product_name="Cola", amount_available=0, cost=5))
+    utils.create_machine(db, "m1")
+    db.commit()
+
+    # this worker, started first, and another one started later
+    workers = []
+    for origin in (change_feed.origin, -1):
+        feed, bus = ChangeFeed(enabled=True), EventBus()
+        feed.origin = origin
+        feed.follow(
+            "event",
+            lambda row_id, event, bus=bus: bus.publish(*json.loads(event), seq=row_id),
+        )
+        connection = engine.connect()
+        feed.poll(connection)
+        workers.append((feed, bus, connection))
+
+    def commit_stock(slot, amount):
+        utils.stock_machine_slot(db, 1, slot, 1, amount)
+        db.commit()
+        for feed, _, connection in workers:
+            feed.poll(connection)
+
+    (_, first, _), (_, second, _) = workers
+    commit_stock("A1", 4)
+    seen = first.seq
+    commit_stock("A2", 2)
+    commit_stock("A3", 1)
+    # the writer published its own events once read back, numbered alike
+    assert first.seq == second.seq
+
+    events, missed = collect(second, last_seq=seen)
+    assert [data["slot"] for _, _, data in events] == ["A2", "A3"]
+    assert not missed
+
+    # a worker restarted since doesn't have these events anymore
+    restarted = EventBus()
+    restarted.start_at(second.seq)
+    events, missed = collect(restarted, last_seq=seen)
+    assert events == []
+    assert missed
+
+    for _, _, connection in workers:
+        connection.close()
+    db.close()
@@ -0,0 +1,83 @@
+from sqlalchemy import event
+from starlette import status
+
+from core import database, models, utils
+from core.database import on_commit
+from tests.factories import make_product, make_user
+from tests.test_api import login
+from user.serializers import User
+
+
+def test_write_handlers_commit_once(client, db, engine):
+    buyer = make_user(db)
+    seller = make_user(db, role="seller")
+    product = make_product(db, seller, amount_available=10)
+    commits = []
+
+    def count_commit(conn):
+        commits.append(conn)
+
+    requests = [
+        lambda: client.put("/deposit", json={"coin_value": 20}, auth=login(buyer)),
+        # takes the deposit and the stock, and publishes the purchase
+        lambda: client.get(
+            "/buy", params={"product_id": product.id, "amount": 2}, auth=login(buyer)
+        ),
+        lambda: client.post(
+            "/product",
+            json={"product_name": "Fanta", "amount_available": 3, "cost": 5},
+            auth=login(seller),
+        ),
+        lambda: client.put(
+            f"/product/{product.product_name}",
+            json={"product_name": "Cola", "amount_available": 1, "cost": 10},
+            auth=login(seller),
+        ),
+    ]
+    event.listen(engine, "commit", count_commit)
+    try:
+        for request in requests:
+            commits.clear()
+            response = request()
+            assert response.status_code == status.HTTP_200_OK, response.json()
+            assert len(commits) == 1
+    finally:
+        event.remove(engine, "commit", count_commit)
+
+
+def test_callbacks_of_a_rolled_back_transaction_are_dropped(db):
+    buyer = make_user(db, deposit=20)
+    ran = []
+
+    on_commit(db, lambda: ran.append("rolled back"))
+    utils.take_user_deposit(db, buyer.id, 5)
+    db.rollback()
+    on_commit(db, lambda: ran.append("committed"))
+    db.commit()
+
+    assert ran == ["committed"]
+    db.expire_all()
+    assert db.get(models.User, buyer.id).deposit == 20
+
+
+def test_instances_are_usable_once_committed(engine):
+    selects = []
+
+    def count_selects(conn, cursor, statement, parameters, context, many):
+        if statement.startswith("SELECT"):
+            selects.append(statement)
+
+    db = database.SessionLocal(bind=engine)
+    try:
+        db_user = utils.create_user(
+            db, User(username="ann", password="secret", deposit=5, role="buyer")
+        )
+        db.commit()
+        event.listen(engine, "before_cursor_execute", count_selects)
+        # what the handler returns is serialized after the commit
+        assert (db_user.id, db_user.username, db_user.deposit) == (1, "ann", 5)
+    finally:
+        event.remove(engine, "before_cursor_execute", count_selects)
+        db.close()
+
+    assert selects == []
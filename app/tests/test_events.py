@@ -0,0 +1,65 @@
+import asyncio
+
+from core.events import EventBus
+
+
+def collect(bus: EventBus, last_seq=None, publish=()):
+    async def run():
+        subscriber = bus.subscribe(asyncio.get_running_loop(), last_seq)
+        for type, key, data in publish:
+            bus.publish(type, key, data)
+        events, missed = await asyncio.wait_for(subscriber.get(), timeout=1)
+        bus.unsubscribe(subscriber)
+        return [(event.seq, event.type, event.data) for event in events], missed
+
+    return asyncio.run(run())
+
+
+def test_slow_subscriber_gets_the_latest_event_of_each_key():
+    events, missed = collect(
+        EventBus(),
+        publish=[
+            ("product.stock", "product:1", {"amountAvailable": 3}),
+            ("product.stock", "product:2", {"amountAvailable": 9}),
+            ("product.stock", "product:1", {"amountAvailable": 2}),
+        ],
+    )
+
+    assert events == [
+        (2, "product.stock", {"amountAvailable": 9}),
+        (3, "product.stock", {"amountAvailable": 2}),
+    ]
+    assert not missed
+
+
+def test_subscriber_queue_is_bounded():
+    bus = EventBus(max_pending=2)
+    events, missed = collect(
+        bus, publish=[("product.stock", f"product:{i}", {}) for i in range(5)]
+    )
+
+    assert [seq for seq, _, _ in events] == [4, 5]
+    assert missed
+
+
+def test_resume_from_a_sequence():
+    bus = EventBus()
+    bus.publish("product.created", "product:1", {})
+    bus.publish("product.created", "product:2", {})
+
+    events, missed = collect(bus, last_seq=1)
+
+    assert [seq for seq, _, _ in events] == [2]
+    assert not missed
+
+
+def test_resume_from_a_forgotten_sequence_asks_for_a_resync():
+    bus = EventBus(history_size=1)
+    bus.publish("product.created", "product:1", {})
+    bus.publish("product.created", "product:2", {})
+    bus.publish("product.created", "product:3", {})
+
+    events, missed = collect(bus, last_seq=1)
+
+    assert events == []
+    assert missed
@@ -0,0 +1,108 @@
+import threading
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from core import utils, models
+from core.coherence import change_feed
+from core.fleet import FleetStock, fleet_stock
+
+
+def seed_machines(db):
+    db.add(models.User(id=1, username="seller", password="x", role="seller"))
+    db.add(models.Product(id=1, product_name="Cola", amount_available=0, cost=5))
+    utils.create_machine(db, "m1")
+    utils.create_machine(db, "m2")
+    db.commit()
+
+
+def test_totals_are_loaded_with_one_aggregate(db):
+    seed_machines(db)
+    utils.stock_machine_slot(db, 1, "A1", 1, 4)
+    utils.stock_machine_slot(db, 2, "A1", 1, 6)
+    db.commit()
+
+    stock = FleetStock()
+    assert stock.total(db, 1) == 10
+    assert stock.total(db, 2) == 0
+
+
+def test_committed_stock_changes_are_applied_incrementally(db):
+    seed_machines(db)
+    fleet_stock.load(db)
+
+    db_slot = utils.stock_machine_slot(db, 1, "A1", 1, 4)
+    utils.stock_machine_slot(db, 2, "A1", 1, 6)
+    db.commit()
+    assert fleet_stock.total(db, 1) == 10
+
+    utils.update_machine_slot_amount_available(db, db_slot, 1)
+    db.commit()
+    assert fleet_stock.total(db, 1) == 7
+
+
+def test_rolled_back_stock_changes_are_dropped(db):
+    seed_machines(db)
+    fleet_stock.load(db)
+
+    utils.stock_machine_slot(db, 1, "A1", 1, 4)
+    db.rollback()
+
+    assert fleet_stock.total(db, 1) == 0
+
+
+def test_a_commit_racing_with_a_load_is_counted_once(tmp_path, monkeypatch):
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'fleet.db'}", connect_args={"check_same_thread": False}
+    )
+    models.Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine, expire_on_commit=False)
+    db = Session()
+    seed_machines(db)
+    utils.stock_machine_slot(db, 1, "A1", 1, 4)
+    db.commit()
+    fleet_stock.load(db)
+
+    committed = threading.Event()
+
+    def restock():
+        other = Session()
+        utils.stock_machine_slot(other, 2, "A1", 1, 6)
+        other.commit()
+        other.close()
+        committed.set()
+
+    read = FleetStock._read
+
+    def read_while_restocking(db):
+        writer = threading.Thread(target=restock)
+        writer.start()
+        # held until the slots are read, then applied on top of the new totals
+        assert not committed.wait(0.2)
+        return read(db)
+
+    monkeypatch.setattr(FleetStock, "_read", staticmethod(read_while_restocking))
+    assert fleet_stock.load(db) == {1: 4}
+    assert committed.wait(5)
+    assert fleet_stock.total(db, 1) == 10
+
+    db.close()
+    engine.dispose()
+
+
+def test_changes_of_other_workers_already_loaded_are_skipped(db, monkeypatch):
+    monkeypatch.setattr(change_feed, "enabled", True)
+    seed_machines(db)
+    utils.stock_machine_slot(db, 1, "A1", 1, 4)
+    db.commit()
+    (row_id,) = (
+        db.query(models.ChangeLog.id).filter(models.ChangeLog.topic == "fleet").one()
+    )
+
+    # another worker loading after the commit, before polling the change log
+    other = FleetStock()
+    assert other.total(db, 1) == 4
+    other.apply(1, 4, log_id=row_id)
+    assert other.total(db, 1) == 4
+    other.apply(1, 2, log_id=row_id + 1)
+    assert other.total(db, 1) == 6
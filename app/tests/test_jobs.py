@@ -0,0 +1,155 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.orm import sessionmaker
+from starlette import status
+
+from core import jobs, models, utils
+from core.jobs import LOW_STOCK
+from tests.factories import make_product, make_user
+from tests.test_api import login
+
+
+def test_deposits_unchanged_for_long_are_stale(db):
+    long_ago = datetime.utcnow() - timedelta(days=30)
+    for username in ("idle", "active", "spender"):
+        db.add(
+            models.User(
+                username=username,
+                password="x",
+                deposit=50,
+                role="buyer",
+                deposit_updated_at=long_ago,
+            )
+        )
+    db.add(models.User(username="empty", password="x", deposit=0, role="buyer"))
+    db.commit()
+
+    utils.update_user_deposit(db, "active", 60)
+    utils.take_user_deposit(db, utils.get_user(db, "spender").id, 10)
+    db.commit()
+
+    stale = utils.get_stale_deposits(db, datetime.utcnow() - timedelta(days=7))
+    assert [(username, deposit) for username, deposit, _ in stale] == [("idle", 50)]
+
+
+def test_stale_deposits_are_read_from_the_index(db, engine):
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, many):
+        statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        utils.get_stale_deposits(db, datetime.utcnow())
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+
+    ((statement, parameters),) = statements
+    with engine.connect() as connection:
+        plan = connection.exec_driver_sql(
+            "EXPLAIN QUERY PLAN " + statement, parameters
+        ).all()
+    # neither a scan of all the users nor a sort of the buyers
+    (detail,) = [detail for *_, detail in plan]
+    assert detail.startswith("SEARCH")
+    assert "USING INDEX ix_user_role_deposit_updated_at" in detail
+
+
+def test_low_stock_is_notified_once_until_restocked(db, engine, monkeypatch):
+    monkeypatch.setattr(jobs, "SessionLocal", sessionmaker(bind=engine))
+    seller = make_user(db, role="seller")
+    cola = make_product(db, seller, amount_available=2)
+    make_product(db, seller, amount_available=9)
+
+    jobs.notify_low_stock()
+    jobs.notify_low_stock()
+    assert utils.get_notification_keys(db, LOW_STOCK) == {(seller.id, str(cola.id))}
+    assert db.query(models.Notification).count() == 1
+
+    cola.amount_available = 20
+    db.commit()
+    jobs.notify_low_stock()
+    assert utils.get_notification_keys(db, LOW_STOCK) == set()
+
+
+def test_low_stock_notified_by_another_worker_is_left_alone(db, engine, monkeypatch):
+    monkeypatch.setattr(jobs, "SessionLocal", sessionmaker(bind=engine))
+    seller = make_user(db, role="seller")
+    make_product(db, seller, amount_available=1)
+    jobs.notify_low_stock()
+
+    # the other worker committed its notification once this one read them
+    monkeypatch.setattr(utils, "get_notification_keys", lambda db, kind: set())
+    jobs.notify_low_stock()
+    monkeypatch.undo()
+
+    assert db.query(models.Notification).count() == 1
+
+
+def test_cleanup_keeps_the_alerts_of_products_still_low(db):
+    db.add(models.User(id=1, username="seller", password="x", role="seller"))
+    db.add(models.Product(id=1, product_name="Cola", amount_available=1, seller_id=1))
+    db.add(models.Product(id=2, product_name="Fanta", amount_available=9, seller_id=1))
+    long_ago = datetime.utcnow() - timedelta(days=60)
+    for kind, key in ((LOW_STOCK, "1"), (LOW_STOCK, "2"), ("other", "1")):
+        db.add(
+            models.Notification(
+                user_id=1, kind=kind, key=key, message="", created_at=long_ago
+            )
+        )
+    db.commit()
+
+    removed = utils.remove_notifications_before(
+        db,
+        datetime.utcnow() - timedelta(days=30),
+        low_stock_kind=LOW_STOCK,
+        low_stock_threshold=3,
+    )
+    db.commit()
+
+    assert removed == 2
+    assert utils.get_notification_keys(db, LOW_STOCK) == {(1, "1")}
+
+
+def test_schema_of_an_older_database_is_upgraded():
+    engine = create_engine("sqlite://")
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            'CREATE TABLE "user" (id INTEGER PRIMARY KEY, username VARCHAR, '
+            "password VARCHAR, deposit INTEGER, role VARCHAR)"
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO \"user\" VALUES (1, 'buyer', 'x', 5, 'buyer')"
+        )
+
+    models.create_schema(engine)
+
+    columns = {column["name"] for column in inspect(engine).get_columns("user")}
+    assert "deposit_updated_at" in columns
+    indexes = {index["name"] for index in inspect(engine).get_indexes("user")}
+    assert "ix_user_role_deposit_updated_at" in indexes
+    db = sessionmaker(bind=engine)()
+    assert utils.get_user(db, "buyer").deposit_updated_at is not None
+    db.close()
+    engine.dispose()
+
+
+def test_schema_of_a_database_file_uses_wal(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'my_db'}")
+    models.create_schema(engine)
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+    engine.dispose()
+
+
+def test_jobs_status_is_for_admins(client, db):
+    buyer = make_user(db)
+    admin = make_user(db, role="admin")
+
+    assert client.get("/jobs").status_code == status.HTTP_401_UNAUTHORIZED
+    response = client.get("/jobs", auth=login(buyer))
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    response = client.get("/jobs", auth=login(admin))
+    assert response.status_code == status.HTTP_200_OK
+    assert "jobs" in response.json()
@@ -0,0 +1,48 @@
+from unittest.mock import patch
+
+from fastapi.security import HTTPBasicCredentials
+from starlette import status
+from starlette.testclient import TestClient
+
+from core.models import Machine, MachineSlot
+from main import app
+from product.views import security
+from tests.mocks import return_get_product_by_id, return_user_info
+
+
+def override_dependency():
+    return HTTPBasicCredentials(username="test", password="test")
+
+
+app.dependency_overrides[security] = override_dependency
+
+
+def test_stock_slot_holding_a_product_of_another_seller(test_client: TestClient):
+    products = {
+        1: return_get_product_by_id("Cola", 10, 5, 1),
+        2: return_get_product_by_id("Fanta", 10, 5, 2),
+    }
+    with patch(
+        "core.utils.get_user", return_value=return_user_info(1, "test", 0, "seller")
+    ), patch(
+        "machine.views.utils.get_machine", return_value=Machine(id=1, name="m1")
+    ), patch(
+        "machine.views.utils.get_product_by_id",
+        side_effect=lambda db, product_id: products.get(product_id),
+    ), patch(
+        "machine.views.utils.get_machine_slot",
+        return_value=MachineSlot(
+            machine_id=1, slot="A1", product_id=2, amount_available=3
+        ),
+    ), patch(
+        "machine.views.utils.stock_machine_slot"
+    ) as stock_machine_slot:
+        response = test_client.put(
+            "/machine/1/slot/A1", json={"product_id": 1, "amount_available": 4}
+        )
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert (
+        response.json()["detail"] == "Slot is stocked with a product of another seller"
+    )
+    stock_machine_slot.assert_not_called()
@@ -0,0 +1,252 @@
+import threading
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from core import utils
+from core.events import event_bus
+from core.memory import InMemoryRepository, InMemoryStore
+from core.repository import (
+    PurchaseConflict,
+    SqlAlchemyRepository,
+    UsernameTaken,
+    WriteConflict,
+)
+from product.serializers import ProductCreate
+from user.serializers import UserBase, User
+
+
+@pytest.fixture(params=["memory", "sqlalchemy"])
+def repo(request, db):
+    if request.param == "memory":
+        return InMemoryRepository(InMemoryStore())
+    return SqlAlchemyRepository(db)
+
+
+def seed(repo):
+    seller = repo.create_user(
+        User(username="seller", password="pass", deposit=0, role="seller")
+    )
+    buyer = repo.create_user(
+        User(username="buyer", password="pass", deposit=100, role="buyer")
+    )
+    product = repo.create_user_product(
+        ProductCreate(product_name="Cola", amount_available=10, cost=5), seller.id
+    )
+    repo.commit()
+    return seller, buyer, product
+
+
+def test_backends_behave_the_same(repo):
+    seller, buyer, product = seed(repo)
+
+    password = utils.hash_password("pass")
+    assert repo.authenticate_user("buyer", password, buyer_requester=True)[0]
+    assert repo.authenticate_user("buyer", "pass")[1] == 401
+    assert repo.authenticate_user("seller", password, buyer_requester=True)[1] == 400
+
+    assert repo.purchase(buyer, product, 3) == 85
+    repo.commit()
+    assert repo.get_user("buyer").deposit == 85
+    assert repo.get_product_by_id(product.id).amount_available == 7
+
+    renamed = repo.update_product(
+        "Cola",
+        seller.id,
+        ProductCreate(product_name="Fanta", amount_available=2, cost=10),
+    )
+    repo.commit()
+    assert (renamed.product_name, renamed.amount_available) == ("Fanta", 2)
+    assert repo.get_all_products("Cola") == []
+    assert [p.id for p in repo.get_all_products("Fanta")] == [product.id]
+
+    updated = repo.update_user(
+        "buyer", UserBase(username="buyer", password="x", deposit=5, role="buyer")
+    )
+    assert updated.deposit == 5
+    assert repo.remove_product("Fanta", seller.id) == 1
+    assert repo.remove_user("buyer") == 1
+    repo.commit()
+    assert repo.get_product_by_id(product.id) is None
+    assert repo.get_user("buyer") is None
+
+
+def test_stale_deposits_are_not_written(repo, db):
+    seed(repo)
+    buyer = repo.get_user("buyer")
+    if isinstance(repo, InMemoryRepository):
+        other = InMemoryRepository(repo.store)
+    else:
+        other = SqlAlchemyRepository(sessionmaker(bind=db.get_bind())())
+    other.get_user("buyer")
+    other.update_user_deposit("buyer", 150)
+    other.commit()
+
+    with pytest.raises(WriteConflict):
+        repo.update_user_deposit("buyer", buyer.deposit + 5)
+    with pytest.raises(PurchaseConflict):
+        repo.purchase(buyer, repo.get_product_by_id(1), 31)
+    assert other.get_user("buyer").deposit == 150
+    if isinstance(other, SqlAlchemyRepository):
+        other.db.close()
+
+
+def test_a_username_registered_meanwhile_is_taken(repo):
+    seed(repo)
+
+    # the view checked the username before another request registered it
+    with pytest.raises(UsernameTaken):
+        repo.create_user(
+            User(username="buyer", password="pass", deposit=0, role="buyer")
+        )
+    repo.create_user(User(username="new", password="pass", deposit=0, role="buyer"))
+    repo.commit()
+    assert repo.get_user("buyer").deposit == 100
+    assert repo.get_user("new") is not None
+
+
+def test_memory_reads_are_copies():
+    repo = InMemoryRepository(InMemoryStore())
+    _, buyer, _ = seed(repo)
+    buyer.deposit = 0
+    assert repo.get_user("buyer").deposit == 100
+
+
+def test_memory_events_wait_for_commit():
+    repo = InMemoryRepository(InMemoryStore())
+    seq = event_bus.seq
+    seed(repo)
+    assert event_bus.seq == seq + 1
+
+    repo.update_product_amount_available_by_id(1, 3)
+    assert event_bus.seq == seq + 1
+    repo.commit()
+    assert event_bus.seq == seq + 2
+
+
+def test_memory_purchases_never_oversell():
+    store = InMemoryStore()
+    _, buyer, product = seed(InMemoryRepository(store))
+    results = []
+
+    def buy():
+        repo = InMemoryRepository(store)
+        try:
+            # every buyer checked the same stale copies
+            results.append(repo.purchase(buyer, product, 3))
+        except PurchaseConflict:
+            results.append(None)
+        repo.commit()
+
+    threads = [threading.Thread(target=buy) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    repo = InMemoryRepository(store)
+    assert len([r for r in results if r is not None]) == 3
+    assert repo.get_product_by_id(product.id).amount_available == 1
+    assert repo.get_user("buyer").deposit == 55
+
+
+def test_memory_writes_wait_for_commit():
+    store = InMemoryStore()
+    repo = InMemoryRepository(store)
+    seed(repo)
+    other = InMemoryRepository(store)
+
+    repo.update_product_amount_available_by_id(1, 3)
+    repo.create_user(User(username="new", password="pass", deposit=0, role="buyer"))
+    # the transaction reads its own writes, the others don't see them yet
+    assert repo.get_product_by_id(1).amount_available == 3
+    assert other.get_product_by_id(1).amount_available == 10
+    assert other.get_user("new") is None
+
+    repo.commit()
+    assert other.get_product_by_id(1).amount_available == 3
+    assert other.get_user("new") is not None
+
+
+def test_memory_rollback_drops_the_writes():
+    store = InMemoryStore()
+    repo = InMemoryRepository(store)
+    seed(repo)
+
+    repo.remove_product("Cola", 1)
+    repo.update_user_deposit("buyer", 0)
+    repo.rollback()
+    repo.commit()
+
+    assert repo.get_product_by_id(1).amount_available == 10
+    assert repo.get_user("buyer").deposit == 100
+
+
+def test_memory_writers_of_a_row_wait_for_each_other():
+    store = InMemoryStore(lock_timeout=0.05)
+    repo = InMemoryRepository(store)
+    seed(repo)
+    other = InMemoryRepository(store)
+
+    repo.update_product_amount_available_by_id(1, 3)
+    with pytest.raises(WriteConflict):
+        other.update_product_amount_available_by_id(1, 4)
+    # a row nobody writes to is free
+    other.get_user("buyer")
+    other.update_user_deposit("buyer", 5)
+    other.commit()
+
+    repo.commit()
+    assert other.update_product_amount_available_by_id(1, 4).amount_available == 4
+
+
+def test_bulk_operations_behave_the_same(repo):
+    seller, buyer, product = seed(repo)
+    repo.create_user(User(username="rich", password="pass", deposit=500, role="buyer"))
+    repo.commit()
+
+    assert repo.reset_deposits(min_deposit=200) == {"rich": utils.RESET}
+    assert repo.reset_deposits(["buyer", "seller", "ghost"]) == {
+        "buyer": utils.RESET,
+        "seller": utils.NOT_BUYER,
+        "ghost": utils.NOT_FOUND,
+    }
+    assert repo.change_roles(["rich", "seller", "ghost"], "seller") == {
+        "rich": utils.UPDATED,
+        "seller": utils.UNCHANGED,
+        "ghost": utils.NOT_FOUND,
+    }
+    repo.commit()
+    assert repo.get_user("buyer").deposit == 0
+    assert repo.get_user("rich").role == "seller"
+
+    assert repo.remove_users(["seller", "ghost"]) == {
+        "seller": utils.DELETED,
+        "ghost": utils.NOT_FOUND,
+    }
+    repo.commit()
+    assert repo.get_user("seller") is None
+    # the products of the seller are removed with it
+    assert repo.get_product_by_id(product.id) is None
+    assert repo.get_all_products("Cola") == []
+
+
+def test_memory_rows_share_a_fixed_number_of_locks():
+    store = InMemoryStore(lock_timeout=0.05, lock_stripes=1)
+    repo = InMemoryRepository(store)
+    seed(repo)
+    for index in range(100):
+        repo.create_user(
+            User(username=f"user-{index}", password="pass", deposit=0, role="buyer")
+        )
+    repo.commit()
+    assert len(store.row_locks) == 1
+
+    # a transaction writing rows on the same lock takes it once
+    repo.update_user_deposit("buyer", 5)
+    repo.update_product_amount_available_by_id(1, 3)
+    other = InMemoryRepository(store)
+    with pytest.raises(WriteConflict):
+        other.update_user_deposit("seller", 5)
+    repo.commit()
+    assert other.update_user_deposit("seller", 5).deposit == 5
@@ -126,3 +126,20 @@ def test_buy_product_only_one_product_available(test_client: TestClient):
             request = test_client.get("/buy", params=return_product_and_amount(1, 2))
             assert request.json()["detail"] == "Only 1 pcs available"
             assert request.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_buy_product_amount_not_positive(test_client: TestClient):
+    with patch(
+        "core.utils.get_user",
+        return_value=return_user_info(1, "test", 150, BUYER_ROLE),
+    ):
+        with patch(
+            "product.views.utils.get_product_by_id",
+            return_value=return_get_product_by_id("Cola", 10, 5, 1),
+        ):
+            for amount in (0, -2):
+                request = test_client.get(
+                    "/buy", params=return_product_and_amount(1, amount)
+                )
+                assert request.json()["detail"] == "Amount must be positive"
+                assert request.status_code == status.HTTP_400_BAD_REQUEST
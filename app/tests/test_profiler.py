@@ -0,0 +1,81 @@
+import json
+import os
+import time
+
+from fastapi import Depends, FastAPI
+from pydantic import BaseModel, validator
+from starlette.testclient import TestClient
+
+from core.profiler import ProfilerMiddleware
+
+
+class SlowModel(BaseModel):
+    name: str
+
+    @validator("name")
+    def slow_validation(cls, value):
+        time.sleep(0.03)
+        return value
+
+
+def slow_dependency():
+    time.sleep(0.03)
+
+
+def build_app(output_dir: str) -> FastAPI:
+    profiled_app = FastAPI()
+
+    @profiled_app.get("/slow/{name}")
+    def slow(name: str):
+        time.sleep(0.05)
+        return {"name": name}
+
+    @profiled_app.get("/validated/{name}", response_model=SlowModel)
+    def validated(name: str, _=Depends(slow_dependency)):
+        return {"name": name}
+
+    profiled_app.add_middleware(
+        ProfilerMiddleware, output_dir=output_dir, token="secret", interval=0.001
+    )
+    return profiled_app
+
+
+def test_profile_is_saved_for_requests_with_the_token(tmp_path):
+    client = TestClient(build_app(str(tmp_path)))
+
+    response = client.get("/slow/cola", headers={"X-Profile": "secret"})
+    assert response.json() == {"name": "cola"}
+
+    files = sorted(os.listdir(tmp_path))
+    assert [name.split(".", 1)[1] for name in files] == [
+        "folded",
+        "meta.json",
+        "speedscope.json",
+    ]
+    meta = json.loads((tmp_path / files[1]).read_text())
+    assert meta["route"] == "/slow/{name}"
+    assert meta["status"] == 200
+    assert meta["latency_ms"] >= 50
+    # the sync endpoint runs in the thread pool, its samples are kept too
+    assert "slow (test_profiler.py" in (tmp_path / files[0]).read_text()
+
+
+def test_dependencies_and_response_validation_are_sampled(tmp_path):
+    client = TestClient(build_app(str(tmp_path)))
+
+    client.get("/validated/cola", headers={"X-Profile": "secret"})
+
+    (folded,) = [name for name in os.listdir(tmp_path) if name.endswith(".folded")]
+    stacks = (tmp_path / folded).read_text()
+    # both run in the thread pool, outside of the endpoint function
+    assert "slow_dependency (test_profiler.py" in stacks
+    assert "slow_validation (test_profiler.py" in stacks
+
+
+def test_requests_without_the_token_are_not_profiled(tmp_path):
+    client = TestClient(build_app(str(tmp_path)))
+
+    client.get("/slow/cola")
+    client.get("/slow/cola", headers={"X-Profile": "wrong"})
+
+    assert os.listdir(tmp_path) == []
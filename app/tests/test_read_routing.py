@@ -0,0 +1,76 @@
+import base64
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from starlette.requests import Request
+
+from core import database, models
+from core.database import ReadYourWrites, get_read_db, read_only_url
+
+
+def request_as(username: str) -> Request:
+    credentials = base64.b64encode(f"{username}:secret".encode()).decode()
+    return Request(
+        {
+            "type": "http",
+            "headers": [(b"authorization", f"Basic {credentials}".encode())],
+        }
+    )
+
+
+@pytest.fixture
+def engines(tmp_path, monkeypatch):
+    """
+    Primary and read-only engines on one database file, like `core.database` builds
+    them for `my_db`, the tests themselves run on an in-memory database
+    """
+    url = f"sqlite:///{tmp_path / 'my_db'}"
+    primary = create_engine(url)
+    models.Base.metadata.create_all(bind=primary)
+    reader = create_engine(read_only_url(url))
+    monkeypatch.setattr(database, "SessionLocal", sessionmaker(bind=primary))
+    monkeypatch.setattr(database, "ReadSessionLocal", sessionmaker(bind=reader))
+    yield primary, reader
+    reader.dispose()
+    primary.dispose()
+
+
+def test_read_only_url_of_a_sqlite_file():
+    assert read_only_url("sqlite:///my_db") == "sqlite:///file:my_db?mode=ro&uri=true"
+
+
+def test_read_only_url_is_unknown_for_memory_and_other_databases():
+    assert read_only_url("sqlite://") is None
+    assert read_only_url("postgresql://localhost/vending") is None
+
+
+def test_writers_stay_on_the_primary_for_a_while():
+    writes = ReadYourWrites(window=60)
+    writes.touch("test")
+
+    assert writes.is_sticky("test")
+    assert not writes.is_sticky("other")
+    assert not writes.is_sticky(None)
+    assert not ReadYourWrites(window=0).is_sticky("test")
+
+
+def test_reads_go_to_the_read_engine_unless_the_user_just_wrote(engines):
+    primary, reader = engines
+    database.read_your_writes.touch("writer")
+
+    reader_db = next(get_read_db(request_as("reader")))
+    writer_db = next(get_read_db(request_as("writer")))
+
+    assert reader_db.get_bind() is reader
+    assert writer_db.get_bind() is primary
+
+    writer_db.add(models.User(username="writer", password="x", role="buyer"))
+    writer_db.commit()
+    assert reader_db.query(models.User.username).all() == [("writer",)]
+    reader_db.add(models.User(username="reader", password="x", role="buyer"))
+    with pytest.raises(OperationalError, match="readonly"):
+        reader_db.commit()
+    reader_db.close()
+    writer_db.close()
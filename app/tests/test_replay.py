@@ -0,0 +1,99 @@
+import json
+import os
+import subprocess
+import sys
+
+import replay
+from tests.factories import make_product, make_user
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def record(method, route, path, query="", user=None, body=None, status=200, t=0.0):
+    return {
+        "t": t,
+        "method": method,
+        "route": route,
+        "path": path,
+        "query": query,
+        "user": user,
+        "body": body,
+        "status": status,
+        "duration_ms": 1.0,
+    }
+
+
+def test_captured_paths_are_replayed_as_sent(client, db):
+    seller = make_user(db, role="seller")
+    make_product(db, seller, product_name="100% Juice", amount_available=4)
+
+    result = replay.replay_one(
+        client,
+        0,
+        record("GET", "/product/{product_name}", "/product/100%25%20Juice"),
+    )
+
+    assert result["status"] == 200
+    assert [product["product_name"] for product in result["body"]] == ["100% Juice"]
+
+
+def test_a_small_capture_is_replayed_against_a_seeded_build(tmp_path):
+    seed = {
+        "users": [
+            {"username": "ann", "role": "seller"},
+            {"username": "bob", "role": "buyer", "deposit": 20},
+        ],
+        "products": [
+            {
+                "product_name": "100% Juice",
+                "amount_available": 5,
+                "cost": 5,
+                "seller": "ann",
+            }
+        ],
+    }
+    capture = [
+        record("GET", "/product/{product_name}", "/product/100%25%20Juice"),
+        record(
+            "PUT",
+            "/deposit",
+            "/deposit",
+            user="bob",
+            body={"coin_value": 10},
+            t=0.01,
+        ),
+        record("GET", "/buy", "/buy", "product_id=1&amount=2", user="bob", t=0.02),
+        record("GET", "/buy", "/buy", "product_id=1&amount=9", "bob", status=400),
+    ]
+    (tmp_path / "seed.json").write_text(json.dumps(seed))
+    (tmp_path / "capture.jsonl").write_text(
+        "".join(json.dumps(line) + "\n" for line in capture)
+    )
+
+    output = subprocess.run(
+        [
+            sys.executable,
+            os.path.join(APP_DIR, "replay.py"),
+            str(tmp_path / "capture.jsonl"),
+            "--build",
+            APP_DIR,
+            "--seed",
+            str(tmp_path / "seed.json"),
+            "--speed",
+            "0",
+        ],
+        cwd=tmp_path,
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout
+    report = json.loads(output)
+
+    assert report["divergences"] == {"count": 0, "first": []}
+    (build,) = report["builds"].values()
+    assert build["latency_ms"]["count"] == len(capture)
+    assert set(build["latency_ms_by_route"]) == {
+        "GET /product/{product_name}",
+        "PUT /deposit",
+        "GET /buy",
+    }
@@ -0,0 +1,109 @@
+import asyncio
+import threading
+import time
+
+from core import jobs
+from core.scheduler import LeaderLock, Scheduler
+
+
+def run_scheduler(scheduler: Scheduler, during):
+    async def run():
+        await scheduler.start()
+        await during()
+        await scheduler.stop()
+
+    asyncio.run(run())
+
+
+def test_triggered_job_runs_in_the_background():
+    scheduler = Scheduler()
+    calls = []
+    scheduler.add_job("job", lambda: calls.append(threading.get_ident()))
+
+    async def during():
+        scheduler.trigger("job")
+        await asyncio.sleep(0.1)
+
+    run_scheduler(scheduler, during)
+
+    assert len(calls) == 1
+    assert calls[0] != threading.get_ident()
+    assert scheduler.status()["jobs"][0]["runs"] == 1
+
+
+def test_triggers_received_while_running_are_coalesced():
+    scheduler = Scheduler()
+    calls = []
+    scheduler.add_job("job", lambda: (calls.append(1), time.sleep(0.05)))
+
+    async def during():
+        scheduler.trigger("job")
+        await asyncio.sleep(0.01)
+        for _ in range(10):
+            scheduler.trigger("job")
+        await asyncio.sleep(0.2)
+
+    run_scheduler(scheduler, during)
+
+    assert len(calls) == 2
+
+
+def test_periodic_job_and_failures_are_reported():
+    scheduler = Scheduler()
+
+    def fail():
+        raise RuntimeError("boom")
+
+    scheduler.add_job("job", fail, interval=0.01)
+
+    async def during():
+        await asyncio.sleep(0.1)
+
+    run_scheduler(scheduler, during)
+
+    status = scheduler.status()["jobs"][0]
+    assert status["failures"] >= 2
+    assert "boom" in status["last_error"]
+
+
+def test_concurrency_is_bounded():
+    scheduler = Scheduler(max_concurrency=1)
+    running = []
+    overlaps = []
+
+    def job():
+        running.append(1)
+        overlaps.append(len(running))
+        time.sleep(0.02)
+        running.pop()
+
+    for name in ("first", "second", "third"):
+        scheduler.add_job(name, job)
+
+    async def during():
+        for name in ("first", "second", "third"):
+            scheduler.trigger(name)
+        await asyncio.sleep(0.2)
+
+    run_scheduler(scheduler, during)
+
+    assert overlaps == [1, 1, 1]
+
+
+def test_singleton_jobs_run_in_one_worker(tmp_path, monkeypatch):
+    path = str(tmp_path / "jobs.lock")
+    # the lock of each worker, the flock of another open file is another owner
+    first, second = LeaderLock(path), LeaderLock(path)
+    runs = []
+
+    monkeypatch.setattr(jobs, "leader", first)
+    jobs.in_leader(lambda: runs.append("first"))()
+    monkeypatch.setattr(jobs, "leader", second)
+    jobs.in_leader(lambda: runs.append("second"))()
+    assert runs == ["first"]
+
+    # the leader exited, another worker takes over
+    first.release()
+    jobs.in_leader(lambda: runs.append("second"))()
+    assert runs == ["first", "second"]
+    second.release()
@@ -0,0 +1,85 @@
+import threading
+import time
+
+import pytest
+
+from core.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    executions = []
+    release = threading.Event()
+
+    def query():
+        executions.append(1)
+        release.wait(1)
+        return ["Cola"]
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(flight.do("Cola", query)))
+        for _ in range(20)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(executions) == 1
+    assert results == [["Cola"]] * 20
+    assert flight.stats()["coalesced"] == 19
+
+
+def test_finished_result_is_shared_inside_stale_window():
+    flight = SingleFlight(stale_seconds=60)
+    assert flight.do("Cola", lambda: 1) == 1
+    assert flight.do("Cola", lambda: 2) == 1
+
+    flight.forget("Cola")
+    assert flight.do("Cola", lambda: 3) == 3
+
+
+def test_finished_result_is_not_shared_without_stale_window():
+    flight = SingleFlight()
+    assert flight.do("Cola", lambda: 1) == 1
+    assert flight.do("Cola", lambda: 2) == 2
+    assert flight.stats()["coalescing_ratio"] == 0
+
+
+def test_forget_stops_sharing_a_call_in_flight():
+    flight = SingleFlight(stale_seconds=60)
+    release = threading.Event()
+    versions = iter(["before write", "after write"])
+
+    def query():
+        version = next(versions)
+        if version == "before write":
+            release.wait(1)
+        return version
+
+    first = []
+    reader = threading.Thread(target=lambda: first.append(flight.do("Cola", query)))
+    reader.start()
+    time.sleep(0.05)
+    # the write commits while the first read is still running
+    flight.forget("Cola")
+    assert flight.do("Cola", query) == "after write"
+    release.set()
+    reader.join()
+
+    assert first == ["before write"]
+    assert flight.do("Cola", query) == "after write"
+
+
+def test_errors_are_not_cached():
+    flight = SingleFlight(stale_seconds=60)
+
+    def fail():
+        raise RuntimeError("db is gone")
+
+    with pytest.raises(RuntimeError):
+        flight.do("Cola", fail)
+    assert flight.do("Cola", lambda: 1) == 1
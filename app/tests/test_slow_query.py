@@ -0,0 +1,80 @@
+import json
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from core import utils, models
+from core.slow_query import SlowQueryLog
+
+
+def run_queries(tmp_path, max_per_second=100, max_explained=1000):
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(bind=engine)
+    log_path = tmp_path / "slow.jsonl"
+    slow_log = SlowQueryLog(
+        str(log_path),
+        threshold_ms=0,
+        max_per_second=max_per_second,
+        max_explained=max_explained,
+    )
+    slow_log.install(engine)
+
+    db = sessionmaker(bind=engine)()
+    utils.get_product_for_user(db, "Cola", 1)
+    utils.get_product_for_user(db, "Fanta", 1)
+    utils.get_user(db, "test")
+    db.close()
+    engine.dispose()
+
+    slow_log.close()
+    return [json.loads(line) for line in log_path.read_text().splitlines()]
+
+
+def test_slow_queries_are_logged_with_caller_and_parameters(tmp_path):
+    records = run_queries(tmp_path)
+    products = [r for r in records if r["function"] == "get_product_for_user"]
+
+    assert len(products) == 2
+    assert products[0]["parameters"]["product_name_1"] == "Cola"
+    assert products[0]["parameters"]["seller_id_1"] == 1
+    assert products[0]["duration_ms"] >= 0
+    assert products[0]["route"] is None
+
+
+def test_query_plan_is_only_captured_on_first_sighting(tmp_path):
+    records = run_queries(tmp_path)
+    products = [r for r in records if r["function"] == "get_product_for_user"]
+
+    assert any("product" in step for step in products[0]["query_plan"])
+    assert "query_plan" not in products[1]
+
+
+def test_slow_query_log_is_rate_limited(tmp_path):
+    records = run_queries(tmp_path, max_per_second=1)
+
+    assert len(records) == 1
+
+
+def test_no_query_plan_once_max_explained_is_reached(tmp_path):
+    records = run_queries(tmp_path, max_explained=1)
+    products = [r for r in records if r["function"] == "get_product_for_user"]
+    users = [r for r in records if r["function"] == "get_user"]
+
+    assert "query_plan" in products[0]
+    assert "query_plan" not in products[1]
+    assert "query_plan" not in users[0]
+
+
+def test_failed_statements_do_not_leave_their_start_time(tmp_path):
+    engine = create_engine("sqlite://")
+    slow_log = SlowQueryLog(str(tmp_path / "slow.jsonl"), threshold_ms=0)
+    slow_log.install(engine)
+
+    with engine.connect() as conn:
+        with pytest.raises(OperationalError):
+            conn.exec_driver_sql("SELECT * FROM missing")
+        assert conn.connection.info["slow_query_started"] == []
+
+    slow_log.close()
@@ -35,7 +35,7 @@ def test_buyer_user_deposit_coin(test_client: TestClient):
         "core.utils.get_user",
         return_value=return_user_info(1, "test", user_actual_deposit, BUYER_ROLE),
     ):
-        with patch("user.views.utils.update_user_deposit") as deposit_mock:
+        with patch("core.utils.update_user_deposit") as deposit_mock:
             test_client.put("/deposit", json=get_mock_coin_value(5))
             assert deposit_mock.call_args[0][1] == "test"
             assert deposit_mock.call_args[0][2] == total_coins
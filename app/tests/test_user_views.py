@@ -37,3 +37,23 @@ def test_read_user(test_client: TestClient):
         request = test_client.get(f"/user/{USERNAME}")
         assert request.status_code == status.HTTP_200_OK
         assert request.json()["username"] == "test"
+
+
+def test_bulk_reset_needs_usernames_or_a_filter(test_client: TestClient):
+    with patch(
+        "core.utils.get_user", return_value=return_user_info(1, "test", 0, "admin")
+    ):
+        request = test_client.put("/admin/users/reset", json={})
+        assert request.status_code == status.HTTP_400_BAD_REQUEST
+        assert request.json()["detail"] == "Give the usernames or a deposit filter"
+
+
+def test_bulk_operations_are_for_admins(test_client: TestClient):
+    with patch(
+        "core.utils.get_user", return_value=return_user_info(1, "test", 0, BUYER_ROLE)
+    ):
+        request = test_client.post(
+            "/admin/users/delete", json={"usernames": ["someone"]}
+        )
+        assert request.status_code == status.HTTP_400_BAD_REQUEST
+        assert request.json()["detail"] == "You should be admin to access this endpoint"
@@ -1,59 +1,52 @@
 from fastapi import Depends, HTTPException, APIRouter
-from fastapi.security import HTTPBasicCredentials, HTTPBasic
-from sqlalchemy.orm import Session
-
-from core import utils
-from core.database import SessionLocal
-from user.serializers import UserBase, CoinValue, User
 
+# `security` is re-exported, overriding it overrides the credentials of every view
+from core.auth import require_admin, require_read_user, require_user, security
+from core.repository import Repository, UsernameTaken, WriteConflict
+from core.storage import get_repository, get_read_repository
+from user.serializers import CoinValue, User, UserBase
 
 router = APIRouter()
-security = HTTPBasic()
-
-
-# Dependency
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
 
 
 @router.post("/user", response_model=User)
-def create_user(user: User, db: Session = Depends(get_db)):
+def create_user(user: User, repo: Repository = Depends(get_repository)):
     """
     Create a user
     :param user: user model info
-    :param db: database session
+    :param repo: users and products storage
     :return: created user info
     """
-    db_user = utils.get_user(db, username=user.username)
+    db_user = repo.get_user(username=user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
-    return utils.create_user(db=db, user=user)
+    try:
+        db_user = repo.create_user(user=user)
+    except UsernameTaken:
+        # registered by a request running at the same time
+        raise HTTPException(status_code=400, detail="Username already registered")
+    repo.commit()
+    return db_user
 
 
 @router.get("/user/{username}", response_model=User)
 def read_user(
     username: str,
-    db: Session = Depends(get_db),
-    credentials: HTTPBasicCredentials = Depends(security),
+    repo: Repository = Depends(get_read_repository),
+    auth_user=Depends(require_read_user),
 ):
     """
     Get a user detail
-    :param credentials:
     :param username: user name
-    :param db: database session
+    :param repo: users and products storage
+    :param auth_user: the logged user
     :return: user info
     """
-    # first check if the credentials are ok
-    auth_user = utils.authenticate_user(db, credentials.username, credentials.password)
-    if not auth_user[0]:
-        raise HTTPException(status_code=auth_user[1], detail=auth_user[2])
+    if username == auth_user.username:
+        return auth_user
 
     # get username user details
-    db_user = utils.get_user(db, username=username)
+    db_user = repo.get_user(username=username)
     if db_user is None:
         raise HTTPException(status_code=400, detail="User not found")
     return db_user
@@ -62,31 +55,23 @@ def read_user(
 @router.delete("/user/{username}")
 def remove_user(
     username: str,
-    db: Session = Depends(get_db),
-    credentials: HTTPBasicCredentials = Depends(security),
+    repo: Repository = Depends(get_repository),
+    auth_user=Depends(require_admin),
 ):
     """
     Here i didn't know who can remove users so i've created another role called `admin`, which is kinda superuser
     :param username: username to remove
-    :param db: db Session
-    :param credentials: basic auth credentials
+    :param repo: users and products storage
+    :param auth_user: the logged admin
     :return: removed user details
     """
-    # first check if the credentials are ok and if it's admin
-    auth_user = utils.authenticate_user(
-        db, credentials.username, credentials.password, admin_requester=True
-    )
-    if not auth_user[0]:
-        if (auth_status_code := auth_user[1]) == 401:
-            raise HTTPException(status_code=auth_status_code, detail=auth_user[2])
-        raise HTTPException(status_code=auth_user[1], detail=auth_user[2])
-
     # get user details
-    db_user = utils.get_user(db, username=username)
+    db_user = repo.get_user(username=username)
     if db_user is None:
         raise HTTPException(status_code=400, detail="User not found.")
 
-    utils.remove_user(db, username)
+    repo.remove_user(username)
+    repo.commit()
     return db_user
 
 
@@ -94,90 +79,85 @@ def remove_user(
 def update_user(
     username: str,
     new_user_details: UserBase,
-    db: Session = Depends(get_db),
-    credentials: HTTPBasicCredentials = Depends(security),
+    repo: Repository = Depends(get_repository),
+    auth_user=Depends(require_user),
 ):
     """
     Update users info
     :param username: username to update info
     :param new_user_details: new user details to add
-    :param db: database Session
-    :param credentials: basic auth credentials
+    :param repo: users and products storage
+    :param auth_user: the logged user
     :return:
     """
-    # first check if the credentials are ok
-    if not utils.authenticate_user(db, credentials.username, credentials.password):
-        raise HTTPException(
-            status_code=401, detail="Wrong credentials. Please try again"
-        )
-
-    # check for the user
-    db_user = utils.get_user(db, username=username)
-    if not db_user:
-        raise HTTPException(status_code=400, detail="Username can't be found")
-
-    if db_user.username != credentials.username:
+    if username != auth_user.username:
+        # check for the user
+        if not repo.get_user(username=username):
+            raise HTTPException(status_code=400, detail="Username can't be found")
         raise HTTPException(
             status_code=401, detail="Sorry but you can't update someone else info"
         )
 
-    return utils.update_user(db, username, new_user_details)
+    db_user = repo.update_user(username, new_user_details)
+    repo.commit()
+    return db_user
 
 
 @router.put("/deposit")
 def deposit_coin(
     coin_value: CoinValue,
-    db: Session = Depends(get_db),
-    credentials: HTTPBasicCredentials = Depends(security),
+    repo: Repository = Depends(get_repository),
+    auth_user=Depends(require_user),
 ):
     """
 
     :param coin_value: how many coins to deposit
-    :param db: database session
-    :param credentials: user credentials
+    :param repo: users and products storage
+    :param auth_user: the logged user
     :return: new details for the user
     """
-    # first check if the credentials are ok
-    user_auth = utils.authenticate_user(db, credentials.username, credentials.password)
-    if not user_auth[0]:
+    if auth_user.role != "buyer":
         raise HTTPException(
-            status_code=401, detail="Wrong credentials. Please try again"
+            status_code=401, detail="You have to be a buyer to be able to deposit"
         )
-
-    if user_auth[1].role != "buyer":
+    new_deposit_value = coin_value.coin_value + auth_user.deposit
+    try:
+        # the logged user is reused, not loaded again
+        db_user = repo.update_user_deposit(auth_user.username, new_deposit_value)
+    except WriteConflict:
         raise HTTPException(
-            status_code=401, detail="You have to be a buyer to be able to deposit"
+            status_code=409, detail="Your deposit changed meanwhile. Please try again"
         )
-    new_deposit_value = coin_value.coin_value + user_auth[1].deposit
-    return utils.update_user_deposit(db, user_auth[1].username, new_deposit_value)
+    repo.commit()
+    return db_user
 
 
 @router.put("/reset")
 def reset_buyer_deposit_to_zero(
     username: str,
-    db: Session = Depends(get_db),
-    credentials: HTTPBasicCredentials = Depends(security),
+    repo: Repository = Depends(get_repository),
+    auth_user=Depends(require_user),
 ):
     """
     Reset buyer deposit to zero
     :param username: username
-    :param db: db session
-    :param credentials: credentials
+    :param repo: users and products storage
+    :param auth_user: the logged user
     :return: user info
     """
-    # first check if the credentials are ok
-    user_auth = utils.authenticate_user(db, credentials.username, credentials.password)
-    if not user_auth[0]:
-        raise HTTPException(
-            status_code=401, detail="Wrong credentials. Please try again"
-        )
-
-    if user_auth[1].username != username:
+    if auth_user.username != username:
         raise HTTPException(
             status_code=400, detail="Sorry but you can't reset someone else deposit"
         )
 
-    if user_auth[1].role != "buyer":
+    if auth_user.role != "buyer":
         raise HTTPException(status_code=400, detail="Sorry but you have to be a buyer")
 
-    return utils.update_user_deposit(db, username, 0)
+    try:
+        db_user = repo.update_user_deposit(username, 0)
+    except WriteConflict:
+        raise HTTPException(
+            status_code=409, detail="Your deposit changed meanwhile. Please try again"
+        )
+    repo.commit()
+    return db_user